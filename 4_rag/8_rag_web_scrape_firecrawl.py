@@ -1,10 +1,12 @@
+import functools
 import os
 
 from dotenv import load_dotenv
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.document_loaders import FireCrawlLoader
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
+
+from utils.crawl_cache import CrawlCache, FirecrawlFetcher, LocalFileFetcher, load_and_split_page
+from utils.embedding_cache import create_cached_embeddings
+from utils.incremental_index import sync_vector_store
+from utils.vectorstore_registry import get_shared_vectorstore
 
 # 從 .env 載入環境變數
 load_dotenv()
@@ -13,63 +15,57 @@ load_dotenv()
 current_dir = os.path.dirname(os.path.abspath(__file__))
 db_dir = os.path.join(current_dir, "db")
 persistent_directory = os.path.join(db_dir, "chroma_db_firecrawl")
+crawl_cache_directory = os.path.join(db_dir, "crawl_cache_firecrawl")
+
+# 要爬取的網址（以逗號分隔）
+CRAWL_URLS = [url.strip() for url in os.getenv("FIRECRAWL_URLS", "https://apple.com").split(",") if url.strip()]
+
+# 設定本地目錄時以本地檔案模擬網站（離線測試，不呼叫 Firecrawl）
+CRAWL_LOCAL_DIR = os.getenv("RAG_CRAWL_LOCAL_DIR")
 
+SPLITTER_CONFIG = {"chunk_size": 1000, "chunk_overlap": 0}
+
+
+def get_fetcher():
+    """選擇抓取器：本地檔案或 Firecrawl"""
+    if CRAWL_LOCAL_DIR:
+        print(f"使用本地檔案模擬網站：{CRAWL_LOCAL_DIR}")
+        return LocalFileFetcher(CRAWL_LOCAL_DIR)
 
-def create_vector_store():
-    """爬取網站、分割內容、建立嵌入並持久化向量存儲。"""
     # 定義 Firecrawl API 金鑰
     api_key = os.getenv("FIRECRAWL_API_KEY")
     if not api_key:
         raise ValueError("未設定 FIRECRAWL_API_KEY 環境變數")
+    return FirecrawlFetcher(api_key=api_key, mode="scrape")
+
 
-    # 步驟 1：使用 FireCrawlLoader 爬取網站
+def update_vector_store(embeddings):
+    """重新爬取網站（只抓取變更的網址）、分割內容，並只嵌入內容有變動的區塊。"""
+    # 步驟 1：以條件式請求檢查每個網址，只抓取有變更的頁面
     print("開始爬取網站...")
-    loader = FireCrawlLoader(
-        api_key=api_key, url="https://apple.com", mode="scrape")
-    docs = loader.load()
-    print("完成爬取網站。")
-
-    # 如果元數據值是列表，則轉換為字串
-    for doc in docs:
-        for key, value in doc.metadata.items():
-            if isinstance(value, list):
-                doc.metadata[key] = ", ".join(map(str, value))
-
-    # 步驟 2：將爬取的內容分割成塊
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-    split_docs = text_splitter.split_documents(docs)
-
-    # 顯示分割文件的資訊
-    print("\n--- 文件塊資訊 ---")
-    print(f"文件塊數量：{len(split_docs)}")
-    print(f"範例塊：\n{split_docs[0].page_content}\n")
-
-    # 步驟 3：為文件塊建立嵌入
-    embeddings = HuggingFaceEmbeddings(model_name="jinaai/jina-embeddings-v2-base-zh")
-
-    # 步驟 4：使用嵌入建立並持久化向量存儲
-    print(f"\n--- 正在 {persistent_directory} 中建立向量存儲 ---")
-    db = Chroma.from_documents(
-        split_docs, embeddings, persist_directory=persistent_directory
+    crawl_cache = CrawlCache(crawl_cache_directory)
+    crawl_stats = crawl_cache.refresh(CRAWL_URLS, get_fetcher())
+    print(f"完成爬取網站：{crawl_stats}")
+
+    # 步驟 2～4：分割頁面、比對區塊 ID，只嵌入新增的區塊並刪除已消失的區塊
+    print(f"\n--- 正在同步 {persistent_directory} 中的向量存儲 ---")
+    db = get_shared_vectorstore(persistent_directory, embeddings)
+    stats = sync_vector_store(
+        db,
+        persistent_directory,
+        crawl_cache.sources(),
+        functools.partial(load_and_split_page, splitter_config=SPLITTER_CONFIG),
+        SPLITTER_CONFIG,
     )
-    print(f"--- 完成在 {persistent_directory} 中建立向量存儲 ---")
-
-
-# 檢查 Chroma 向量存儲是否已存在
-if not os.path.exists(persistent_directory):
-    create_vector_store()
-else:
     print(
-        f"向量存儲 {persistent_directory} 已存在。無需初始化。")
-
-# 使用嵌入載入向量存儲
-embeddings = HuggingFaceEmbeddings(model_name="jinaai/jina-embeddings-v2-base-zh")
-db = Chroma(persist_directory=persistent_directory,
-            embedding_function=embeddings)
+        f"--- 完成同步：新增 {stats['added']}、刪除 {stats['deleted']}、"
+        f"未變更 {stats['unchanged']} 個區塊 ---"
+    )
+    return db
 
 
 # 步驟 5：查詢向量存儲
-def query_vector_store(query):
+def query_vector_store(db, embeddings, query):
     """使用指定的問題查詢向量存儲。"""
     # 建立用於查詢向量存儲的檢索器
     retriever = db.as_retriever(
@@ -87,9 +83,18 @@ def query_vector_store(query):
         if doc.metadata:
             print(f"來源：{doc.metadata.get('source', 'Unknown')}\n")
 
+    # 顯示 embedding 快取統計
+    print(f"Embedding 快取統計：{embeddings.stats()}")
+
+
+# 爬取與查詢只在直接執行本檔案時進行
+if __name__ == "__main__":
+    # 使用嵌入載入向量存儲（重複的查詢直接使用 embedding 快取）
+    embeddings = create_cached_embeddings("jinaai/jina-embeddings-v2-base-zh")
+    db = update_vector_store(embeddings)
 
-# 定義使用者的問題
-query = "Apple Intelligence?"
+    # 定義使用者的問題
+    query = "Apple Intelligence?"
 
-# 使用使用者的問題查詢向量存儲
-query_vector_store(query)
+    # 使用使用者的問題查詢向量存儲
+    query_vector_store(db, embeddings, query)
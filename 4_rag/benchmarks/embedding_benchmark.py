@@ -0,0 +1,325 @@
+"""
+Embedding 模型基準測試
+功能：以 books/ 語料庫離線比較多個本地 embedding 模型：
+      - 不同 batch size、執行緒數量、最大序列長度下的吞吐量（區塊/秒）
+      - 峰值記憶體 (RSS)、向量維度、向量儲存空間（float32 / float16 / int8）
+      - 以 benchmarks/questions.json 計算 recall@k 與 MRR
+
+每個模型在獨立的子行程中執行，峰值記憶體與執行緒設定不會互相影響
+（OpenAI 等 API 模型需要網路與費用，不在此比較；成本估算請使用 utils/embedding_cost_calculator.py）
+
+使用方式（在 4_rag 目錄下）：
+    python benchmarks/embedding_benchmark.py
+    python benchmarks/embedding_benchmark.py --models jinaai/jina-embeddings-v2-base-zh,BAAI/bge-small-zh-v1.5
+    python benchmarks/embedding_benchmark.py --batch-sizes 8,32 --threads 1,4 --seq-lengths 256,512 --csv embedding.csv
+
+模型倉庫中的自訂程式碼 (trust_remote_code) 只對 REMOTE_CODE_MODELS 中的模型啟用，
+其他模型需要時以 --trust-remote-code 模型名稱 個別指定
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Windows 沒有 resource 模組，峰值記憶體改用 psutil（未安裝時不回報）
+    resource = None
+
+# benchmarks/（splitter_benchmark）與 4_rag/（utils）都需要可匯入，不依賴目前的工作目錄
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, ".."))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from splitter_benchmark import (
+    DEFAULT_BOOKS_DIR,
+    DEFAULT_QUESTIONS_PATH,
+    _int_list,
+    first_hit_rank,
+    get_book_tasks,
+    load_questions,
+)
+from utils.embedding_cache import DEFAULT_MODEL_NAME
+from utils.embedding_cost_calculator import DEFAULT_SPLITTER_CONFIG
+from utils.text_splitting import load_and_split_text_file
+
+DEFAULT_MODELS = [DEFAULT_MODEL_NAME, "BAAI/bge-small-zh-v1.5"]
+
+# 模型卡要求 trust_remote_code 才能載入的模型（會執行模型倉庫中的程式碼）
+REMOTE_CODE_MODELS = {
+    "jinaai/jina-embeddings-v2-base-zh",
+    "jinaai/jina-embeddings-v2-base-en",
+    "jinaai/jina-embeddings-v2-small-en",
+}
+
+# 需要在查詢與文檔前加上前綴的模型（依模型卡說明）
+MODEL_PREFIXES = {
+    "intfloat/multilingual-e5-small": ("query: ", "passage: "),
+    "intfloat/multilingual-e5-base": ("query: ", "passage: "),
+    "intfloat/multilingual-e5-large": ("query: ", "passage: "),
+}
+
+
+def peak_rss_mb():
+    """
+    目前行程的峰值 RSS (MB)
+
+    Linux 以 KB 回報、macOS 以 bytes 回報；Windows 以 psutil 的峰值工作集代替，
+    未安裝 psutil 時回傳 None
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return round(getattr(memory, "peak_wset", memory.rss) / (1024 * 1024), 1)
+
+
+def load_chunks(books_dir, splitter_config):
+    """以 RAG 案例相同的分割設定載入所有區塊"""
+    chunks = []
+    for _, (file_path, metadata, config) in get_book_tasks(books_dir, splitter_config):
+        chunks.extend(load_and_split_text_file(file_path, metadata, config))
+    return chunks
+
+
+def measure_throughput(model, texts, batch_size, threads, seq_length):
+    """測量指定設定下每秒可嵌入的區塊數"""
+    import torch
+
+    torch.set_num_threads(threads)
+    model.max_seq_length = seq_length
+
+    # 暖機：第一次呼叫包含權重載入到快取與 kernel 初始化
+    model.encode(texts[:batch_size], batch_size=batch_size, show_progress_bar=False)
+
+    started = time.perf_counter()
+    model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+    elapsed = time.perf_counter() - started
+    return {
+        "batch_size": batch_size,
+        "threads": threads,
+        "seq_length": seq_length,
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(texts) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def evaluate_recall(model, chunks, questions, ks, batch_size, query_prefix="", passage_prefix=""):
+    """嵌入整個語料庫與問題，以餘弦相似度檢索，計算 recall@k 與 MRR"""
+    import numpy as np
+
+    started = time.perf_counter()
+    chunk_vectors = model.encode(
+        [passage_prefix + chunk.page_content for chunk in chunks],
+        batch_size=batch_size,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+    corpus_seconds = time.perf_counter() - started
+
+    query_vectors = model.encode(
+        [query_prefix + question["question"] for question in questions],
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+
+    max_k = max(ks)
+    ranks = []
+    for question, scores in zip(questions, query_vectors @ chunk_vectors.T):
+        top = np.argsort(-scores)[:max_k]
+        ranks.append(first_hit_rank([chunks[i] for i in top], question))
+
+    result = {
+        "corpus_embed_seconds": round(corpus_seconds, 2),
+        "mrr": round(sum(1 / rank for rank in ranks if rank) / len(ranks), 4),
+    }
+    for k in ks:
+        result[f"recall@{k}"] = round(sum(1 for rank in ranks if rank and rank <= k) / len(ranks), 4)
+    return result, chunk_vectors.shape[1]
+
+
+def benchmark_model(model_name, books_dir, questions_path, splitter_config, batch_sizes, thread_counts,
+                    seq_lengths, ks, sample_chunks, trust_remote_code=False):
+    """在子行程中測試單一模型"""
+    from sentence_transformers import SentenceTransformer
+
+    chunks = load_chunks(books_dir, splitter_config)
+    questions = load_questions(questions_path)
+    query_prefix, passage_prefix = MODEL_PREFIXES.get(model_name, ("", ""))
+
+    started = time.perf_counter()
+    model = SentenceTransformer(model_name, device="cpu", trust_remote_code=trust_remote_code)
+    load_seconds = time.perf_counter() - started
+    default_seq_length = model.max_seq_length
+
+    # 吞吐量只用前 sample_chunks 個區塊，控制測試時間
+    sample = [passage_prefix + chunk.page_content for chunk in chunks[:sample_chunks]]
+    grid = []
+    for threads in thread_counts:
+        for seq_length in seq_lengths:
+            for batch_size in batch_sizes:
+                point = measure_throughput(model, sample, batch_size, threads, seq_length)
+                print(
+                    f"  {model_name}: threads={threads} seq={seq_length} batch={batch_size} "
+                    f"→ {point['chunks_per_second']} 區塊/秒",
+                    flush=True
+                )
+                grid.append(point)
+
+    # recall 以模型預設的序列長度與最快的設定計算
+    best = max(grid, key=lambda point: point["chunks_per_second"])
+    import torch
+
+    torch.set_num_threads(best["threads"])
+    model.max_seq_length = default_seq_length
+    recall, dimensions = evaluate_recall(
+        model, chunks, questions, ks, best["batch_size"], query_prefix, passage_prefix
+    )
+
+    return {
+        "model": model_name,
+        "load_seconds": round(load_seconds, 2),
+        "dimensions": int(dimensions),
+        "max_seq_length": default_seq_length,
+        "chunks": len(chunks),
+        "storage_bytes": {
+            dtype: len(chunks) * dimensions * size
+            for dtype, size in (("float32", 4), ("float16", 2), ("int8", 1))
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "best_throughput": best,
+        **recall,
+        "throughput": grid,
+    }
+
+
+def run_benchmark(models, batch_sizes=(8, 32), thread_counts=(1, 4), seq_lengths=(256, 512), ks=(1, 3, 5),
+                  books_dir=DEFAULT_BOOKS_DIR, questions_path=DEFAULT_QUESTIONS_PATH,
+                  splitter_config=DEFAULT_SPLITTER_CONFIG, sample_chunks=128, remote_code_models=REMOTE_CODE_MODELS):
+    """
+    依序測試每個模型（每個模型一個新的子行程），回傳結果列表
+
+    參數：
+        remote_code_models: 允許執行模型倉庫自訂程式碼的模型名稱
+    """
+    results = []
+    for model_name in models:
+        print(f"\n🔬 {model_name}")
+        # spawn：子行程從乾淨的狀態開始，峰值 RSS 只包含該模型
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            future = executor.submit(
+                benchmark_model, model_name, books_dir, questions_path, splitter_config, list(batch_sizes),
+                list(thread_counts), list(seq_lengths), list(ks), sample_chunks, model_name in remote_code_models
+            )
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"❌ {model_name} 測試失敗: {e}")
+                results.append({"model": model_name, "error": str(e)})
+    return results
+
+
+def print_results(results, ks):
+    """以表格輸出每個模型的摘要"""
+    recall_headers = "".join(f"{f'R@{k}':>8}" for k in ks)
+    print()
+    print(f"{'模型':<44}{'維度':>6}{'最佳區塊/秒':>12}{'峰值RSS(MB)':>13}{'float32(MB)':>13}{recall_headers}{'MRR':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['model']:<44}  ❌ {r['error']}")
+            continue
+        recalls = "".join(f"{r[f'recall@{k}']:>8.2f}" for k in ks)
+        peak_rss = f"{r['peak_rss_mb']:>13.0f}" if r["peak_rss_mb"] is not None else f"{'-':>13}"
+        print(
+            f"{r['model']:<44}{r['dimensions']:>6}{r['best_throughput']['chunks_per_second']:>12.1f}"
+            f"{peak_rss}{r['storage_bytes']['float32'] / 1_000_000:>13.2f}{recalls}{r['mrr']:>8.3f}"
+        )
+
+
+def write_csv(results, path, ks):
+    """每個模型 × 吞吐量設定一列"""
+    fieldnames = [
+        "model", "dimensions", "peak_rss_mb", "storage_float32_bytes", "mrr",
+        *[f"recall@{k}" for k in ks],
+        "batch_size", "threads", "seq_length", "chunks_per_second",
+    ]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for r in results:
+            if "error" in r:
+                continue
+            summary = {
+                "model": r["model"],
+                "dimensions": r["dimensions"],
+                "peak_rss_mb": r["peak_rss_mb"],
+                "storage_float32_bytes": r["storage_bytes"]["float32"],
+                "mrr": r["mrr"],
+                **{f"recall@{k}": r[f"recall@{k}"] for k in ks},
+            }
+            for point in r["throughput"]:
+                writer.writerow({
+                    **summary,
+                    **{key: point[key] for key in ("batch_size", "threads", "seq_length", "chunks_per_second")},
+                })
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="離線比較本地 embedding 模型的吞吐量、記憶體與檢索品質")
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="以逗號分隔的模型名稱")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[8, 32], help="以逗號分隔")
+    parser.add_argument("--threads", type=_int_list, default=[1, 4], help="以逗號分隔")
+    parser.add_argument("--seq-lengths", type=_int_list, default=[256, 512], help="最大序列長度，以逗號分隔")
+    parser.add_argument("--k", type=_int_list, default=[1, 3, 5], help="計算 recall@k 的 k 值，以逗號分隔")
+    parser.add_argument("--sample-chunks", type=int, default=128, help="吞吐量測試使用的區塊數量")
+    parser.add_argument("--books", default=DEFAULT_BOOKS_DIR, help="語料庫目錄")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS_PATH, help="問題集 JSON")
+    parser.add_argument(
+        "--trust-remote-code", default="", metavar="模型",
+        help="以逗號分隔，額外允許執行模型倉庫自訂程式碼的模型（預設只有 REMOTE_CODE_MODELS）",
+    )
+    parser.add_argument("--json", metavar="路徑", help="輸出 JSON 結果")
+    parser.add_argument("--csv", metavar="路徑", help="輸出 CSV 結果")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ks = sorted(set(args.k))
+
+    results = run_benchmark(
+        [model.strip() for model in args.models.split(",") if model.strip()],
+        batch_sizes=args.batch_sizes,
+        thread_counts=args.threads,
+        seq_lengths=args.seq_lengths,
+        ks=ks,
+        books_dir=args.books,
+        questions_path=args.questions,
+        sample_chunks=args.sample_chunks,
+        remote_code_models=REMOTE_CODE_MODELS | {
+            model.strip() for model in args.trust_remote_code.split(",") if model.strip()
+        },
+    )
+    print_results(results, ks)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n已輸出 JSON 結果：{args.json}")
+    if args.csv:
+        write_csv(results, args.csv, ks)
+        print(f"已輸出 CSV 結果：{args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+文本分割設定基準測試
+功能：以不同的 chunk_size / chunk_overlap 組合為 books/ 建立向量資料庫，
+      用一組已知答案片段的問題 (benchmarks/questions.json) 測量：
+      - 索引建立時間、區塊數量、索引大小
+      - 向量搜尋延遲 (p50 / p95 / p99)
+      - recall@k 與 MRR（前 k 個結果中是否有區塊包含完整的答案片段）
+
+問題的 embedding 只計算一次，延遲只包含向量搜尋本身，不同設定之間可以直接比較
+
+使用方式（在 4_rag 目錄下）：
+    python benchmarks/splitter_benchmark.py
+    python benchmarks/splitter_benchmark.py --chunk-sizes 300,500,1000 --chunk-overlaps 0,100 --k 1,3,5
+    python benchmarks/splitter_benchmark.py --json splitter.json --csv splitter.csv
+"""
+
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.embedding_cache import DEFAULT_MODEL_NAME, create_cached_embeddings
+from utils.ingestion import ingest_files
+from utils.text_splitting import load_and_split_text_file
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BOOKS_DIR = os.path.join(BENCHMARK_DIR, "..", "books")
+DEFAULT_QUESTIONS_PATH = os.path.join(BENCHMARK_DIR, "questions.json")
+
+
+def load_questions(path):
+    """載入問題集：[{question, source_name, answer_span}]"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_book_tasks(books_dir, splitter_config):
+    """books/ 中每個 .txt 檔案一個匯入工作，source_name 為檔名（不含副檔名）"""
+    tasks = []
+    for file_path in sorted(glob.glob(os.path.join(books_dir, "*.txt"))):
+        filename = os.path.basename(file_path)
+        metadata = {"source_name": os.path.splitext(filename)[0], "filename": filename}
+        tasks.append((filename, (file_path, metadata, splitter_config)))
+    if not tasks:
+        raise FileNotFoundError(f"在 {books_dir} 中找不到 .txt 檔案")
+    return tasks
+
+
+def directory_size(path):
+    """目錄中所有檔案的大小總和 (bytes)"""
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+def percentile(values, p):
+    """最近排名法的百分位數"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _normalize(text):
+    return re.sub(r"\s+", "", text)
+
+
+def first_hit_rank(docs, question):
+    """回傳第一個包含完整答案片段的區塊排名（從 1 開始），沒有則為 None"""
+    span = _normalize(question["answer_span"])
+    for rank, doc in enumerate(docs, 1):
+        if doc.metadata.get("source_name") == question["source_name"] and span in _normalize(doc.page_content):
+            return rank
+    return None
+
+
+def benchmark_config(splitter_config, tasks, embeddings, questions, query_vectors, ks, repeat,
+                     use_filter=False, work_dir=None, max_workers=None):
+    """以一組分割設定建立索引並測量檢索品質與延遲"""
+    from langchain_community.vectorstores import Chroma
+
+    persist_directory = tempfile.mkdtemp(prefix="splitter-bench-", dir=work_dir)
+    try:
+        db = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+
+        started = time.perf_counter()
+        ingest_stats = ingest_files(db, tasks, load_and_split_text_file, max_workers=max_workers)
+        build_seconds = time.perf_counter() - started
+
+        max_k = max(ks)
+        latencies = []
+        ranks = []
+        for question, query_vector in zip(questions, query_vectors):
+            search_filter = {"source_name": question["source_name"]} if use_filter else None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                docs = db.similarity_search_by_vector(query_vector, k=max_k, filter=search_filter)
+                latencies.append((time.perf_counter() - started) * 1000)
+            ranks.append(first_hit_rank(docs, question))
+
+        result = {
+            "chunk_size": splitter_config["chunk_size"],
+            "chunk_overlap": splitter_config["chunk_overlap"],
+            "chunks": ingest_stats["chunks_written"],
+            "build_seconds": round(build_seconds, 2),
+            "index_bytes": directory_size(persist_directory),
+            "latency_ms_p50": round(percentile(latencies, 50), 3),
+            "latency_ms_p95": round(percentile(latencies, 95), 3),
+            "latency_ms_p99": round(percentile(latencies, 99), 3),
+            "mrr": round(sum(1 / rank for rank in ranks if rank) / len(ranks), 4),
+        }
+        for k in ks:
+            result[f"recall@{k}"] = round(sum(1 for rank in ranks if rank and rank <= k) / len(ranks), 4)
+        result["misses"] = [q["question"] for q, rank in zip(questions, ranks) if not rank]
+        return result
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+def run_benchmark(chunk_sizes, chunk_overlaps, ks=(1, 3, 5), separator="\n", books_dir=DEFAULT_BOOKS_DIR,
+                  questions_path=DEFAULT_QUESTIONS_PATH, model_name=DEFAULT_MODEL_NAME, repeat=5,
+                  use_filter=False, use_embedding_cache=False, work_dir=None, max_workers=None):
+    """執行所有分割設定組合的基準測試，回傳每個設定的結果列表"""
+    questions = load_questions(questions_path)
+
+    if use_embedding_cache:
+        embeddings = create_cached_embeddings(model_name)
+    else:
+        # 預設不使用快取，建立時間才包含實際的 embedding 計算
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        embeddings = HuggingFaceEmbeddings(model_name=model_name)
+
+    query_vectors = [embeddings.embed_query(q["question"]) for q in questions]
+
+    results = []
+    for chunk_size in chunk_sizes:
+        for chunk_overlap in chunk_overlaps:
+            if chunk_overlap >= chunk_size:
+                continue
+            splitter_config = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "separator": separator}
+            print(f"\n🔬 chunk_size={chunk_size}, chunk_overlap={chunk_overlap}")
+            results.append(benchmark_config(
+                splitter_config,
+                get_book_tasks(books_dir, splitter_config),
+                embeddings,
+                questions,
+                query_vectors,
+                ks,
+                repeat,
+                use_filter=use_filter,
+                work_dir=work_dir,
+                max_workers=max_workers,
+            ))
+    return results
+
+
+def print_results(results, ks):
+    """以表格輸出結果"""
+    recall_headers = "".join(f"{f'R@{k}':>8}" for k in ks)
+    print()
+    print(
+        f"{'size':>6}{'overlap':>9}{'區塊':>7}{'建立(秒)':>10}{'索引(MB)':>10}"
+        f"{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{recall_headers}{'MRR':>8}"
+    )
+    for r in results:
+        recalls = "".join(f"{r[f'recall@{k}']:>8.2f}" for k in ks)
+        print(
+            f"{r['chunk_size']:>6}{r['chunk_overlap']:>9}{r['chunks']:>7}{r['build_seconds']:>10.1f}"
+            f"{r['index_bytes'] / 1_000_000:>10.2f}{r['latency_ms_p50']:>10.2f}{r['latency_ms_p95']:>10.2f}"
+            f"{r['latency_ms_p99']:>10.2f}{recalls}{r['mrr']:>8.3f}"
+        )
+
+
+def write_csv(results, path):
+    fieldnames = [key for key in results[0] if key != "misses"]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="比較不同文本分割設定的檢索品質與速度")
+    parser.add_argument("--chunk-sizes", type=_int_list, default=[500, 1000, 1500], help="以逗號分隔")
+    parser.add_argument("--chunk-overlaps", type=_int_list, default=[0, 100, 200], help="以逗號分隔")
+    parser.add_argument("--separator", default="\\n")
+    parser.add_argument("--k", type=_int_list, default=[1, 3, 5], help="計算 recall@k 的 k 值，以逗號分隔")
+    parser.add_argument("--books", default=DEFAULT_BOOKS_DIR, help="語料庫目錄")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS_PATH, help="問題集 JSON")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME, help="embedding 模型")
+    parser.add_argument("--repeat", type=int, default=5, help="每個問題重複查詢的次數（用於延遲統計）")
+    parser.add_argument("--filter", action="store_true", help="查詢時以 source_name 過濾（預設搜尋全部文檔）")
+    parser.add_argument("--embedding-cache", action="store_true",
+                        help="使用 embedding 快取（重複執行較快，但建立時間不再包含 embedding 計算）")
+    parser.add_argument("--workers", type=int, default=None, help="平行分割檔案的工作數量")
+    parser.add_argument("--work-dir", default=None, help="暫存向量資料庫的目錄")
+    parser.add_argument("--json", metavar="路徑", help="輸出 JSON 結果")
+    parser.add_argument("--csv", metavar="路徑", help="輸出 CSV 結果")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ks = sorted(set(args.k))
+
+    results = run_benchmark(
+        args.chunk_sizes,
+        args.chunk_overlaps,
+        ks=ks,
+        separator=args.separator.replace("\\n", "\n").replace("\\t", "\t"),
+        books_dir=args.books,
+        questions_path=args.questions,
+        model_name=args.model,
+        repeat=args.repeat,
+        use_filter=args.filter,
+        use_embedding_cache=args.embedding_cache,
+        work_dir=args.work_dir,
+        max_workers=args.workers,
+    )
+    if not results:
+        print("沒有有效的分割設定（chunk_overlap 必須小於 chunk_size）")
+        return
+
+    print_results(results, ks)
+    for r in results:
+        if r["misses"]:
+            print(f"\n未命中（size={r['chunk_size']}, overlap={r['chunk_overlap']}）：")
+            for question in r["misses"]:
+                print(f"  - {question}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n已輸出 JSON 結果：{args.json}")
+    if args.csv:
+        write_csv(results, args.csv)
+        print(f"已輸出 CSV 結果：{args.csv}")
+
+
+if __name__ == "__main__":
+    main()
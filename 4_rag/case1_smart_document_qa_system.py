@@ -24,16 +24,31 @@
 
 import gradio as gr
 from dotenv import load_dotenv
-from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import CharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema.output_parser import StrOutputParser
-from langchain.schema.runnable import RunnablePassthrough
+from langchain.schema.runnable import RunnableParallel, RunnablePassthrough
 from langchain_ollama.llms import OllamaLLM
 import os
-from pathlib import Path
+from functools import lru_cache, partial
+
+from utils.answer_cache import SemanticAnswerCache
+from utils.async_runtime import ConcurrencyLimiter, run_in_thread
+from utils.context_compression import (
+    DEFAULT_MAX_SENTENCES,
+    DEFAULT_TOKEN_BUDGET,
+    ContextCompressor,
+    format_compression_stats,
+)
+from utils.embedding_cache import create_cached_embeddings
+from utils.document_summaries import TwoStageRetriever, load_or_build_summary_index
+from utils.hybrid_search import HybridRetriever, load_or_build_lexical_index
+from utils.incremental_index import load_manifest, manifest_index_version, sync_vector_store
+from utils.lazy_startup import BackgroundLoader, launch_with_health
+from utils.metadata_index import POSITION_BUCKETS, CandidateSearcher, FilteredRetriever, load_or_build_metadata_index
+from utils.mmap_vector_store import load_or_export_mmap_store
+from utils.reranker import DEFAULT_OVERFETCH, DEFAULT_RERANKER_MODEL, CrossEncoderReranker, RerankingRetriever
+from utils.text_splitting import load_and_split_source_file
+from utils.vectorstore_registry import get_shared_vectorstore
 
 # 載入環境變數
 load_dotenv()
@@ -57,88 +72,183 @@ AVAILABLE_DOCS = {
     "租屋契約範本與說明": "租屋契約範本與說明.txt"
 }
 
+# 文檔位置過濾（匯入時依區塊在文檔中的順序記錄為前段/中段/後段）
+ALL_POSITIONS = "全部位置"
+
+# 向量資料庫與關鍵字索引的存放位置
+DB_PATH = os.path.abspath("./db")
+LEXICAL_INDEX_PATH = os.path.join(DB_PATH, "lexical_index.json.gz")
+SUMMARY_INDEX_PATH = os.path.join(DB_PATH, "summary_index.json.gz")
+METADATA_INDEX_PATH = os.path.join(DB_PATH, "metadata_index.json.gz")
+MMAP_STORE_PATH = os.path.join(DB_PATH, "mmap_store")
+
+# 查詢使用的向量後端（環境變數 RAG_VECTOR_BACKEND）：
+#   chroma - 直接查詢 Chroma（預設）
+#   mmap   - 從 Chroma 匯出量化向量，以 mmap 開啟做精確搜尋（RAG_MMAP_DTYPE：float16 或 int8）
+VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma")
+MMAP_DTYPE = os.getenv("RAG_MMAP_DTYPE", "float16")
+
+# 檢索策略顯示名稱
+SEARCH_TYPE_NAMES = {
+    "similarity": "相似度搜尋",
+    "mmr": "最大邊際相關性 (MMR)",
+    "hybrid": "混合檢索 (BM25 + 向量, RRF)",
+    "two_stage": "兩階段檢索 (文檔摘要路由 → 區塊搜尋)"
+}
+
+# 文本分割設定（變更後會觸發所有檔案重新分割比對）
+# 可用 benchmarks/splitter_benchmark.py 比較不同設定的 recall@k、索引大小與延遲
+SPLITTER_CONFIG = {
+    "chunk_size": 1000,
+    "chunk_overlap": 200,
+    "separator": "\n"
+}
+
+# 兩階段檢索：先以文檔摘要挑出最相關的前 N 份文檔，再只搜尋這些文檔的區塊
+ROUTE_TOP_DOCUMENTS = int(os.getenv("RAG_ROUTE_TOP_DOCUMENTS", "3"))
+# 除了整份文檔的摘要，也為每個章節標題建立 embedding（設為 0 只建立文檔摘要）
+SUMMARY_SECTIONS = os.getenv("RAG_SUMMARY_SECTIONS", "1") == "1"
+
+# 延遲啟動：介面先啟動，embedding 模型與向量資料庫在背景載入
+# 設定 RAG_LAZY_STARTUP=0 可改回啟動前先完成載入
+LAZY_STARTUP = os.getenv("RAG_LAZY_STARTUP", "1") == "1"
+# 請求等待向量資料庫就緒的最長秒數
+STARTUP_WAIT_SECONDS = float(os.getenv("RAG_STARTUP_WAIT_SECONDS", "30"))
+
+# 語意回答快取：相同檢索設定下，問題相似度超過門檻即直接回傳已快取的回答
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+answer_cache = SemanticAnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    max_entries=512,
+    # 每次查找前檢查 manifest 的索引版本（向量資料庫被增量更新後快取自動失效）
+    index_version_fn=lambda: manifest_index_version(DB_PATH)
+)
+
+# Cross-encoder 重新排序：先多取 RERANK_OVERFETCH 倍的候選區塊，評分後保留前 k 個
+# （模型在第一次使用重新排序時才載入）
+RERANK_OVERFETCH = int(os.getenv("RAG_RERANK_OVERFETCH", str(DEFAULT_OVERFETCH)))
+reranker = CrossEncoderReranker(os.getenv("RAG_RERANKER_MODEL", DEFAULT_RERANKER_MODEL))
+
+# 同時生成回答的請求數量上限，超過的請求排隊等待（佇列深度可由 /metrics 查詢）
+MAX_CONCURRENT_REQUESTS = int(os.getenv("RAG_MAX_CONCURRENT_REQUESTS", "4"))
+request_limiter = ConcurrencyLimiter("answer_question", max_concurrent=MAX_CONCURRENT_REQUESTS)
+
+# Context 壓縮：只把與問題最相關的句子放進 prompt（token 預算，預設 0 為停用）
+# 啟用時預算應大於 k 個區塊的大小，每次最多計算 CONTEXT_MAX_SENTENCES 句的 embedding
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", str(DEFAULT_TOKEN_BUDGET)))
+CONTEXT_MAX_SENTENCES = int(os.getenv("RAG_CONTEXT_MAX_SENTENCES", str(DEFAULT_MAX_SENTENCES)))
+
 # 💡 AI 提示：優化文檔載入流程
 # Prompt: "為文檔載入器添加錯誤處理機制，當檔案不存在或讀取失敗時提供友善的錯誤訊息"
-def load_documents():
-    """載入所有文檔並建立向量資料庫"""
-    all_docs = []
-    
+# 載入並分割單一文檔（在匯入管線的工作行程中執行，因此使用 utils 的模組層級函數）
+# 每個區塊另外記錄章節標題與位置，供 metadata 索引做複合過濾
+load_and_split_file = partial(load_and_split_source_file, splitter_config=SPLITTER_CONFIG, structure_metadata=True)
+
+def get_source_files():
+    """取得所有來源檔案 {檔案路徑: (文檔名稱, 檔名)}"""
+    sources = {}
     for doc_name, filename in AVAILABLE_DOCS.items():
         if doc_name == "全部文檔":
             continue
-            
-        file_path = os.path.join(BOOKS_DIR, filename)
-        if not os.path.exists(file_path):
-            print(f"⚠️ 檔案不存在: {file_path}")
-            continue
-            
-        try:
-            loader = TextLoader(file_path, encoding='utf-8')
-            documents = loader.load()
-            
-            # 添加 metadata
-            for doc in documents:
-                doc.metadata["source_name"] = doc_name
-                doc.metadata["filename"] = filename
-                
-            all_docs.extend(documents)
-            print(f"✅ 成功載入: {doc_name}")
-        except Exception as e:
-            print(f"❌ 載入失敗 {doc_name}: {e}")
-    
-    return all_docs
+        sources[os.path.join(BOOKS_DIR, filename)] = (doc_name, filename)
+    return sources
 
 # 💡 AI 提示：調整分割策略
 # Prompt: "比較不同的 chunk_size (500, 1000, 1500) 和 chunk_overlap (50, 100, 200) 對檢索效果的影響"
-def create_vector_store():
-    """建立或載入向量資料庫"""
-    db_path = os.path.abspath("./db")
-    
-    # 使用 HuggingFace 的中文 embedding 模型
-    embeddings = HuggingFaceEmbeddings(
-        model_name='jinaai/jina-embeddings-v2-base-zh'
-    )
-    
-    # 檢查資料庫是否已存在
-    if Path(db_path).exists():
-        print("📂 載入現有向量資料庫...")
-        db = Chroma(persist_directory=db_path, embedding_function=embeddings)
-        return db
+def create_vector_store(report=None):
+    """建立或載入向量資料庫，並增量同步 books/ 的變更"""
+    report = report or (lambda stage, progress=None: None)
+    # 使用 HuggingFace 的中文 embedding 模型（包裝查詢/文檔區塊的 embedding 快取）
+    report("載入 embedding 模型")
+    embeddings = create_cached_embeddings('jinaai/jina-embeddings-v2-base-zh', micro_batch=True)
     
-    print("🔨 建立新的向量資料庫...")
+    print("📂 載入向量資料庫...")
+    report("開啟向量資料庫")
+    db = get_shared_vectorstore(DB_PATH, embeddings)
     
-    # 載入所有文檔
-    documents = load_documents()
+    # 比對 manifest，只嵌入新增/變更的區塊，刪除已消失的區塊
+    stats = sync_vector_store(
+        db,
+        DB_PATH,
+        get_source_files(),
+        load_and_split_file,
+        SPLITTER_CONFIG,
+        progress=lambda done, total: report(f"同步索引 {done}/{total} 個檔案", done / total)
+    )
     
-    if not documents:
+    total_chunks = stats["added"] + stats["unchanged"]
+    if not total_chunks:
         raise ValueError("沒有成功載入任何文檔")
     
-    # 分割文檔
-    text_splitter = CharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        separator="\n"
+    print(
+        f"✅ 向量資料庫同步完成：共 {total_chunks} 個文檔區塊"
+        f"（新增 {stats['added']}、刪除 {stats['deleted']}、未變更 {stats['unchanged']}），"
+        f"嵌入速度 {stats['throughput']['chunks_per_second']:.1f} 區塊/秒"
     )
-    docs = text_splitter.split_documents(documents)
-    
-    print(f"📄 共分割成 {len(docs)} 個文檔區塊")
     
-    # 建立向量資料庫
-    db = Chroma.from_documents(
-        docs,
-        embeddings,
-        persist_directory=db_path
-    )
+    # 重新索引後，舊的快取回答可能已過時
+    answer_cache.set_index_version(stats["index_version"])
     
-    print("✅ 向量資料庫建立完成")
+    if VECTOR_BACKEND == "mmap":
+        # Chroma 仍負責增量索引，查詢改用與索引版本同步的 mmap 量化向量
+        report("載入 mmap 向量資料庫")
+        return load_or_export_mmap_store(db, MMAP_STORE_PATH, stats["index_version"], dtype=MMAP_DTYPE)
     return db
 
-# 初始化向量資料庫
-try:
-    vectorstore = create_vector_store()
-except Exception as e:
-    print(f"❌ 向量資料庫初始化失敗: {e}")
-    vectorstore = None
+# 在背景初始化向量資料庫，不阻塞介面啟動
+vectorstore_loader = BackgroundLoader("vectorstore", create_vector_store).start()
+
+def create_lexical_index(report=None):
+    """載入或重建混合檢索使用的 BM25 關鍵字索引（與向量資料庫的索引版本同步）"""
+    db = vectorstore_loader.wait()
+    if report:
+        report("載入關鍵字索引")
+    return load_or_build_lexical_index(db, LEXICAL_INDEX_PATH, load_manifest(DB_PATH)["index_version"])
+
+lexical_index_loader = BackgroundLoader("lexical_index", create_lexical_index).start()
+
+def create_summary_index(report=None):
+    """載入或更新兩階段檢索使用的文檔摘要索引（只重新計算變更過的文檔）"""
+    db = vectorstore_loader.wait()
+    if report:
+        report("建立文檔摘要索引")
+    sources = {doc_name: file_path for file_path, (doc_name, _) in get_source_files().items()}
+    return load_or_build_summary_index(SUMMARY_INDEX_PATH, sources, db.embeddings, include_sections=SUMMARY_SECTIONS)
+
+summary_index_loader = BackgroundLoader("summary_index", create_summary_index).start()
+
+def create_metadata_index(report=None):
+    """載入或重建 metadata 倒排索引（與向量資料庫的索引版本同步）"""
+    db = vectorstore_loader.wait()
+    if report:
+        report("載入 metadata 索引")
+    return load_or_build_metadata_index(db, METADATA_INDEX_PATH, load_manifest(DB_PATH)["index_version"])
+
+metadata_index_loader = BackgroundLoader("metadata_index", create_metadata_index).start()
+
+@lru_cache(maxsize=1)
+def get_candidate_searcher():
+    """候選區塊搜尋器（快取各過濾條件的候選向量）"""
+    return CandidateSearcher(get_vectorstore())
+
+def get_vectorstore():
+    """取得向量資料庫；背景載入尚未完成時最多等待 STARTUP_WAIT_SECONDS 秒"""
+    return vectorstore_loader.wait(timeout=STARTUP_WAIT_SECONDS)
+
+def query_batching_stats():
+    """查詢 embedding 微批次的批次大小與排隊延遲統計（向量資料庫載入前為空）"""
+    if not vectorstore_loader.ready:
+        return {}
+    # 快取包裝器 → 微批次包裝器
+    return get_vectorstore().embeddings.embeddings.stats()
+
+def vectorstore_unavailable_message(error):
+    """向量資料庫無法使用時的提示訊息"""
+    if isinstance(error, TimeoutError):
+        return f"⏳ 系統啟動中（{vectorstore_loader.status()['stage']}），請稍後再試"
+    return f"❌ 向量資料庫未初始化，請檢查系統設定（{error}）"
 
 # RAG Prompt 模板
 # 💡 AI 提示：客製化 Prompt
@@ -175,48 +285,112 @@ def format_docs(docs):
     
     return "\n\n" + "\n\n".join(formatted)
 
-# 💡 AI 提示：加入進階功能
-# Prompt: "為問答系統加入對話歷史記錄功能，使用 ChatMessageHistory 保存多輪對話"
-def answer_question(question, doc_filter, num_results, search_type):
-    """回答使用者問題"""
-    if not vectorstore:
-        return "❌ 向量資料庫未初始化，請檢查系統設定"
+# 💡 AI 提示：重複使用 Chain
+# Prompt: "依檢索設定快取 RAG Chain，讓每個問題只做一次 embedding、一次向量搜尋、一次 LLM 呼叫"
+def build_filter(doc_filter, position=ALL_POSITIONS):
+    """
+    依文檔範圍與文檔位置組成 metadata 過濾條件（Chroma 的 where 語法）
+
+    兩者都指定時以 $and 組合，例如 {"$and": [{"source_name": "洗衣機使用說明"}, {"position": "後段"}]}
+    回傳：dict；都未指定時回傳 None
+    """
+    conditions = []
+    if doc_filter != "全部文檔":
+        conditions.append({"source_name": doc_filter})
+    if position in POSITION_BUCKETS:
+        conditions.append({"position": position})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def scope_label(doc_filter, position=ALL_POSITIONS):
+    """搜尋範圍的顯示文字"""
+    return doc_filter if position not in POSITION_BUCKETS else f"{doc_filter}（{position}）"
+
+@lru_cache(maxsize=64)
+def get_rag_chain(doc_filter, num_results, search_type, rerank=False, position=ALL_POSITIONS):
+    """取得指定檢索設定的 RAG Chain（依 filter/k/search_type/rerank/position 快取），輸出 answer 與 context"""
+    # 重新排序時先多取候選區塊，評分後再裁切為 num_results 個
+    fetch_k = num_results * RERANK_OVERFETCH if rerank else num_results
+    search_kwargs = {"k": fetch_k}
     
-    if not question.strip():
-        return "⚠️ 請輸入您的問題"
+    # 如果有指定文檔或位置，添加 metadata 過濾
+    metadata_filter = build_filter(doc_filter, position)
+    if metadata_filter:
+        search_kwargs["filter"] = metadata_filter
     
-    try:
-        # 設定檢索器
-        search_kwargs = {"k": num_results}
-        
-        # 如果有指定文檔，添加 metadata 過濾
-        if doc_filter != "全部文檔":
-            search_kwargs["filter"] = {"source_name": doc_filter}
-        
-        retriever = vectorstore.as_retriever(
-            search_type=search_type,
+    if search_type == "hybrid":
+        # 向量檢索與 BM25 關鍵字檢索同時執行，再以 RRF 合併
+        retriever = HybridRetriever(
+            vectorstore=get_vectorstore(),
+            lexical_index=lexical_index_loader.wait(timeout=STARTUP_WAIT_SECONDS),
+            k=fetch_k,
+            filter=search_kwargs.get("filter")
+        )
+    elif search_type == "two_stage" and "filter" not in search_kwargs:
+        # 全部文檔：先以摘要路由到最相關的文檔，再搜尋區塊
+        retriever = TwoStageRetriever(
+            vectorstore=get_vectorstore(),
+            summary_index=summary_index_loader.wait(timeout=STARTUP_WAIT_SECONDS),
+            k=fetch_k,
+            top_documents=ROUTE_TOP_DOCUMENTS
+        )
+    elif search_type in ("similarity", "two_stage") and "filter" in search_kwargs and VECTOR_BACKEND == "chroma":
+        # 指定文檔或位置：先以 metadata 倒排索引解析（複合）過濾條件，只在候選中做精確搜尋
+        # （已指定文檔時不需要路由，兩階段檢索等同相似度搜尋；mmap 後端本身已依列索引過濾）
+        retriever = FilteredRetriever(
+            vectorstore=get_vectorstore(),
+            metadata_index=metadata_index_loader.wait(timeout=STARTUP_WAIT_SECONDS),
+            searcher=get_candidate_searcher(),
+            filter=search_kwargs["filter"],
+            k=fetch_k
+        )
+    else:
+        retriever = get_vectorstore().as_retriever(
+            search_type="similarity" if search_type == "two_stage" else search_type,
             search_kwargs=search_kwargs
         )
-        
-        # 建立 RAG Chain
-        rag_chain = (
-            {
-                "context": retriever | format_docs,
-                "question": RunnablePassthrough()
-            }
-            | rag_template
-            | model
-            | StrOutputParser()
+    
+    if rerank:
+        retriever = RerankingRetriever(base_retriever=retriever, reranker=reranker, k=num_results)
+    
+    compressor = (
+        ContextCompressor(
+            get_vectorstore().embeddings,
+            token_budget=CONTEXT_TOKEN_BUDGET,
+            # 句子不寫入 embedding 快取（快取包裝器 → 微批次包裝器）
+            sentence_embeddings=get_vectorstore().embeddings.embeddings,
+            max_sentences=CONTEXT_MAX_SENTENCES
         )
-        
-        # 執行問答
-        answer = rag_chain.invoke(question)
-        
-        # 取得來源文檔
-        source_docs = retriever.invoke(question)
-        
-        # 格式化輸出
-        output = f"""
+        if CONTEXT_TOKEN_BUDGET > 0 else None
+    )
+    
+    def compress_context(inputs):
+        """挑出與問題最相關的句子，在 token 預算內組成 context"""
+        if compressor is None:
+            return {"docs": inputs["context"], "stats": None}
+        docs, stats = compressor.compress(inputs["question"], inputs["context"])
+        print(f"🗜️ Context 壓縮：{format_compression_stats(stats)}")
+        return {"docs": docs, "stats": stats}
+    
+    # 以壓縮後的文檔生成回答
+    answer_chain = (
+        RunnablePassthrough.assign(context=lambda x: format_docs(x["compressed"]["docs"]))
+        | rag_template
+        | model
+        | StrOutputParser()
+    )
+    
+    # 檢索結果只計算一次，同時作為 prompt 的 context 與回傳的來源文檔
+    return RunnableParallel(
+        context=retriever,
+        question=RunnablePassthrough()
+    ).assign(compressed=compress_context).assign(answer=answer_chain)
+
+def format_answer_output(question, answer, source_docs, doc_filter, num_results, search_type,
+                         rerank=False, compression=None, cached_from=None, position=ALL_POSITIONS):
+    """將問題、回答與來源文檔格式化為輸出文字"""
+    output = f"""
 ╔══════════════════════════════════════════════════════════════════╗
 ║                        智慧文檔問答系統                          ║
 ╚══════════════════════════════════════════════════════════════════╝
@@ -232,19 +406,22 @@ def answer_question(question, doc_filter, num_results, search_type):
 📚 參考資料來源
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 """
-        
-        for i, doc in enumerate(source_docs, 1):
-            source = doc.metadata.get('source_name', '未知來源')
-            content_preview = doc.page_content.strip()[:150] + "..."
-            output += f"\n{i}. 【{source}】\n   {content_preview}\n"
-        
-        output += """
+    
+    for i, doc in enumerate(source_docs, 1):
+        source = doc.metadata.get('source_name', '未知來源')
+        content_preview = doc.page_content.strip()[:150] + "..."
+        output += f"\n{i}. 【{source}】\n   {content_preview}\n"
+    
+    cache_stats = get_vectorstore().embeddings.stats()
+    output += """
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 🔍 檢索設定
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 • 搜尋範圍：{doc_filter}
 • 檢索策略：{search_type_name}
 • 結果數量：{num_results} 個文檔區塊
+• 重新排序：{rerank_note}
+• Context 壓縮：{compression_note}
 
 💡 技術說明
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -252,18 +429,151 @@ def answer_question(question, doc_filter, num_results, search_type):
 ✅ Embedding 模型：jina-embeddings-v2-base-zh
 ✅ LLM 模型：Llama 3.2
 ✅ 檢索策略：{search_type}
+✅ Embedding 快取：命中率 {cache_hit_rate:.0%}（命中 {cache_hits} / 計算 {cache_misses}）
+✅ 回答快取：{answer_cache_note}
 """.format(
-            doc_filter=doc_filter,
-            search_type_name="相似度搜尋" if search_type == "similarity" else "最大邊際相關性 (MMR)",
-            num_results=num_results,
-            search_type=search_type
+        doc_filter=scope_label(doc_filter, position),
+        search_type_name=SEARCH_TYPE_NAMES.get(search_type, search_type),
+        num_results=num_results,
+        rerank_note=(
+            f"Cross-encoder（{int(num_results) * RERANK_OVERFETCH} 個候選 → {num_results} 個，"
+            f"分數快取命中率 {reranker.stats()['hit_rate']:.0%}）"
+            if rerank else "未啟用"
+        ),
+        compression_note=(
+            "使用快取回答，未送出 prompt" if cached_from else format_compression_stats(compression)
+        ),
+        search_type=search_type,
+        cache_hit_rate=cache_stats["hit_rate"],
+        cache_hits=cache_stats["memory_hits"] + cache_stats["disk_hits"],
+        cache_misses=cache_stats["misses"],
+        answer_cache_note=(
+            f"命中（相似問題：{cached_from['question']}，相似度 {cached_from['similarity']:.3f}）"
+            if cached_from else "未命中，已即時生成"
+        )
+    )
+    
+    return output.strip()
+
+# 💡 AI 提示：加入進階功能
+# Prompt: "為問答系統加入對話歷史記錄功能，使用 ChatMessageHistory 保存多輪對話"
+async def prepare_question(vectorstore, question, doc_filter, num_results, search_type, rerank, position):
+    """
+    在執行緒池中計算問題 embedding 並查詢語意回答快取
+    （問題的 embedding 會由 embedding 快取留給後續檢索使用）
+
+    在取得 request_limiter 之前執行：快取命中的請求不必排在 LLM 生成後面
+
+    回傳：(scope, query_vector, 快取的回答或 None)
+    """
+    scope = (doc_filter, int(num_results), search_type, bool(rerank), position)
+    query_vector = await run_in_thread(vectorstore.embeddings.embed_query, question)
+    cached = await run_in_thread(answer_cache.lookup, question, scope, query_vector)
+    return scope, query_vector, cached
+
+async def answer_question(question, doc_filter, num_results, search_type, rerank=False, position=ALL_POSITIONS):
+    """回答使用者問題（非同步，阻塞的檢索在執行緒池中執行）"""
+    if not question.strip():
+        return "⚠️ 請輸入您的問題"
+    
+    try:
+        vectorstore = await run_in_thread(get_vectorstore)
+    except Exception as e:
+        return vectorstore_unavailable_message(e)
+    
+    try:
+        scope, query_vector, cached = await prepare_question(
+            vectorstore, question, doc_filter, num_results, search_type, rerank, position
         )
+        if cached:
+            return format_answer_output(
+                question, cached["answer"], cached["source_docs"],
+                doc_filter, num_results, search_type, rerank, cached_from=cached, position=position
+            )
+        
+        # 使用預先建立的 RAG Chain：一次檢索同時取得回答與來源文檔（只有執行 chain 時受並行上限控制）
+        rag_chain = await run_in_thread(get_rag_chain, *scope)
+        async with request_limiter:
+            result = await rag_chain.ainvoke(question)
+        answer_cache.store(question, scope, query_vector, result["answer"], result["context"])
         
-        return output.strip()
+        return format_answer_output(
+            question, result["answer"], result["context"],
+            doc_filter, num_results, search_type, rerank, result["compressed"]["stats"], position=position
+        )
         
     except Exception as e:
         return f"❌ 發生錯誤：{str(e)}"
 
+# 💡 AI 提示：串流輸出
+# Prompt: "使用 chain.astream() 先顯示檢索到的來源文檔，再逐字串流 AI 回答到 Gradio"
+async def answer_question_stream(question, doc_filter, num_results, search_type, rerank=False,
+                                 position=ALL_POSITIONS):
+    """串流回答使用者問題：先顯示來源文檔，再逐步顯示 AI 回答"""
+    if not question.strip():
+        yield "⚠️ 請輸入您的問題"
+        return
+    
+    try:
+        vectorstore = await run_in_thread(get_vectorstore)
+    except Exception as e:
+        yield vectorstore_unavailable_message(e)
+        return
+    
+    answer = ""
+    source_docs = []
+    compression = None
+    
+    try:
+        scope, query_vector, cached = await prepare_question(
+            vectorstore, question, doc_filter, num_results, search_type, rerank, position
+        )
+        if cached:
+            yield format_answer_output(
+                question, cached["answer"], cached["source_docs"],
+                doc_filter, num_results, search_type, rerank, cached_from=cached, position=position
+            )
+            return
+        
+        rag_chain = await run_in_thread(get_rag_chain, *scope)
+        
+        queue = request_limiter.stats()
+        if queue["active"] >= queue["max_concurrent"]:
+            yield f"⏳ 目前使用人數較多，排隊中（前面還有 {queue['waiting']} 個請求）..."
+        
+        # 只有執行 chain（檢索與 LLM 生成）時受並行上限控制
+        async with request_limiter:
+            # 串流輸出依序為 question、context（檢索完成）、compressed（壓縮完成）、answer（逐個 token）
+            async for chunk in rag_chain.astream(question):
+                if "context" in chunk:
+                    source_docs = chunk["context"]
+                elif "compressed" in chunk:
+                    compression = chunk["compressed"]["stats"]
+                elif "answer" in chunk:
+                    answer += chunk["answer"]
+                else:
+                    continue
+                
+                yield format_answer_output(
+                    question, answer or "⏳ 正在生成回答...", source_docs,
+                    doc_filter, num_results, search_type, rerank, compression, position=position
+                )
+        
+        answer_cache.store(question, scope, query_vector, answer, source_docs)
+        
+    except Exception as e:
+        yield f"❌ 發生錯誤：{str(e)}"
+
+async def respond(question, doc_filter, num_results, search_type, rerank, stream_output, position=ALL_POSITIONS):
+    """依設定選擇串流或一次性輸出"""
+    if stream_output:
+        async for output in answer_question_stream(
+            question, doc_filter, num_results, search_type, rerank, position
+        ):
+            yield output
+    else:
+        yield await answer_question(question, doc_filter, num_results, search_type, rerank, position)
+
 # 預設範例問題
 examples = [
     ["如何設定 WiFi？", "路由器設定手冊", 3, "similarity"],
@@ -271,6 +581,8 @@ examples = [
     ["洗衣機如何清潔？", "洗衣機使用說明", 3, "similarity"],
     ["冷氣機如何保養？", "冷氣機安裝維護手冊", 3, "similarity"],
     ["信用卡有什麼優惠？", "信用卡權益說明", 3, "similarity"],
+    ["WPA3 加密要怎麼設定？", "路由器設定手冊", 3, "hybrid"],
+    ["押金什麼時候會退還？", "全部文檔", 3, "two_stage"],
 ]
 
 # 建立 Gradio 介面
@@ -324,10 +636,28 @@ with gr.Blocks(title="智慧文檔問答系統", theme=gr.themes.Soft()) as demo
                     label="檢索策略",
                     choices=[
                         ("相似度搜尋 (Similarity)", "similarity"),
-                        ("最大邊際相關性 (MMR)", "mmr")
+                        ("最大邊際相關性 (MMR)", "mmr"),
+                        ("混合檢索 (BM25 + 向量)", "hybrid"),
+                        ("兩階段檢索 (文檔摘要 → 區塊，適用全部文檔)", "two_stage")
                     ],
                     value="similarity"
                 )
+                
+                position = gr.Radio(
+                    label="文檔位置（與文檔範圍以 AND 組合過濾，例如只搜尋手冊後段的疑難排解）",
+                    choices=[ALL_POSITIONS, *POSITION_BUCKETS],
+                    value=ALL_POSITIONS
+                )
+                
+                rerank = gr.Checkbox(
+                    label=f"Cross-encoder 重新排序（先取 {RERANK_OVERFETCH} 倍候選，再保留最相關的區塊）",
+                    value=False
+                )
+                
+                stream_output = gr.Checkbox(
+                    label="串流輸出（先顯示來源，再逐字顯示回答）",
+                    value=True
+                )
             
             submit_btn = gr.Button("🔍 搜尋答案", variant="primary", size="lg")
             
@@ -345,15 +675,19 @@ with gr.Blocks(title="智慧文檔問答系統", theme=gr.themes.Soft()) as demo
             )
     
     submit_btn.click(
-        fn=answer_question,
-        inputs=[question_input, doc_filter, num_results, search_type],
-        outputs=answer_output
+        fn=respond,
+        inputs=[question_input, doc_filter, num_results, search_type, rerank, stream_output, position],
+        outputs=answer_output,
+        # 由 request_limiter 控制同時生成的數量，Gradio 不再逐一排隊
+        concurrency_limit=None
     )
     
     question_input.submit(
-        fn=answer_question,
-        inputs=[question_input, doc_filter, num_results, search_type],
-        outputs=answer_output
+        fn=respond,
+        inputs=[question_input, doc_filter, num_results, search_type, rerank, stream_output, position],
+        outputs=answer_output,
+        # 由 request_limiter 控制同時生成的數量，Gradio 不再逐一排隊
+        concurrency_limit=None
     )
     
     gr.Markdown("""
@@ -372,6 +706,11 @@ with gr.Blocks(title="智慧文檔問答系統", theme=gr.themes.Soft()) as demo
     3. **檢索策略**
        - **Similarity**: 基於餘弦相似度的檢索
        - **MMR**: 最大邊際相關性，增加結果多樣性
+       - **Hybrid**: BM25 關鍵字檢索 + 向量檢索，以 RRF 合併，適合型號、錯誤代碼、條款編號
+       - **Two-stage**: 先以文檔摘要與章節標題挑出最相關的文檔，再只搜尋這些文檔的區塊
+       - **Metadata 索引**: 指定文檔或位置時先以倒排索引解析（複合）過濾條件取得候選區塊，只在候選中做精確的向量搜尋
+       - **Rerank**: 以 cross-encoder (bge-reranker-base) 重新排序候選區塊，可用較少的區塊得到更好的回答
+       - **Context 壓縮**: 只把與問題最相關的句子放進 prompt，縮短 LLM 處理 prompt 的時間
     
     4. **RAG Chain**
        - Retriever → Prompt Template → LLM → Answer
@@ -384,5 +723,19 @@ with gr.Blocks(title="智慧文檔問答系統", theme=gr.themes.Soft()) as demo
     """)
 
 if __name__ == "__main__":
-    demo.launch(share=False, server_name="0.0.0.0", server_port=7860)
+    if not LAZY_STARTUP:
+        try:
+            vectorstore_loader.wait()
+        except Exception as e:
+            print(f"❌ 向量資料庫初始化失敗: {e}")
+    
+    # /health 回報載入進度，/ready 在向量資料庫就緒後才回傳 200
+    # /metrics 回報請求佇列深度與等待時間
+    launch_with_health(
+        demo,
+        [vectorstore_loader, lexical_index_loader, summary_index_loader, metadata_index_loader],
+        server_name="0.0.0.0",
+        server_port=7860,
+        metrics={"requests": request_limiter.stats, "query_batching": query_batching_stats}
+    )
 
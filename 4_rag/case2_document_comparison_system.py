@@ -1,7 +1,7 @@
 """
 案例 2: 多文檔智能比較分析系統
 功能：同時檢索多個文檔，比較不同產品/服務的特點與差異
-使用技術：多檢索器 (Multiple Retrievers) + 並行鏈 (RunnableParallel) + RAG
+使用技術：批次比較檢索（單次嵌入 + 單次查詢）+ Metadata 過濾 + RAG
 
 🤖 AI 輔助提示：
 你可以使用 AI 協助完成以下任務：
@@ -24,17 +24,32 @@
 
 import gradio as gr
 from dotenv import load_dotenv
-from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import CharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema.output_parser import StrOutputParser
-from langchain.schema.runnable import RunnableParallel, RunnablePassthrough, RunnableLambda
+from langchain.schema.runnable import RunnableLambda
 from langchain_ollama.llms import OllamaLLM
 import os
+from functools import lru_cache
 from pathlib import Path
 
+from utils.async_runtime import ConcurrencyLimiter, run_in_thread
+from utils.context_compression import (
+    DEFAULT_MAX_SENTENCES,
+    DEFAULT_TOKEN_BUDGET,
+    ContextCompressor,
+    format_compression_stats,
+    merge_compression_stats,
+)
+from utils.embedding_cache import create_cached_embeddings
+from utils.incremental_index import current_index_version
+from utils.ingestion import ingest_files
+from utils.lazy_startup import BackgroundLoader, launch_with_health
+from utils.metadata_index import MULTI_VALUE_SEPARATOR, CandidateSearcher, load_or_build_metadata_index
+from utils.mmap_vector_store import load_or_export_mmap_store
+from utils.sharded_store import ShardedVectorStore
+from utils.text_splitting import load_and_split_source_file
+from utils.vectorstore_registry import get_shared_vectorstore
+
 # 載入環境變數
 load_dotenv()
 
@@ -44,6 +59,12 @@ model = OllamaLLM(model="llama3.2:latest")
 # 文檔目錄
 BOOKS_DIR = "books"
 
+# 延遲啟動：介面先啟動，embedding 模型與向量資料庫在背景載入
+# 設定 RAG_LAZY_STARTUP=0 可改回啟動前先完成載入
+LAZY_STARTUP = os.getenv("RAG_LAZY_STARTUP", "1") == "1"
+# 請求等待向量資料庫就緒的最長秒數
+STARTUP_WAIT_SECONDS = float(os.getenv("RAG_STARTUP_WAIT_SECONDS", "30"))
+
 # 可比較的文檔組合
 COMPARISON_GROUPS = {
     "家電產品": {
@@ -64,96 +85,218 @@ COMPARISON_GROUPS = {
     }
 }
 
+# 向量資料庫分片模式（環境變數 RAG_SHARD_MODE）：
+#   none   - 所有區塊放在同一個 collection，以 metadata 過濾（預設）
+#   source - 每個文檔一個 collection
+#   group  - 每個比較組合一個 collection
+SHARD_MODE = os.getenv("RAG_SHARD_MODE", "none")
+
+# 查詢使用的向量後端（環境變數 RAG_VECTOR_BACKEND）：
+#   chroma - 直接查詢 Chroma（預設）
+#   mmap   - 從 Chroma 匯出量化向量，以 mmap 開啟做精確搜尋（僅支援 RAG_SHARD_MODE=none）
+VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma")
+MMAP_DTYPE = os.getenv("RAG_MMAP_DTYPE", "float16")
+if VECTOR_BACKEND == "mmap" and SHARD_MODE != "none":
+    raise ValueError("RAG_VECTOR_BACKEND=mmap 以列索引過濾文檔，不需要分片，請設定 RAG_SHARD_MODE=none")
+
+# Context 壓縮：所有比較文檔合計的 token 預算（平均分給每個文檔，預設 0 為停用）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", str(DEFAULT_TOKEN_BUDGET)))
+CONTEXT_MAX_SENTENCES = int(os.getenv("RAG_CONTEXT_MAX_SENTENCES", str(DEFAULT_MAX_SENTENCES)))
+
+# 同時進行比較分析的請求數量上限，超過的請求排隊等待（佇列深度可由 /metrics 查詢）
+MAX_CONCURRENT_REQUESTS = int(os.getenv("RAG_MAX_CONCURRENT_REQUESTS", "4"))
+request_limiter = ConcurrencyLimiter("compare_documents", max_concurrent=MAX_CONCURRENT_REQUESTS)
+
+# 比較系統的向量資料庫目錄（RAG_SHARD_MODE=none 時使用）
+COMPARISON_DB_PATH = os.path.abspath("./db_comparison")
+
+# 文本分割設定
+SPLITTER_CONFIG = {
+    "chunk_size": 1000,
+    "chunk_overlap": 200,
+    "separator": "\n"
+}
+
 # 💡 AI 提示：優化文檔載入
 # Prompt: "為文檔載入添加快取機制，避免重複載入相同的文檔"
-def load_and_split_document(filename, doc_name):
-    """載入並分割單一文檔"""
-    file_path = os.path.join(BOOKS_DIR, filename)
-    
-    if not os.path.exists(file_path):
-        return []
-    
-    try:
-        loader = TextLoader(file_path, encoding='utf-8')
-        documents = loader.load()
-        
-        # 添加 metadata
-        for doc in documents:
-            doc.metadata["source_name"] = doc_name
-            doc.metadata["filename"] = filename
-        
-        # 分割文檔
-        text_splitter = CharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separator="\n"
-        )
-        docs = text_splitter.split_documents(documents)
-        
-        return docs
-    except Exception as e:
-        print(f"❌ 載入失敗 {doc_name}: {e}")
-        return []
+def get_ingestion_tasks():
+    """
+    取得匯入管線的工作列表（同一份文檔出現在多個組合中只匯入一次）
+
+    每個工作交給 load_and_split_source_file 在工作行程中載入並分割；
+    類別取自 COMPARISON_GROUPS，另外記錄章節標題與位置，供 metadata 索引做複合過濾
+    """
+    tasks = {}
+    for docs in COMPARISON_GROUPS.values():
+        for doc_name, filename in docs.items():
+            file_path = os.path.join(BOOKS_DIR, filename)
+            if not os.path.exists(file_path):
+                print(f"⚠️ 檔案不存在: {file_path}")
+                continue
+            extra_metadata = {"category": categories_of(doc_name)}
+            tasks[doc_name] = (file_path, doc_name, filename, SPLITTER_CONFIG, extra_metadata, True)
+    return list(tasks.items())
+
+def categories_of(doc_name):
+    """文檔所屬的所有比較組合（多個組合以 ", " 分隔）"""
+    return MULTI_VALUE_SEPARATOR.join(
+        group_name for group_name, docs in COMPARISON_GROUPS.items() if doc_name in docs
+    )
+
+def group_of(doc_name):
+    """取得文檔所屬的第一個比較組合（作為 group 分片模式的 shard 名稱）"""
+    for group_name, docs in COMPARISON_GROUPS.items():
+        if doc_name in docs:
+            return group_name
+    return "其他"
+
+def open_vectorstore(db_path, embeddings):
+    """依分片模式開啟向量資料庫"""
+    if SHARD_MODE == "source":
+        return ShardedVectorStore(db_path, embeddings)
+    if SHARD_MODE == "group":
+        return ShardedVectorStore(db_path, embeddings, shard_of=group_of)
+    return get_shared_vectorstore(db_path, embeddings)
+
+def open_query_store(db, db_path, report):
+    """依向量後端回傳查詢用的資料庫（mmap 模式會在第一次啟動時從 Chroma 匯出）"""
+    if VECTOR_BACKEND != "mmap":
+        return db
+    report("載入 mmap 向量資料庫")
+    # 向量資料庫只在目錄不存在時建立，沒有 manifest 時以區塊數量作為索引版本
+    index_version = current_index_version(db, db_path)
+    return load_or_export_mmap_store(db, os.path.join(db_path, "mmap_store"), index_version, dtype=MMAP_DTYPE)
 
 # 💡 AI 提示：優化向量資料庫
 # Prompt: "為每個文檔類別建立獨立的 collection，避免檢索時的相互干擾"
-def get_or_create_vectorstore():
+def get_or_create_vectorstore(report=None):
     """取得或建立向量資料庫"""
-    db_path = os.path.abspath("./db")
+    report = report or (lambda stage, progress=None: None)
+    # 使用與案例 1 (./db) 分開的目錄：比較系統的區塊另外記錄 category，
+    # 案例 1 的增量同步不會覆寫這些 metadata 或刪除比較系統的區塊
+    # 分片模式使用各自獨立的目錄，避免與共用 collection 混在一起
+    db_path = os.path.abspath(COMPARISON_DB_PATH if SHARD_MODE == "none" else f"./db_shards_{SHARD_MODE}")
     
-    embeddings = HuggingFaceEmbeddings(
-        model_name='jinaai/jina-embeddings-v2-base-zh'
-    )
+    # 包裝 embedding 快取，重複的問題不必重新計算向量
+    report("載入 embedding 模型")
+    embeddings = create_cached_embeddings('jinaai/jina-embeddings-v2-base-zh', micro_batch=True)
     
     # 如果資料庫已存在，直接載入
     if Path(db_path).exists():
-        print("📂 載入現有向量資料庫...")
-        return Chroma(persist_directory=db_path, embedding_function=embeddings)
+        print(f"📂 載入現有向量資料庫（分片模式：{SHARD_MODE}）...")
+        report("開啟向量資料庫")
+        return open_query_store(open_vectorstore(db_path, embeddings), db_path, report)
     
-    print("🔨 建立新的向量資料庫...")
+    print(f"🔨 建立新的向量資料庫（分片模式：{SHARD_MODE}）...")
+    db = open_vectorstore(db_path, embeddings)
     
-    # 載入所有文檔
-    all_docs = []
-    for group_name, docs in COMPARISON_GROUPS.items():
-        for doc_name, filename in docs.items():
-            docs_chunks = load_and_split_document(filename, doc_name)
-            all_docs.extend(docs_chunks)
-            print(f"✅ 載入 {doc_name}: {len(docs_chunks)} 個區塊")
+    # 平行讀取與分割文檔，區塊以固定批次嵌入並寫入
+    report("建立向量資料庫")
+    stats = ingest_files(db, get_ingestion_tasks(), load_and_split_source_file, report=report)
     
-    if not all_docs:
+    if not stats["chunks_written"]:
         raise ValueError("沒有成功載入任何文檔")
     
-    # 建立向量資料庫
-    db = Chroma.from_documents(
-        all_docs,
-        embeddings,
-        persist_directory=db_path
+    print(
+        f"✅ 向量資料庫建立完成，共 {stats['chunks_written']} 個文檔區塊，"
+        f"嵌入速度 {stats['chunks_per_second']:.1f} 區塊/秒"
     )
-    
-    print(f"✅ 向量資料庫建立完成，共 {len(all_docs)} 個文檔區塊")
-    return db
-
-# 初始化向量資料庫
-try:
-    vectorstore = get_or_create_vectorstore()
-except Exception as e:
-    print(f"❌ 向量資料庫初始化失敗: {e}")
-    vectorstore = None
+    return open_query_store(db, db_path, report)
+
+# 在背景初始化向量資料庫，不阻塞介面啟動
+vectorstore_loader = BackgroundLoader("vectorstore", get_or_create_vectorstore).start()
+
+def get_vectorstore():
+    """取得向量資料庫；背景載入尚未完成時最多等待 STARTUP_WAIT_SECONDS 秒"""
+    return vectorstore_loader.wait(timeout=STARTUP_WAIT_SECONDS)
+
+# 單一 collection 的 Chroma 後端：先以 metadata 倒排索引取得每個文檔的候選區塊，只在候選中搜尋
+# （分片模式每個 shard 本身就是候選集合，mmap 後端本身已依列索引過濾）
+USE_METADATA_INDEX = SHARD_MODE == "none" and VECTOR_BACKEND == "chroma"
+METADATA_INDEX_PATH = os.path.join(COMPARISON_DB_PATH, "metadata_index.json.gz")
+
+def create_metadata_index(report=None):
+    """載入或重建 metadata 倒排索引"""
+    db = vectorstore_loader.wait()
+    if report:
+        report("載入 metadata 索引")
+    index_version = current_index_version(db, COMPARISON_DB_PATH)
+    return load_or_build_metadata_index(db, METADATA_INDEX_PATH, index_version)
+
+metadata_index_loader = BackgroundLoader("metadata_index", create_metadata_index)
+if USE_METADATA_INDEX:
+    metadata_index_loader.start()
+
+@lru_cache(maxsize=1)
+def get_candidate_searcher():
+    """候選區塊搜尋器（快取各文檔的候選向量）"""
+    return CandidateSearcher(get_vectorstore())
+
+def query_batching_stats():
+    """查詢 embedding 微批次的批次大小與排隊延遲統計（向量資料庫載入前為空）"""
+    if not vectorstore_loader.ready:
+        return {}
+    # 快取包裝器 → 微批次包裝器
+    return get_vectorstore().embeddings.embeddings.stats()
+
+def vectorstore_unavailable_message(error):
+    """向量資料庫無法使用時的提示訊息"""
+    if isinstance(error, TimeoutError):
+        return f"⏳ 系統啟動中（{vectorstore_loader.status()['stage']}），請稍後再試"
+    return f"❌ 向量資料庫未初始化（{error}）"
+
+# 比較檢索單次查詢的取回倍數：多取一些結果，讓每個文檔都能分到 top-k
+COMPARISON_OVERFETCH = 2
 
 # 💡 AI 提示：優化檢索函數
 # Prompt: "為檢索器添加相關度過濾，只返回相似度超過閾值的結果"
-def create_retriever_for_doc(doc_name, k=3):
-    """為特定文檔建立檢索器"""
-    if not vectorstore:
-        return None
-    
-    return vectorstore.as_retriever(
-        search_type="similarity",
-        search_kwargs={
-            "k": k,
-            "filter": {"source_name": doc_name}
+def retrieve_for_comparison(question, doc_names, k=3):
+    """
+    比較檢索：問題只嵌入一次，以單次批次查詢取得每個文檔的 top-k 區塊
+    
+    回傳：{文檔名稱: [Document, ...]}
+    """
+    db = get_vectorstore()
+    doc_names = list(dict.fromkeys(doc_names))
+    query_vector = db.embeddings.embed_query(question)
+    
+    if USE_METADATA_INDEX:
+        # 每個文檔各自在候選區塊中做精確搜尋，保證每個文檔都取得 top-k，不需要多取或補查
+        metadata_index = metadata_index_loader.wait(timeout=STARTUP_WAIT_SECONDS)
+        searcher = get_candidate_searcher()
+        return {
+            name: [
+                doc for doc, _ in searcher.search(
+                    query_vector, metadata_index.resolve({"source_name": name}), k=k,
+                    index_version=metadata_index.index_version
+                )
+            ]
+            for name in doc_names
         }
+    
+    # 單次查詢：以 $in 過濾所選文檔，多取一些結果後依文檔分組
+    n_results = k * len(doc_names) * COMPARISON_OVERFETCH
+    results = db.similarity_search_by_vector_with_relevance_scores(
+        query_vector,
+        k=n_results,
+        filter={"source_name": {"$in": doc_names}}
     )
+    
+    grouped = {name: [] for name in doc_names}
+    for doc, _score in results:
+        docs = grouped.get(doc.metadata.get("source_name"))
+        if docs is not None and len(docs) < k:
+            docs.append(doc)
+    
+    # 結果被某個文檔佔滿時，其他文檔用同一個向量補查（不需重新嵌入）
+    if len(results) >= n_results:
+        for name, docs in grouped.items():
+            if len(docs) < k:
+                grouped[name] = db.similarity_search_by_vector(
+                    query_vector, k=k, filter={"source_name": name}
+                )
+    
+    return grouped
 
 def format_docs(docs):
     """格式化文檔內容"""
@@ -199,11 +342,8 @@ comparison_template = ChatPromptTemplate.from_messages([
 
 # 💡 AI 提示：加入視覺化功能
 # Prompt: "為比較報告加入圖表視覺化，使用 matplotlib 或 plotly 呈現比較結果"
-def compare_documents(question, doc1_name, doc2_name, doc3_name=None, num_results=3):
-    """比較多個文檔"""
-    if not vectorstore:
-        return "❌ 向量資料庫未初始化"
-    
+async def compare_documents(question, doc1_name, doc2_name, doc3_name=None, num_results=3):
+    """比較多個文檔（非同步，阻塞的檢索在執行緒池中執行）"""
     if not question.strip():
         return "⚠️ 請輸入比較問題"
     
@@ -211,56 +351,67 @@ def compare_documents(question, doc1_name, doc2_name, doc3_name=None, num_result
         return "⚠️ 請至少選擇兩個文檔進行比較"
     
     try:
-        # 建立檢索器
-        retriever1 = create_retriever_for_doc(doc1_name, num_results)
-        retriever2 = create_retriever_for_doc(doc2_name, num_results)
-        
-        if not retriever1 or not retriever2:
-            return "❌ 檢索器建立失敗"
-        
-        # 準備並行檢索
-        retrieval_dict = {
-            "doc1_name": RunnablePassthrough(),
-            "doc2_name": RunnablePassthrough(),
-            "question": RunnablePassthrough(),
-            "doc1_context": retriever1 | RunnableLambda(format_docs),
-            "doc2_context": retriever2 | RunnableLambda(format_docs),
-        }
-        
-        # 處理第三個文檔（可選）
-        doc3_section = ""
-        if doc3_name and doc3_name != "不選擇":
-            retriever3 = create_retriever_for_doc(doc3_name, num_results)
-            if retriever3:
-                retrieval_dict["doc3_name"] = RunnablePassthrough()
-                retrieval_dict["doc3_context"] = retriever3 | RunnableLambda(format_docs)
-                doc3_section = "{doc3_name} 的相關資料：\n{doc3_context}\n"
+        vectorstore = await run_in_thread(get_vectorstore)
+    except Exception as e:
+        return vectorstore_unavailable_message(e)
+    
+    try:
+        has_doc3 = bool(doc3_name and doc3_name != "不選擇")
+        doc_names = [doc1_name, doc2_name] + ([doc3_name] if has_doc3 else [])
+        compressor = (
+            ContextCompressor(
+                vectorstore.embeddings,
+                token_budget=CONTEXT_TOKEN_BUDGET // len(doc_names),
+                # 句子不寫入 embedding 快取（快取包裝器 → 微批次包裝器）
+                sentence_embeddings=vectorstore.embeddings.embeddings,
+                max_sentences=CONTEXT_MAX_SENTENCES
+            )
+            if CONTEXT_TOKEN_BUDGET > 0 else None
+        )
+        compression_stats = []
         
-        retrieval_dict["doc3_section"] = RunnablePassthrough()
+        def prepare_inputs(inputs):
+            """一次檢索所有文檔，填入比較 Prompt 的欄位"""
+            grouped = retrieve_for_comparison(inputs["question"], doc_names, int(num_results))
+            
+            if compressor:
+                # 每個文檔各自在預算內挑出最相關的句子，避免某個文檔佔滿整個 context
+                for doc_name in doc_names:
+                    grouped[doc_name], stats = compressor.compress(inputs["question"], grouped[doc_name])
+                    compression_stats.append(stats)
+                print(f"🗜️ Context 壓縮：{format_compression_stats(merge_compression_stats(compression_stats))}")
+            
+            prompt_inputs = {
+                "question": inputs["question"],
+                "doc1_name": doc1_name,
+                "doc2_name": doc2_name,
+                "doc1_context": format_docs(grouped[doc1_name]),
+                "doc2_context": format_docs(grouped[doc2_name]),
+                "doc3_section": ""
+            }
+            
+            # 處理第三個文檔（可選）
+            if has_doc3:
+                prompt_inputs["doc3_section"] = (
+                    f"{doc3_name} 的相關資料：\n{format_docs(grouped[doc3_name])}\n"
+                )
+            return prompt_inputs
         
-        # 建立並行檢索鏈
-        parallel_retrieval = RunnableParallel(retrieval_dict)
+        async def aprepare_inputs(inputs):
+            """檢索與 context 壓縮會阻塞，放到執行緒池執行"""
+            return await run_in_thread(prepare_inputs, inputs)
         
         # 建立完整的比較鏈
         comparison_chain = (
-            parallel_retrieval
+            RunnableLambda(prepare_inputs, afunc=aprepare_inputs)
             | comparison_template
             | model
             | StrOutputParser()
         )
         
-        # 執行比較
-        input_data = {
-            "question": question,
-            "doc1_name": doc1_name,
-            "doc2_name": doc2_name,
-            "doc3_section": doc3_section
-        }
-        
-        if doc3_name and doc3_name != "不選擇":
-            input_data["doc3_name"] = doc3_name
-        
-        result = comparison_chain.invoke(input_data)
+        # 執行比較（超過同時請求上限時在此排隊）
+        async with request_limiter:
+            result = await comparison_chain.ainvoke({"question": question})
         
         # 格式化輸出
         output = f"""
@@ -285,10 +436,11 @@ def compare_documents(question, doc1_name, doc2_name, doc3_name=None, num_result
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 🔍 技術說明
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-✅ 使用並行檢索 (RunnableParallel) 同時查詢多個文檔
+✅ 問題只嵌入一次，以單次批次查詢同時檢索多個文檔
 ✅ 基於向量相似度找出最相關的資訊
 ✅ 使用專門的比較 Prompt 進行深度分析
 ✅ 每個文檔檢索 {num_results} 個最相關區塊
+✅ Context 壓縮：{compression_note}
 
 💡 應用場景
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -302,7 +454,8 @@ def compare_documents(question, doc1_name, doc2_name, doc3_name=None, num_result
             doc2_name=doc2_name,
             doc3_info=f"3. {doc3_name}" if doc3_name and doc3_name != "不選擇" else "",
             result=result,
-            num_results=num_results
+            num_results=num_results,
+            compression_note=format_compression_stats(merge_compression_stats(compression_stats))
         )
         
         return output.strip()
@@ -404,13 +557,17 @@ with gr.Blocks(title="多文檔智能比較系統", theme=gr.themes.Soft()) as d
     compare_btn.click(
         fn=compare_documents,
         inputs=[question_input, doc1_select, doc2_select, doc3_select, num_results],
-        outputs=comparison_output
+        outputs=comparison_output,
+        # 由 request_limiter 控制同時分析的數量，Gradio 不再逐一排隊
+        concurrency_limit=None
     )
     
     question_input.submit(
         fn=compare_documents,
         inputs=[question_input, doc1_select, doc2_select, doc3_select, num_results],
-        outputs=comparison_output
+        outputs=comparison_output,
+        # 由 request_limiter 控制同時分析的數量，Gradio 不再逐一排隊
+        concurrency_limit=None
     )
     
     gr.Markdown("""
@@ -419,16 +576,16 @@ with gr.Blocks(title="多文檔智能比較系統", theme=gr.themes.Soft()) as d
     
     **核心技術架構**：
     
-    1. **並行檢索 (RunnableParallel)**
+    1. **批次比較檢索**
        ```python
-       parallel_retrieval = RunnableParallel(
-           doc1_context=retriever1,
-           doc2_context=retriever2,
-           doc3_context=retriever3
+       query_vector = embeddings.embed_query(question)
+       results = db.similarity_search_by_vector_with_relevance_scores(
+           query_vector, k=k * len(doc_names) * 2,
+           filter={"source_name": {"$in": doc_names}}
        )
        ```
-       - 同時查詢多個文檔，提升效率
-       - 每個檢索器使用 metadata 過濾特定文檔
+       - 問題只嵌入一次，單次查詢取得所有文檔的結果
+       - 再依 `source_name` 分組，每個文檔取 top-k
     
     2. **比較 Chain 架構**
        ```
@@ -456,5 +613,19 @@ with gr.Blocks(title="多文檔智能比較系統", theme=gr.themes.Soft()) as d
     """)
 
 if __name__ == "__main__":
-    demo.launch(share=False, server_name="0.0.0.0", server_port=7861)
+    if not LAZY_STARTUP:
+        try:
+            vectorstore_loader.wait()
+        except Exception as e:
+            print(f"❌ 向量資料庫初始化失敗: {e}")
+    
+    # /health 回報載入進度，/ready 在向量資料庫就緒後才回傳 200
+    # /metrics 回報請求佇列深度與等待時間
+    launch_with_health(
+        demo,
+        [vectorstore_loader] + ([metadata_index_loader] if USE_METADATA_INDEX else []),
+        server_name="0.0.0.0",
+        server_port=7861,
+        metrics={"requests": request_limiter.stats, "query_batching": query_batching_stats}
+    )
 
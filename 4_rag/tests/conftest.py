@@ -0,0 +1,68 @@
+"""
+4_rag 工具模組測試的共用設定
+功能：把 4_rag 加入 sys.path（與各案例相同，以 `from utils.x import ...` 匯入），
+      並提供不需要 Chroma 與 embedding 模型的假向量資料庫
+
+執行方式（在 4_rag 目錄下）：
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeCollection:
+    """模擬 Chroma collection 的 update（只更新 metadata）"""
+
+    def __init__(self, store):
+        self.store = store
+        self.updates = 0
+
+    def update(self, ids, metadatas):
+        for chunk_id, metadata in zip(ids, metadatas):
+            self.store.records[chunk_id] = (self.store.records[chunk_id][0], dict(metadata))
+        self.updates += len(ids)
+
+
+class FakeVectorStore:
+    """
+    只實作增量索引用到的 Chroma 介面：get、delete、add_documents、_collection.update
+
+    records: {區塊 ID: (文字, metadata)}，依寫入順序保存
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.added = 0
+        self.deleted = 0
+        self._collection = FakeCollection(self)
+
+    def get(self, ids=None, include=None):
+        include = include or []
+        selected = [chunk_id for chunk_id in (ids if ids is not None else self.records) if chunk_id in self.records]
+        data = {"ids": selected}
+        if "documents" in include:
+            data["documents"] = [self.records[chunk_id][0] for chunk_id in selected]
+        if "metadatas" in include:
+            data["metadatas"] = [dict(self.records[chunk_id][1]) for chunk_id in selected]
+        return data
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            if self.records.pop(chunk_id, None) is not None:
+                self.deleted += 1
+
+    def add_documents(self, documents, ids=None):
+        for chunk_id, doc in zip(ids, documents):
+            self.records[chunk_id] = (doc.page_content, dict(doc.metadata))
+        self.added += len(documents)
+        return list(ids)
+
+
+@pytest.fixture
+def fake_db():
+    return FakeVectorStore()
@@ -0,0 +1,106 @@
+"""
+語意回答快取測試：相似度門檻、檢索設定、TTL、LRU 淘汰與索引版本失效
+"""
+
+import types
+
+import pytest
+
+from utils import answer_cache
+from utils.answer_cache import SemanticAnswerCache
+
+SCOPE = ("全部文檔", 3, "similarity")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手動推進的時鐘"""
+    now = {"value": 1000.0}
+    monkeypatch.setattr(answer_cache, "time", types.SimpleNamespace(monotonic=lambda: now["value"]))
+    return now
+
+
+def test_similar_question_hits_above_threshold():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store("押金什麼時候退還？", SCOPE, [1.0, 0.0, 0.0], "退租後 30 天內", ["doc"])
+
+    hit = cache.lookup("押金何時退？", SCOPE, [0.99, 0.05, 0.0])
+
+    assert hit["answer"] == "退租後 30 天內"
+    assert hit["source_docs"] == ["doc"]
+    assert hit["similarity"] >= 0.95
+
+
+def test_question_below_threshold_misses():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store("押金什麼時候退還？", SCOPE, [1.0, 0.0, 0.0], "退租後 30 天內", [])
+
+    assert cache.lookup("可以養寵物嗎？", SCOPE, [0.6, 0.8, 0.0]) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_different_scope_misses():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store("押金什麼時候退還？", SCOPE, [1.0, 0.0], "退租後 30 天內", [])
+
+    assert cache.lookup("押金什麼時候退還？", ("租賃合約", 3, "similarity"), [1.0, 0.0]) is None
+
+
+def test_best_match_among_entries():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("問題一", SCOPE, [1.0, 0.0], "回答一", [])
+    cache.store("問題二", SCOPE, [0.0, 1.0], "回答二", [])
+
+    assert cache.lookup("相近的問題", SCOPE, [0.1, 0.99])["answer"] == "回答二"
+
+
+def test_expired_entries_are_dropped(clock):
+    cache = SemanticAnswerCache(ttl_seconds=60)
+    cache.store("問題", SCOPE, [1.0, 0.0], "回答", [])
+
+    clock["value"] += 30
+    assert cache.lookup("問題", SCOPE, [1.0, 0.0]) is not None
+
+    clock["value"] += 61
+    assert cache.lookup("問題", SCOPE, [1.0, 0.0]) is None
+    stats = cache.stats()
+    assert stats["expired"] == 1
+    assert stats["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticAnswerCache(threshold=0.99, max_entries=2)
+    cache.store("問題一", SCOPE, [1.0, 0.0, 0.0], "回答一", [])
+    cache.store("問題二", SCOPE, [0.0, 1.0, 0.0], "回答二", [])
+    # 使用問題一後，問題二成為最久未使用的項目
+    assert cache.lookup("問題一", SCOPE, [1.0, 0.0, 0.0]) is not None
+
+    cache.store("問題三", SCOPE, [0.0, 0.0, 1.0], "回答三", [])
+
+    assert cache.lookup("問題二", SCOPE, [0.0, 1.0, 0.0]) is None
+    assert cache.lookup("問題一", SCOPE, [1.0, 0.0, 0.0])["answer"] == "回答一"
+    assert cache.lookup("問題三", SCOPE, [0.0, 0.0, 1.0])["answer"] == "回答三"
+    assert cache.stats()["evicted"] == 1
+
+
+def test_index_version_change_invalidates():
+    version = {"value": 1}
+    cache = SemanticAnswerCache(index_version_fn=lambda: version["value"])
+    cache.store("問題", SCOPE, [1.0, 0.0], "回答", [])
+    assert cache.lookup("問題", SCOPE, [1.0, 0.0]) is not None
+
+    version["value"] = 2
+
+    assert cache.lookup("問題", SCOPE, [1.0, 0.0]) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_dimension_change_resets_matrix():
+    cache = SemanticAnswerCache()
+    cache.store("問題", SCOPE, [1.0, 0.0], "回答", [])
+
+    assert cache.lookup("另一個問題", SCOPE, [1.0, 0.0, 0.0]) is None
+
+    cache.store("另一個問題", SCOPE, [1.0, 0.0, 0.0], "新回答", [])
+    assert cache.lookup("另一個問題", SCOPE, [1.0, 0.0, 0.0])["answer"] == "新回答"
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,103 @@
+"""
+Token 預算聊天歷史測試：預算內保留原文、超出預算時背景摘要、摘要失敗時保留原文
+"""
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from utils.chat_history import MESSAGE_OVERHEAD_TOKENS, TokenBudgetHistory
+
+
+class CharTokenHistory(TokenBudgetHistory):
+    """以字元數代替 tiktoken 計算 token（測試不需要下載編碼檔）"""
+
+    def count_tokens(self, text):
+        return len(text)
+
+
+class FakeSummarizeChain:
+    """把新的對話附加到摘要後面"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def invoke(self, inputs):
+        self.calls.append(inputs)
+        if self.fail:
+            raise RuntimeError("摘要服務無法使用")
+        return f"摘要{len(self.calls)}"
+
+
+# 每輪對話：問題 2 字 + 回答 2 字 + 兩則訊息的開銷
+TURN_TOKENS = 4 + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def make_history(chain, max_turns, keep_recent_turns=1):
+    return CharTokenHistory(chain, max_tokens=TURN_TOKENS * max_turns, keep_recent_turns=keep_recent_turns)
+
+
+def test_turns_within_budget_are_kept_verbatim():
+    chain = FakeSummarizeChain()
+    history = make_history(chain, max_turns=3)
+    history.add_turn("問一", "答一")
+    history.add_turn("問二", "答二")
+    history.wait()
+
+    assert chain.calls == []
+    assert [message.content for message in history.messages()] == ["問一", "答一", "問二", "答二"]
+    assert isinstance(history.messages()[0], HumanMessage)
+    assert isinstance(history.messages()[1], AIMessage)
+
+
+def test_older_turns_are_folded_into_summary():
+    chain = FakeSummarizeChain()
+    history = make_history(chain, max_turns=3)
+    for i in range(1, 5):
+        history.add_turn(f"問{i}", f"答{i}")
+    history.wait()
+
+    assert len(chain.calls) == 1
+    assert "問1" in chain.calls[0]["new_lines"]
+    messages = history.messages()
+    assert isinstance(messages[0], SystemMessage)
+    assert messages[0].content.endswith("摘要1")
+    assert messages[-2].content == "問4"
+    assert sum(history.count_tokens(m.content) + MESSAGE_OVERHEAD_TOKENS for m in messages) <= history.max_tokens
+
+    stats = history.stats()
+    assert stats["turns"] == 4
+    assert stats["summarized_turns"] == 1
+    assert stats["pending_summary_turns"] == 0
+
+
+def test_recent_turns_are_never_summarized():
+    chain = FakeSummarizeChain()
+    history = make_history(chain, max_turns=1, keep_recent_turns=2)
+    history.add_turn("問1", "答1")
+    history.add_turn("問2", "答2")
+    history.wait()
+
+    assert chain.calls == []
+    # 超出預算時仍至少保留最近一輪
+    assert [message.content for message in history.messages()] == ["問2", "答2"]
+
+
+def test_failed_summary_keeps_turns_for_retry():
+    chain = FakeSummarizeChain(fail=True)
+    history = make_history(chain, max_turns=2)
+    for i in range(1, 4):
+        history.add_turn(f"問{i}", f"答{i}")
+    history.wait()
+
+    stats = history.stats()
+    assert history.summary == ""
+    assert stats["verbatim_turns"] == 3
+    assert stats["pending_summary_turns"] == 1
+
+    chain.fail = False
+    history.add_turn("問4", "答4")
+    history.wait()
+
+    # 先前失敗的對話與新移出的對話一起摘要
+    assert "問1" in chain.calls[-1]["new_lines"]
+    assert history.stats()["summarized_turns"] >= 2
@@ -0,0 +1,71 @@
+"""
+問題上下文化閘門測試：needs_rewrite 的判斷與改寫快取
+"""
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.contextualize import QuestionContextualizer
+
+HISTORY = [HumanMessage(content="路由器怎麼設定 WiFi？"), AIMessage(content="進入管理介面的無線設定頁面。")]
+
+
+class FakeRewriteChain:
+    """記錄呼叫次數的改寫鏈"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, inputs):
+        self.calls += 1
+        return f"改寫：{inputs['input']}"
+
+
+@pytest.fixture
+def contextualizer():
+    return QuestionContextualizer(FakeRewriteChain())
+
+
+def test_no_history_never_rewrites(contextualizer):
+    assert contextualizer.needs_rewrite("它支援 5GHz 嗎？", []) == (False, "skipped_no_history")
+
+
+@pytest.mark.parametrize("question", [
+    "它支援 5GHz 嗎？",
+    "那洗衣機呢？",
+    "上述的設定要重開機嗎？",
+    "為什麼？",
+    "多少錢？",
+    "怎麼設定？",
+    "Why?",
+    "What about the guest network?",
+    "Does it support WPA3?",
+])
+def test_follow_up_questions_are_rewritten(contextualizer, question):
+    assert contextualizer.needs_rewrite(question, HISTORY) == (True, "reference")
+
+
+@pytest.mark.parametrize("question", [
+    "洗衣機出現錯誤代碼 E03 該怎麼處理？",
+    "租賃合約中押金什麼時候會退還？",
+    "其它品牌的路由器也能使用這份手冊嗎",
+    "什麼是RAG？",
+    "如何安裝Python",
+    "押金怎麼算？",
+    "How do I reset the router to factory settings?",
+])
+def test_standalone_questions_skip_rewrite(contextualizer, question):
+    assert contextualizer.needs_rewrite(question, HISTORY) == (False, "skipped_heuristic")
+
+
+def test_rewrite_results_are_cached(contextualizer):
+    inputs = {"input": "它支援 5GHz 嗎？", "chat_history": HISTORY}
+
+    assert contextualizer.contextualize(inputs) == "改寫：它支援 5GHz 嗎？"
+    assert contextualizer.contextualize(inputs) == "改寫：它支援 5GHz 嗎？"
+
+    assert contextualizer.rewrite_chain.calls == 1
+    stats = contextualizer.stats()
+    assert stats["llm_calls"] == 1
+    assert stats["cache_hits"] == 1
+    assert stats["saved_round_trips"] == 1
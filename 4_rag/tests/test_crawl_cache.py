@@ -0,0 +1,97 @@
+"""
+網頁爬取快取測試：以 LocalFileFetcher 模擬網站，驗證 CrawlCache.refresh 的增量行為
+"""
+
+import os
+
+import pytest
+
+from utils.crawl_cache import CrawlCache, LocalFileFetcher
+
+PAGE = "https://example.com/docs/setup"
+OTHER_PAGE = "https://example.com/docs/faq"
+
+
+@pytest.fixture
+def site(tmp_path):
+    fetcher = LocalFileFetcher(str(tmp_path / "site"))
+
+    def write(url, content):
+        path = fetcher.path_for(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    fetcher.write = write
+    return fetcher
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return CrawlCache(str(tmp_path / "crawl_cache"))
+
+
+def test_first_refresh_adds_pages(cache, site):
+    site.write(PAGE, "# 安裝步驟")
+    site.write(OTHER_PAGE, "# 常見問題")
+
+    stats = cache.refresh([PAGE, OTHER_PAGE], site)
+
+    assert stats["added"] == 2
+    with open(cache.page_path(PAGE), "r", encoding="utf-8") as f:
+        assert f.read() == "# 安裝步驟"
+    assert {url for url, _ in cache.sources().values()} == {PAGE, OTHER_PAGE}
+
+
+def test_unchanged_page_is_not_modified(cache, site):
+    site.write(PAGE, "# 安裝步驟")
+    cache.refresh([PAGE], site)
+
+    stats = cache.refresh([PAGE], site)
+
+    assert stats["not_modified"] == 1
+    assert stats["added"] == stats["changed"] == 0
+
+
+def test_changed_page_is_rewritten(cache, site):
+    site.write(PAGE, "# 安裝步驟")
+    cache.refresh([PAGE], site)
+
+    site.write(PAGE, "# 安裝步驟（更新版）")
+    stats = cache.refresh([PAGE], site)
+
+    assert stats["changed"] == 1
+    with open(cache.page_path(PAGE), "r", encoding="utf-8") as f:
+        assert f.read() == "# 安裝步驟（更新版）"
+
+
+def test_urls_dropped_from_list_are_removed(cache, site):
+    site.write(PAGE, "# 安裝步驟")
+    site.write(OTHER_PAGE, "# 常見問題")
+    cache.refresh([PAGE, OTHER_PAGE], site)
+
+    stats = cache.refresh([PAGE], site)
+
+    assert stats["removed"] == 1
+    assert [url for url, _ in cache.sources().values()] == [PAGE]
+    assert not os.path.exists(cache.page_path(OTHER_PAGE))
+
+
+def test_failed_fetch_is_counted(cache, site):
+    site.write(PAGE, "# 安裝步驟")
+    cache.refresh([PAGE], site)
+
+    stats = cache.refresh([PAGE, OTHER_PAGE], site)
+
+    assert stats["failed"] == 1
+    assert stats["not_modified"] == 1
+    assert [url for url, _ in cache.sources().values()] == [PAGE]
+
+
+def test_index_persists_across_instances(cache, site, tmp_path):
+    site.write(PAGE, "# 安裝步驟")
+    cache.refresh([PAGE], site)
+
+    reopened = CrawlCache(str(tmp_path / "crawl_cache"))
+
+    assert reopened.refresh([PAGE], site)["not_modified"] == 1
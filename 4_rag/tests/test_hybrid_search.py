@@ -0,0 +1,128 @@
+"""
+混合檢索測試：中英混合分詞、BM25 計分與過濾、依 ID 從向量資料庫取回內容、RRF 合併
+"""
+
+import gzip
+import json
+
+import pytest
+from langchain_core.documents import Document
+
+from utils.hybrid_search import BM25Index, load_or_build_lexical_index, reciprocal_rank_fusion, tokenize
+
+IDS = ["wifi", "e21", "e03", "deposit"]
+TEXTS = [
+    "路由器 AX-3000 支援 802.11ax 無線網路",
+    "洗衣機顯示錯誤代碼 E21 表示排水異常",
+    "洗衣機顯示錯誤代碼 E03 表示門未關好",
+    "租約結束後押金於三十天內退還",
+]
+METADATAS = [
+    {"source_name": "路由器設定手冊"},
+    {"source_name": "洗衣機使用說明"},
+    {"source_name": "洗衣機使用說明"},
+    {"source_name": "租賃合約"},
+]
+
+
+@pytest.fixture
+def db(fake_db):
+    for chunk_id, text, metadata in zip(IDS, TEXTS, METADATAS):
+        fake_db.records[chunk_id] = (text, metadata)
+    return fake_db
+
+
+@pytest.fixture
+def index(db):
+    return BM25Index.build(IDS, TEXTS, index_version=1, vectorstore=db)
+
+
+def test_tokenize_keeps_model_numbers_and_parts():
+    tokens = tokenize("AX-3000 支援 802.11ax")
+
+    assert "ax-3000" in tokens
+    assert {"ax", "3000"} <= set(tokens)
+    assert {"802.11ax", "802", "11ax"} <= set(tokens)
+
+
+def test_tokenize_chinese_unigrams_and_bigrams():
+    assert tokenize("押金退還") == ["押", "金", "退", "還", "押金", "金退", "退還"]
+
+
+def test_tokenize_normalizes_full_width():
+    assert tokenize("ＡＸ－３０００") == tokenize("ax-3000")
+
+
+def test_exact_code_ranks_first(index):
+    results = index.search("錯誤代碼 E21", k=2)
+
+    assert results[0][0].id == "e21"
+    assert results[0][1] > results[1][1]
+    # 文字與 metadata 由向量資料庫取回
+    assert results[0][0].page_content == TEXTS[1]
+    assert results[0][0].metadata == METADATAS[1]
+
+
+def test_chunks_deleted_from_store_are_skipped(index, db):
+    db.delete(ids=["e21"])
+
+    assert [doc.id for doc, _ in index.search("錯誤代碼 E21", k=2)] == ["e03"]
+
+
+def test_search_respects_filter(index):
+    results = index.search("錯誤代碼", k=5, filter={"source_name": "洗衣機使用說明"})
+
+    assert {doc.id for doc, _ in results} == {"e21", "e03"}
+    assert index.search("押金", k=5, filter={"source_name": "洗衣機使用說明"}) == []
+
+
+def test_unknown_terms_return_nothing(index):
+    assert index.search("xyz-999", k=3) == []
+
+
+def test_save_and_load_round_trip(index, db, tmp_path):
+    path = str(tmp_path / "lexical_index.json.gz")
+    index.save(path)
+
+    loaded = BM25Index.load(path, vectorstore=db)
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        saved = json.load(f)
+    assert "texts" not in saved and "metadatas" not in saved
+    assert loaded.index_version == 1
+    assert [(doc.id, score) for doc, score in loaded.search("押金", k=2)] == \
+        [(doc.id, score) for doc, score in index.search("押金", k=2)]
+
+
+def test_load_or_build_rebuilds_on_version_change(db, tmp_path):
+    path = str(tmp_path / "lexical_index.json.gz")
+
+    assert load_or_build_lexical_index(db, path, 1).index_version == 1
+    db.records.pop("deposit")
+    rebuilt = load_or_build_lexical_index(db, path, 2)
+
+    assert rebuilt.index_version == 2
+    assert "押" not in rebuilt.postings
+    assert rebuilt.search("押金", k=3) == []
+
+
+def test_old_format_is_rebuilt(db, tmp_path):
+    path = str(tmp_path / "lexical_index.json.gz")
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump({"k1": 1.5, "b": 0.75, "index_version": 1, "doc_ids": [], "texts": [], "metadatas": [],
+                   "doc_lengths": [], "postings": {}}, f)
+
+    index = load_or_build_lexical_index(db, path, 1)
+
+    assert index.doc_ids == IDS
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    a = Document(page_content="甲", metadata={"filename": "a.txt"})
+    b = Document(page_content="乙", metadata={"filename": "a.txt"})
+    c = Document(page_content="丙", metadata={"filename": "b.txt"})
+
+    fused = reciprocal_rank_fusion([[a, b], [c, b]])
+
+    # b 在兩組都出現，排名最前；相同內容只保留一份
+    assert [doc.page_content for doc in fused] == ["乙", "甲", "丙"]
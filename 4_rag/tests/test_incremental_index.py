@@ -0,0 +1,219 @@
+"""
+增量索引測試：區塊 ID、sync_vector_store 的新增/變更/刪除/改名、分割設定變更、
+讀取失敗時保留舊區塊，以及 manifest 格式版本升級
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.documents import Document
+
+from utils import incremental_index, ingestion
+from utils.incremental_index import (
+    MANIFEST_VERSION,
+    assign_chunk_ids,
+    load_manifest,
+    manifest_path,
+    sync_vector_store,
+)
+
+SPLITTER = {"chunk_size": 100, "chunk_overlap": 0}
+
+
+def split_paragraphs(file_path, doc_name, filename):
+    """以空行分割段落；內容含 BROKEN 時模擬讀取失敗"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if "BROKEN" in text:
+        raise ValueError("無法解析")
+    return [
+        Document(page_content=part.strip(), metadata={"source_name": doc_name, "filename": filename})
+        for part in text.split("\n\n")
+        if part.strip()
+    ]
+
+
+@pytest.fixture(autouse=True)
+def in_process_executor(monkeypatch):
+    """測試中以執行緒代替行程池，分割函數不需要被 pickle"""
+    monkeypatch.setattr(ingestion, "create_executor", lambda max_workers: ThreadPoolExecutor(max_workers))
+
+
+@pytest.fixture
+def books(tmp_path):
+    books_dir = tmp_path / "books"
+    books_dir.mkdir()
+
+    def write(filename, *paragraphs):
+        path = books_dir / filename
+        path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+        return str(path)
+
+    return write
+
+
+def sync(db, db_path, sources, splitter=SPLITTER):
+    return sync_vector_store(db, db_path, sources, split_paragraphs, splitter, max_workers=2)
+
+
+def test_assign_chunk_ids_distinguishes_duplicate_chunks():
+    chunks = [Document(page_content="相同內容"), Document(page_content="不同內容"), Document(page_content="相同內容")]
+    ids = assign_chunk_ids("a.txt", chunks)
+
+    assert len(set(ids)) == 3
+    assert ids[0].rsplit("-", 1)[0] == ids[2].rsplit("-", 1)[0]
+    assert ids[0].endswith("-0") and ids[2].endswith("-1")
+    # 內容不變則 ID 不變；不同檔名的相同內容得到不同 ID
+    assert assign_chunk_ids("a.txt", chunks) == ids
+    assert assign_chunk_ids("b.txt", chunks)[0] != ids[0]
+
+
+def test_initial_sync_adds_all_chunks(fake_db, tmp_path, books):
+    a = books("a.txt", "第一段", "第二段")
+    b = books("b.txt", "第三段")
+
+    stats = sync(fake_db, str(tmp_path / "db"), {a: ("文檔A", "a.txt"), b: ("文檔B", "b.txt")})
+
+    assert stats["added"] == 3
+    assert stats["files_changed"] == 2
+    assert stats["index_version"] == 1
+    assert len(fake_db.records) == 3
+    manifest = load_manifest(str(tmp_path / "db"))
+    assert set(manifest["files"]) == {"a.txt", "b.txt"}
+
+
+def test_unchanged_sync_does_nothing(fake_db, tmp_path, books):
+    db_path = str(tmp_path / "db")
+    sources = {books("a.txt", "第一段", "第二段"): ("文檔A", "a.txt")}
+    sync(fake_db, db_path, sources)
+
+    stats = sync(fake_db, db_path, sources)
+
+    assert stats["unchanged"] == 2
+    assert stats["added"] == stats["deleted"] == stats["files_changed"] == 0
+    assert stats["index_version"] == 1
+
+
+def test_changed_file_only_replaces_changed_chunks(fake_db, tmp_path, books):
+    db_path = str(tmp_path / "db")
+    sources = {books("a.txt", "第一段", "第二段"): ("文檔A", "a.txt")}
+    sync(fake_db, db_path, sources)
+
+    books("a.txt", "第一段", "修改後的第二段", "第三段")
+    stats = sync(fake_db, db_path, sources)
+
+    assert stats["added"] == 2
+    assert stats["deleted"] == 1
+    assert stats["unchanged"] == 1
+    assert stats["index_version"] == 2
+    assert sorted(text for text, _ in fake_db.records.values()) == sorted(["第一段", "修改後的第二段", "第三段"])
+
+
+def test_removed_file_deletes_its_chunks(fake_db, tmp_path, books):
+    db_path = str(tmp_path / "db")
+    a = books("a.txt", "第一段")
+    b = books("b.txt", "第二段", "第三段")
+    sync(fake_db, db_path, {a: ("文檔A", "a.txt"), b: ("文檔B", "b.txt")})
+
+    stats = sync(fake_db, db_path, {a: ("文檔A", "a.txt")})
+
+    assert stats["files_removed"] == 1
+    assert stats["deleted"] == 2
+    assert [text for text, _ in fake_db.records.values()] == ["第一段"]
+    assert set(load_manifest(db_path)["files"]) == {"a.txt"}
+
+
+def test_renamed_document_only_updates_metadata(fake_db, tmp_path, books):
+    db_path = str(tmp_path / "db")
+    a = books("a.txt", "第一段", "第二段")
+    sync(fake_db, db_path, {a: ("舊名稱", "a.txt")})
+
+    stats = sync(fake_db, db_path, {a: ("新名稱", "a.txt")})
+
+    assert stats["added"] == stats["deleted"] == 0
+    assert stats["metadata_updated"] == 2
+    assert stats["index_version"] == 2
+    assert fake_db.added == 2
+    assert {metadata["source_name"] for _, metadata in fake_db.records.values()} == {"新名稱"}
+
+
+def test_renamed_file_replaces_chunks(fake_db, tmp_path, books):
+    db_path = str(tmp_path / "db")
+    a = books("a.txt", "第一段")
+    sync(fake_db, db_path, {a: ("文檔A", "a.txt")})
+
+    renamed = books("renamed.txt", "第一段")
+    stats = sync(fake_db, db_path, {renamed: ("文檔A", "renamed.txt")})
+
+    # 區塊 ID 包含檔名，改檔名視為刪除舊檔、新增新檔
+    assert stats["added"] == 1
+    assert stats["deleted"] == 1
+    assert stats["files_removed"] == 1
+    assert [metadata["filename"] for _, metadata in fake_db.records.values()] == ["renamed.txt"]
+
+
+def test_splitter_change_reprocesses_every_file(fake_db, tmp_path, books):
+    db_path = str(tmp_path / "db")
+    sources = {books("a.txt", "第一段"): ("文檔A", "a.txt"), books("b.txt", "第二段"): ("文檔B", "b.txt")}
+    sync(fake_db, db_path, sources)
+
+    stats = sync(fake_db, db_path, sources, splitter={"chunk_size": 200, "chunk_overlap": 0})
+
+    assert stats["files_changed"] == 2
+    # 分割結果相同時沿用原本的區塊，但索引版本仍會遞增
+    assert stats["added"] == stats["deleted"] == 0
+    assert stats["index_version"] == 2
+    assert load_manifest(db_path)["splitter"] == {"chunk_size": 200, "chunk_overlap": 0}
+
+
+def test_load_error_keeps_old_chunks(fake_db, tmp_path, books):
+    db_path = str(tmp_path / "db")
+    sources = {books("a.txt", "第一段", "第二段"): ("文檔A", "a.txt")}
+    sync(fake_db, db_path, sources)
+    old_entry = load_manifest(db_path)["files"]["a.txt"]
+
+    books("a.txt", "BROKEN")
+    stats = sync(fake_db, db_path, sources)
+
+    assert stats["unchanged"] == 2
+    assert stats["added"] == stats["deleted"] == 0
+    assert len(fake_db.records) == 2
+    assert load_manifest(db_path)["files"]["a.txt"] == old_entry
+
+
+def test_manifest_version_bump_rebuilds_and_keeps_counting(fake_db, tmp_path, books):
+    db_path = str(tmp_path / "db")
+    sources = {books("a.txt", "第一段", "第二段"): ("文檔A", "a.txt")}
+    sync(fake_db, db_path, sources)
+    books("a.txt", "第一段", "第二段", "第三段")
+    sync(fake_db, db_path, sources)
+
+    # 模擬舊格式的 manifest
+    with open(manifest_path(db_path), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["version"] = MANIFEST_VERSION - 1
+    with open(manifest_path(db_path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    assert load_manifest(db_path) is None
+
+    stats = sync(fake_db, db_path, sources)
+
+    assert fake_db.deleted == 3
+    assert stats["added"] == 3
+    # 版本號沿用舊 manifest 繼續遞增，不與衍生索引的快取撞號
+    assert stats["index_version"] == 3
+    assert load_manifest(db_path)["version"] == MANIFEST_VERSION
+
+
+def test_manifest_index_version_follows_manifest_changes(fake_db, tmp_path, books):
+    db_path = str(tmp_path / "db")
+    assert incremental_index.manifest_index_version(db_path) is None
+
+    sources = {books("a.txt", "第一段"): ("文檔A", "a.txt")}
+    sync(fake_db, db_path, sources)
+    assert incremental_index.manifest_index_version(db_path) == 1
+
+    books("a.txt", "第一段", "第二段")
+    sync(fake_db, db_path, sources)
+    assert incremental_index.manifest_index_version(db_path) == 2
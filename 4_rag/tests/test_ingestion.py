@@ -0,0 +1,22 @@
+"""
+匯入管線測試：工作行程以 utils.text_splitting 作為主模組，不重新匯入主程式
+"""
+
+import sys
+
+from utils.ingestion import create_executor
+
+
+def main_module_name():
+    main_module = sys.modules["__main__"]
+    return getattr(main_module.__spec__, "name", None)
+
+
+def test_workers_use_lightweight_main_module():
+    original_spec = sys.modules["__main__"].__spec__
+
+    with create_executor(1) as executor:
+        assert executor.submit(main_module_name).result(timeout=60) == "utils.text_splitting"
+
+    # 啟動工作行程後還原主程式的 __spec__
+    assert sys.modules["__main__"].__spec__ is original_spec
@@ -0,0 +1,53 @@
+"""
+metadata 倒排索引測試：MetadataIndex.resolve 與 matches_filter 的過濾語意一致
+"""
+
+import pytest
+
+from utils.metadata_index import MetadataIndex, matches_filter
+
+IDS = ["a1", "a2", "b1", "c1"]
+METADATAS = [
+    {"source_name": "租賃合約", "position": "前段", "section": "押金"},
+    {"source_name": "租賃合約", "position": "後段", "section": "違約"},
+    {"source_name": "洗衣機使用說明", "position": "後段", "section": "錯誤代碼"},
+    {"source_name": "路由器設定手冊", "position": "前段"},
+]
+
+
+@pytest.fixture
+def index():
+    return MetadataIndex.build(IDS, METADATAS, index_version=1)
+
+
+@pytest.mark.parametrize("filter, expected", [
+    ({"source_name": "租賃合約"}, {"a1", "a2"}),
+    ({"source_name": {"$eq": "洗衣機使用說明"}}, {"b1"}),
+    ({"source_name": {"$in": ["洗衣機使用說明", "路由器設定手冊"]}}, {"b1", "c1"}),
+    ({"$and": [{"source_name": "租賃合約"}, {"position": "後段"}]}, {"a2"}),
+    ({"$or": [{"section": "押金"}, {"source_name": "路由器設定手冊"}]}, {"a1", "c1"}),
+    ({"source_name": "租賃合約", "position": "前段"}, {"a1"}),
+    ({"$and": [{"source_name": "租賃合約"}, {"source_name": "路由器設定手冊"}]}, set()),
+    ({"source_name": "不存在的文檔"}, set()),
+])
+def test_resolve_matches_filter(index, filter, expected):
+    assert index.resolve(filter) == expected
+    # 與逐筆比對的結果相同
+    assert {doc_id for doc_id, metadata in zip(IDS, METADATAS) if matches_filter(metadata, filter)} == expected
+
+
+def test_empty_filter_means_no_filtering(index):
+    assert index.resolve(None) is None
+    assert index.resolve({}) is None
+
+
+def test_unsupported_filter_raises(index):
+    assert not index.supports({"chunk_index": 3})
+    with pytest.raises(ValueError):
+        index.resolve({"chunk_index": 3})
+    with pytest.raises(ValueError):
+        index.resolve({"source_name": {"$ne": "租賃合約"}})
+
+
+def test_values_lists_field_values(index):
+    assert index.values("position") == ["前段", "後段"]
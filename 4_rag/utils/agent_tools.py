@@ -0,0 +1,138 @@
+"""
+Agent 的 RAG 工具模式
+功能：建立 RAG 工具時可選擇兩種模式：
+      - answer：工具內部執行完整的 RAG 鏈（問題改寫 + 檢索 + LLM 生成答案），回傳答案
+      - passages：工具只做檢索，把去重、截短後的段落直接交給 Agent 作為 observation，
+        由外層 Agent 一次整合回答，省下工具內部的 LLM 呼叫
+      並提供計算 LLM 呼叫次數與延遲的 callback handler，用於比較兩種模式
+
+answer 模式下每次使用工具需要三次 LLM 呼叫（Agent 推理、問題改寫、生成答案）
+
+使用方式：
+    counter = LLMCallCounter()
+    llm = ChatOpenAI(model="gpt-4o", callbacks=[counter])
+
+    tool = create_rag_tool("Answer Question", "回答有關上下文的問題", mode="passages",
+                           rag_chain=rag_chain, retrieve=retrieve)
+    counter.reset()
+    agent_executor.invoke({"input": question})
+    print(counter.stats())  # {"llm_calls": 2, "llm_seconds": 3.1}
+"""
+
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tools import Tool
+
+from utils.embedding_cache import normalize_text
+
+TOOL_MODES = ("answer", "passages")
+
+# passages 模式每段的最大字元數與最多段落數
+DEFAULT_MAX_PASSAGE_CHARS = 400
+DEFAULT_MAX_PASSAGES = 4
+
+_SENTENCE_ENDINGS = "。！？!?.\n"
+
+
+def dedupe_passages(docs):
+    """移除內容相同或被其他段落完整包含的區塊（重疊分割常見），保留原順序"""
+    kept = []
+    for doc in docs:
+        text = normalize_text(doc.page_content)
+        if not text or any(text in other for _, other in kept):
+            continue
+        # 新段落包含先前保留的較短段落時，以新段落取代
+        kept = [(d, other) for d, other in kept if other not in text]
+        kept.append((doc, text))
+    return [doc for doc, _ in kept]
+
+
+def trim_passage(text, max_chars=DEFAULT_MAX_PASSAGE_CHARS):
+    """截短到 max_chars，盡量在句尾截斷"""
+    text = text.strip()
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    end = max(cut.rfind(ch) for ch in _SENTENCE_ENDINGS)
+    if end >= max_chars // 2:
+        cut = cut[:end + 1]
+    return cut.rstrip() + "…"
+
+
+def format_passages(docs, max_passages=DEFAULT_MAX_PASSAGES, max_chars=DEFAULT_MAX_PASSAGE_CHARS):
+    """把檢索到的區塊整理成 Agent 的 observation 文字"""
+    passages = dedupe_passages(docs)[:max_passages]
+    if not passages:
+        return "找不到相關的段落。"
+    lines = []
+    for i, doc in enumerate(passages, 1):
+        source = doc.metadata.get("source_name") or doc.metadata.get("source", "未知來源")
+        lines.append(f"[{i}] 來源：{source}\n{trim_passage(doc.page_content, max_chars)}")
+    return "\n\n".join(lines)
+
+
+def create_rag_tool(name, description, mode, rag_chain=None, retrieve=None,
+                    max_passages=DEFAULT_MAX_PASSAGES, max_chars=DEFAULT_MAX_PASSAGE_CHARS):
+    """
+    建立 RAG 工具
+
+    參數：
+        mode: "answer"（回傳 rag_chain 的答案）或 "passages"（回傳去重截短後的段落）
+        rag_chain: answer 模式使用，輸入問題字串、輸出答案字串的函數
+        retrieve: passages 模式使用，輸入問題字串、輸出 Document 列表的函數
+    """
+    if mode not in TOOL_MODES:
+        raise ValueError(f"不支援的工具模式：{mode}（可用：{', '.join(TOOL_MODES)}）")
+
+    if mode == "answer":
+        return Tool(name=name, func=rag_chain, description=description)
+
+    return Tool(
+        name=name,
+        func=lambda query: format_passages(retrieve(query), max_passages=max_passages, max_chars=max_chars),
+        description=f"{description}（回傳相關的原文段落，請根據段落內容作答）",
+    )
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """計算 LLM 呼叫次數與累計的 LLM 延遲（可掛在多個 LLM 物件上共用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.seconds = 0.0
+            self._started.clear()
+
+    def _start(self, run_id):
+        with self._lock:
+            self.calls += 1
+            self._started[run_id] = time.perf_counter()
+
+    def _end(self, run_id):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+            if started is not None:
+                self.seconds += time.perf_counter() - started
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def stats(self):
+        with self._lock:
+            return {"llm_calls": self.calls, "llm_seconds": round(self.seconds, 2)}
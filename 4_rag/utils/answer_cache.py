@@ -0,0 +1,170 @@
+"""
+語意回答快取
+功能：新問題的 embedding 與已快取問題的餘弦相似度超過門檻，
+      且檢索設定 (doc_filter, k, search_type) 相同時，直接回傳已儲存的回答
+      支援 TTL 到期、LRU 淘汰，以及向量資料庫重新索引時自動失效
+
+- 問題向量存放在預先配置的 NumPy 矩陣中，查找時以一次矩陣乘法計算所有項目的相似度
+- 傳入 index_version_fn 時，每次查找與儲存前都會檢查目前的索引版本
+  （例如其他行程增量更新了向量資料庫），版本改變就清空快取
+
+使用方式：
+    answer_cache = SemanticAnswerCache(
+        threshold=0.95, ttl_seconds=3600, index_version_fn=lambda: manifest_index_version(DB_PATH)
+    )
+
+    hit = answer_cache.lookup(question, scope, query_vector)
+    if hit is None:
+        ...
+        answer_cache.store(question, scope, query_vector, answer, source_docs)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _normalize(vector):
+    """將向量正規化為單位長度，之後只需內積即可得到餘弦相似度"""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """以問題語意相似度查找的回答快取"""
+
+    def __init__(self, threshold=0.95, ttl_seconds=3600, max_entries=512, index_version_fn=None):
+        """
+        參數：
+            index_version_fn: 選用，回傳目前索引版本的函數（應該是低成本的呼叫）
+        """
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.index_version_fn = index_version_fn
+        self.index_version = None
+
+        self._entries = OrderedDict()
+        self._next_id = 0
+        # 問題向量矩陣（第一次儲存時依維度配置），每個項目佔用一列
+        self._matrix = None
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "invalidations": 0}
+
+    def _clear(self):
+        self._entries.clear()
+        self._free_rows = list(range(self.max_entries - 1, -1, -1))
+        self._counters["invalidations"] += 1
+
+    def set_index_version(self, index_version):
+        """設定目前的索引版本，版本變更（重新索引）時清空快取"""
+        with self._lock:
+            if self.index_version is not None and index_version != self.index_version:
+                self._clear()
+            self.index_version = index_version
+
+    def _check_index_version(self):
+        if self.index_version_fn is not None:
+            self.set_index_version(self.index_version_fn())
+
+    def invalidate(self):
+        """手動清空快取"""
+        with self._lock:
+            self._clear()
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._free_rows.append(entry["row"])
+
+    def lookup(self, question, scope, query_vector):
+        """
+        查找相似問題的快取回答
+
+        參數：
+            question: 使用者問題
+            scope: 檢索設定，例如 (doc_filter, k, search_type)
+            query_vector: 問題的 embedding
+
+        回傳：命中時為 {"question", "answer", "source_docs", "similarity"}，否則為 None
+        """
+        self._check_index_version()
+        vector = _normalize(query_vector)
+        now = time.monotonic()
+        best_id, best_score = None, -1.0
+
+        with self._lock:
+            candidates = []
+            for entry_id, entry in list(self._entries.items()):
+                if now - entry["created"] > self.ttl_seconds:
+                    self._remove(entry_id)
+                    self._counters["expired"] += 1
+                    continue
+                if entry["scope"] != scope:
+                    continue
+
+                # 完全相同的問題不必計算相似度
+                if entry["question"] == question:
+                    best_id, best_score = entry_id, 1.0
+                    break
+                candidates.append(entry_id)
+
+            if best_id is None and candidates and self._matrix.shape[1] == len(vector):
+                # 一次矩陣乘法計算所有項目的相似度，再只看相同檢索設定的列
+                scores = self._matrix @ vector
+                rows = np.fromiter((self._entries[i]["row"] for i in candidates), dtype=np.int64, count=len(candidates))
+                best = int(np.argmax(scores[rows]))
+                best_id, best_score = candidates[best], float(scores[rows[best]])
+
+            if best_id is None or best_score < self.threshold:
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            self._counters["hits"] += 1
+            entry = self._entries[best_id]
+            return {
+                "question": entry["question"],
+                "answer": entry["answer"],
+                "source_docs": entry["source_docs"],
+                "similarity": best_score
+            }
+
+    def store(self, question, scope, query_vector, answer, source_docs):
+        """儲存回答，超過容量時淘汰最久未使用的項目"""
+        self._check_index_version()
+        vector = _normalize(query_vector)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != len(vector):
+                # 第一次儲存（或 embedding 模型的維度改變）時配置矩陣
+                if self._matrix is not None:
+                    self._clear()
+                self._matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._counters["evicted"] += 1
+
+            row = self._free_rows.pop()
+            self._matrix[row] = vector
+            self._entries[self._next_id] = {
+                "question": question,
+                "scope": scope,
+                "row": row,
+                "answer": answer,
+                "source_docs": source_docs,
+                "created": time.monotonic()
+            }
+            self._next_id += 1
+
+    def stats(self):
+        """回傳快取統計"""
+        with self._lock:
+            counters = dict(self._counters)
+            counters["entries"] = len(self._entries)
+        total = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / total if total else 0.0
+        return counters
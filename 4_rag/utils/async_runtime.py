@@ -0,0 +1,97 @@
+"""
+非同步請求處理工具
+功能：讓 Gradio 的 async 處理函數在同一個行程中服務多個使用者
+
+- run_in_thread：把會阻塞的工作（embedding、向量檢索、等待資源載入）放到執行緒池，
+  不阻塞事件迴圈
+- ConcurrencyLimiter：限制同時執行的請求數量（例如同時送到 Ollama 的生成數量），
+  超過的請求在佇列中等待，並記錄佇列深度與等待時間
+
+使用方式：
+    limiter = ConcurrencyLimiter("answer", max_concurrent=4)
+
+    async def answer(question):
+        async with limiter:
+            query_vector = await run_in_thread(embeddings.embed_query, question)
+            return await chain.ainvoke(question)
+
+    limiter.stats()  # {"active": 2, "waiting": 5, ...}
+"""
+
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 執行檢索等阻塞工作的執行緒數量
+RETRIEVAL_THREADS = int(os.getenv("RAG_RETRIEVAL_THREADS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="rag-worker")
+
+
+async def run_in_thread(fn, *args, **kwargs):
+    """在共用的執行緒池執行阻塞函數"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+class ConcurrencyLimiter:
+    """限制同時執行數量的 async context manager，並記錄佇列統計"""
+
+    def __init__(self, name, max_concurrent=4):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _get_semaphore(self):
+        # 在事件迴圈內第一次使用時才建立，避免綁定到匯入模組時的迴圈
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    async def __aenter__(self):
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        started = time.monotonic()
+        try:
+            await self._get_semaphore().acquire()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self.active += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+        self._get_semaphore().release()
+
+    def stats(self):
+        """回傳目前的佇列深度與等待時間統計"""
+        with self._lock:
+            started = self.completed + self.active
+            return {
+                "max_concurrent": self.max_concurrent,
+                "active": self.active,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "completed": self.completed,
+                "avg_wait_ms": round(self.total_wait_seconds / started * 1000, 1) if started else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 1),
+            }
@@ -0,0 +1,162 @@
+"""
+Token 預算的聊天歷史管理
+功能：以 tiktoken 計算聊天歷史的 token 數，最近的對話原文保留，
+      超出預算的較舊對話在背景執行緒中逐步併入一段滾動摘要（不阻塞下一輪問答），
+      提供給 prompt 的是「摘要 + 最近對話」且總長度不超過預算的精簡版本
+
+聊天歷史會同時送進問題改寫與問答兩個 prompt，
+若無限累積，prompt 大小與延遲會隨對話長度線性增加
+
+- 摘要是增量更新：每次只把新移出的對話與舊摘要合併，不重新處理整段歷史
+- 摘要尚未完成前，等待摘要的對話若仍放得進預算就保留原文，放不下的最舊對話暫時略過
+
+使用方式：
+    history = TokenBudgetHistory(summarize_prompt | llm | StrOutputParser(), max_tokens=1500)
+    rag_chain.invoke({"input": question, "chat_history": history.messages()})
+    history.add_turn(question, answer)
+    print(history.stats())
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+# 每則訊息除內容外的格式開銷（角色與分隔符號，依 OpenAI 的計算方式估計）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def format_turns(turns):
+    """把對話轉成摘要 prompt 使用的文字"""
+    return "\n".join(f"使用者：{question}\nAI：{answer}" for question, answer in turns)
+
+
+class TokenBudgetHistory:
+    """保留最近對話原文、較舊對話在背景摘要的聊天歷史"""
+
+    def __init__(self, summarize_chain, max_tokens=1500, keep_recent_turns=2,
+                 model_name="gpt-4o", summary_prefix="先前對話摘要："):
+        """
+        參數：
+            summarize_chain: 輸入 {"summary", "new_lines"}、輸出新摘要字串的 Runnable
+            max_tokens: 提供給 prompt 的聊天歷史（含摘要）token 上限
+            keep_recent_turns: 至少保留原文的最近對話輪數（不會被摘要）
+            model_name: 用於選擇 tiktoken 編碼的模型名稱
+        """
+        self.summarize_chain = summarize_chain
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.model_name = model_name
+        self.summary_prefix = summary_prefix
+
+        self.summary = ""
+        # 原文保留的對話：[(問題, 回答, token 數)]，包含等待摘要的對話
+        self._turns = []
+        # _turns 的前幾輪已送去背景摘要
+        self._pending = 0
+        self._summarized_turns = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summarizer")
+        self._tokenizer = None
+
+    def count_tokens(self, text):
+        if self._tokenizer is None:
+            import tiktoken
+
+            try:
+                self._tokenizer = tiktoken.encoding_for_model(self.model_name)
+            except KeyError:
+                self._tokenizer = tiktoken.get_encoding("cl100k_base")
+        return len(self._tokenizer.encode(text))
+
+    def _turn_tokens(self, question, answer):
+        return self.count_tokens(question) + self.count_tokens(answer) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+    def _summary_tokens(self):
+        if not self.summary:
+            return 0
+        return self.count_tokens(self.summary_prefix + self.summary) + MESSAGE_OVERHEAD_TOKENS
+
+    def add_turn(self, question, answer):
+        """記錄一輪對話；超出預算時把較舊的對話排入背景摘要"""
+        tokens = self._turn_tokens(question, answer)
+        with self._lock:
+            self._turns.append((question, answer, tokens))
+            budget = self.max_tokens - self._summary_tokens()
+            verbatim = sum(t for _, _, t in self._turns[self._pending:])
+
+            # 從尚未排入摘要的最舊對話開始移出，直到剩下的原文放得進預算
+            start = self._pending
+            end = start
+            while verbatim > budget and len(self._turns) - end > self.keep_recent_turns:
+                verbatim -= self._turns[end][2]
+                end += 1
+            if end == start:
+                return
+            self._pending = end
+
+        self._executor.submit(self._fold)
+
+    def _fold(self):
+        """（背景執行緒）把所有等待摘要的對話併入摘要，完成後才從原文中刪除"""
+        with self._lock:
+            turns = [(q, a) for q, a, _ in self._turns[:self._pending]]
+            previous = self.summary
+        if not turns:
+            return
+
+        try:
+            summary = self.summarize_chain.invoke({"summary": previous or "（無）", "new_lines": format_turns(turns)})
+        except Exception as e:
+            # 保留原文並維持等待狀態，下一次排入摘要時一併重試
+            print(f"⚠️ 對話摘要失敗，保留原文: {e}")
+            return
+
+        with self._lock:
+            self.summary = summary.strip()
+            del self._turns[:len(turns)]
+            self._pending -= len(turns)
+            self._summarized_turns += len(turns)
+
+    def messages(self):
+        """回傳提供給 prompt 的歷史：摘要 + 由新到舊放得進預算的對話原文（至少包含最近一輪）"""
+        with self._lock:
+            summary = self.summary
+            turns = list(self._turns)
+            budget = self.max_tokens - self._summary_tokens()
+
+        kept = []
+        for question, answer, tokens in reversed(turns):
+            if kept and tokens > budget:
+                break
+            kept.append((question, answer))
+            budget -= tokens
+
+        messages = [SystemMessage(content=self.summary_prefix + summary)] if summary else []
+        for question, answer in reversed(kept):
+            messages.append(HumanMessage(content=question))
+            messages.append(AIMessage(content=answer))
+        return messages
+
+    def wait(self):
+        """等待進行中的背景摘要完成"""
+        self._executor.submit(lambda: None).result()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        """回傳對話輪數、摘要輪數與目前的 token 用量"""
+        view = self.messages()
+        with self._lock:
+            return {
+                "turns": len(self._turns) + self._summarized_turns,
+                "verbatim_turns": len(self._turns),
+                "summarized_turns": self._summarized_turns,
+                "pending_summary_turns": self._pending,
+                "summary_tokens": self._summary_tokens(),
+                "prompt_tokens": sum(
+                    self.count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS for message in view
+                ),
+                "max_tokens": self.max_tokens,
+            }
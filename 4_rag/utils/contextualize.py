@@ -0,0 +1,143 @@
+"""
+問題上下文化閘門
+功能：在以 LLM 依聊天歷史改寫問題之前，先用本地的低成本檢查判斷是否真的需要改寫：
+      - 沒有聊天歷史：直接使用原問題
+      - 啟發式規則：問題含代名詞/指示詞（它、這個、上述、it、that…）、
+        以「那…」「還有…」「what about…」開頭，或短到像是省略句時才需要改寫
+      改寫結果依 (聊天歷史雜湊, 問題) 快取，並統計省下的 LLM 呼叫次數
+
+每次改寫都是一次完整的 LLM 網路往返，第一輪與完整的獨立問題不需要付出這個延遲
+
+使用方式：
+    rewrite_chain = contextualize_q_prompt | llm | StrOutputParser()
+    contextualizer = QuestionContextualizer(rewrite_chain)
+    history_aware_retriever = RunnableLambda(contextualizer.contextualize) | retriever
+    print(contextualizer.stats())  # {"llm_calls": 2, "saved_round_trips": 5, ...}
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+# 指代前文的中文詞彙（誤判只會多一次改寫，因此寧可寬鬆）
+# 「其」「該」「他」常出現在其他、應該、該怎麼等非指代的詞中，不單獨比對
+_CHINESE_REFERENCES = (
+    "它", "她", "他們", "這個", "那個", "這些", "那些", "這裡", "那裡", "這樣", "那樣",
+    "上述", "上面", "前面", "剛才", "剛剛", "之前", "同樣", "後者", "前者",
+    "其中", "該產品", "該文檔", "該功能", "該方案",
+)
+# 含上列字元但不是指代的詞，比對前先移除
+_CHINESE_NON_REFERENCES = ("其它",)
+_CHINESE_FOLLOW_UP_PREFIXES = ("那", "還有", "另外", "所以", "然後", "而且", "那麼", "也")
+_ENGLISH_REFERENCES = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|him|her|his|there|same|"
+    r"above|previous|former|latter)\b|^(and|also|so|then|what about|how about)\b",
+    re.IGNORECASE,
+)
+
+# 比這個長度更短的問題多半是省略句（例如 "Why?"、"How much?"）
+SHORT_QUESTION_CHARS = 8
+# 含中日韓文字的問題資訊密度較高，「什麼是RAG？」已是完整的問題，
+# 只有更短的問題才視為省略句（例如「為什麼？」「多少錢？」「怎麼設定？」）
+SHORT_CJK_QUESTION_CHARS = 5
+_CJK_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]")
+
+
+def _history_hash(chat_history):
+    digest = hashlib.sha256()
+    for message in chat_history:
+        digest.update(getattr(message, "type", "").encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(str(getattr(message, "content", message)).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def has_reference(question):
+    """問題是否含指代前文的詞彙、承接語或過短"""
+    text = question.strip()
+    core = text.rstrip("?？。.!！")
+    if len(core) < (SHORT_CJK_QUESTION_CHARS if _CJK_PATTERN.search(core) else SHORT_QUESTION_CHARS):
+        return True
+    if text.startswith(_CHINESE_FOLLOW_UP_PREFIXES):
+        return True
+    chinese = text
+    for word in _CHINESE_NON_REFERENCES:
+        chinese = chinese.replace(word, "")
+    if any(word in chinese for word in _CHINESE_REFERENCES):
+        return True
+    return bool(_ENGLISH_REFERENCES.search(text))
+
+
+class QuestionContextualizer:
+    """只在需要時呼叫 LLM 改寫問題，並快取改寫結果"""
+
+    def __init__(self, rewrite_chain, cache_size=256):
+        """
+        參數：
+            rewrite_chain: 輸入 {"input", "chat_history"}、輸出改寫後問題字串的 Runnable
+            cache_size: 快取的改寫結果數量
+        """
+        self.rewrite_chain = rewrite_chain
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {
+            "questions": 0,
+            "llm_calls": 0,
+            "skipped_no_history": 0,
+            "skipped_heuristic": 0,
+            "cache_hits": 0,
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def needs_rewrite(self, question, chat_history):
+        """
+        判斷是否需要依聊天歷史改寫
+
+        回傳：(是否需要改寫, 原因)
+        """
+        if not chat_history:
+            return False, "skipped_no_history"
+        if has_reference(question):
+            return True, "reference"
+        return False, "skipped_heuristic"
+
+    def contextualize(self, inputs):
+        """回傳可獨立理解的問題（需要時才呼叫 LLM）"""
+        question = inputs["input"]
+        chat_history = inputs.get("chat_history") or []
+        self._count("questions")
+
+        rewrite, reason = self.needs_rewrite(question, chat_history)
+        if not rewrite:
+            self._count(reason)
+            return question
+
+        key = (_history_hash(chat_history), question)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self._counts["cache_hits"] += 1
+                return self._cache[key]
+
+        self._count("llm_calls")
+        rewritten = self.rewrite_chain.invoke({"input": question, "chat_history": chat_history}).strip() or question
+
+        with self._lock:
+            self._cache[key] = rewritten
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return rewritten
+
+    def stats(self):
+        """回傳各種略過原因的次數與省下的 LLM 往返次數"""
+        with self._lock:
+            counts = dict(self._counts)
+        counts["saved_round_trips"] = counts["questions"] - counts["llm_calls"]
+        return counts
@@ -0,0 +1,266 @@
+"""
+網頁爬取快取
+功能：記錄每個網址的 ETag、Last-Modified 與內容雜湊，重新爬取時先發送條件式請求，
+      只有內容真的改變的網址才重新抓取與寫入；頁面存成檔案後交給 sync_vector_store，
+      只重新嵌入內容有變動的區塊
+
+Firecrawl 依頁數計費，重新爬取整個網站並重新嵌入既慢又貴
+
+- 抓取器 (fetcher) 可替換：FirecrawlFetcher 使用 Firecrawl API，
+  LocalFileFetcher 以本地檔案模擬網站，可離線測試
+- 快取目錄結構：
+    crawl_index.json          每個網址的 ETag、Last-Modified、內容雜湊與抓取時間
+    pages/<雜湊>.md            頁面內容（Markdown）
+    pages/<雜湊>.meta.json     頁面 metadata
+
+使用方式：
+    cache = CrawlCache("./db/crawl_cache")
+    stats = cache.refresh(["https://example.com"], FirecrawlFetcher(api_key))
+    sync_vector_store(db, db_path, cache.sources(), load_and_split_page, SPLITTER_CONFIG)
+"""
+
+import email.utils
+import hashlib
+import json
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass, field
+
+INDEX_FILENAME = "crawl_index.json"
+
+
+@dataclass
+class FetchResult:
+    """抓取結果；not_modified 為 True 時 content 為 None"""
+
+    content: str = None
+    metadata: dict = field(default_factory=dict)
+    etag: str = None
+    last_modified: str = None
+    not_modified: bool = False
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:24]
+
+
+def _content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _flatten_metadata(metadata):
+    """Chroma 的 metadata 只接受純量，列表轉為字串、None 移除"""
+    flat = {}
+    for key, value in metadata.items():
+        if isinstance(value, list):
+            flat[key] = ", ".join(map(str, value))
+        elif isinstance(value, (str, int, float, bool)):
+            flat[key] = value
+    return flat
+
+
+class FirecrawlFetcher:
+    """先以 HEAD 條件式請求確認網頁是否變更，變更時才呼叫 Firecrawl 抓取（才會計費）"""
+
+    def __init__(self, api_key, mode="scrape", timeout=10):
+        self.api_key = api_key
+        self.mode = mode
+        self.timeout = timeout
+
+    def _check_headers(self, url, etag, last_modified):
+        """
+        發送條件式 HEAD 請求
+
+        回傳：(是否未變更, 新的 ETag, 新的 Last-Modified)；網站不支援時視為已變更
+        """
+        request = urllib.request.Request(url, method="HEAD")
+        if etag:
+            request.add_header("If-None-Match", etag)
+        if last_modified:
+            request.add_header("If-Modified-Since", last_modified)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return False, response.headers.get("ETag"), response.headers.get("Last-Modified")
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return True, etag, last_modified
+            return False, None, None
+        except (urllib.error.URLError, TimeoutError):
+            return False, None, None
+
+    def fetch(self, url, etag=None, last_modified=None):
+        not_modified, new_etag, new_last_modified = self._check_headers(url, etag, last_modified)
+        if not_modified:
+            return FetchResult(etag=new_etag, last_modified=new_last_modified, not_modified=True)
+
+        from langchain_community.document_loaders import FireCrawlLoader
+
+        docs = FireCrawlLoader(api_key=self.api_key, url=url, mode=self.mode).load()
+        return FetchResult(
+            content="\n\n".join(doc.page_content for doc in docs),
+            metadata=_flatten_metadata(docs[0].metadata) if docs else {},
+            etag=new_etag,
+            last_modified=new_last_modified,
+        )
+
+
+class LocalFileFetcher:
+    """
+    以本地檔案模擬網站（離線測試用）
+
+    網址對應到 root_dir 下的檔案：https://example.com/docs/page → root_dir/example.com/docs/page.md，
+    以檔案的修改時間作為 Last-Modified、內容雜湊作為 ETag
+    """
+
+    def __init__(self, root_dir, extension=".md"):
+        self.root_dir = root_dir
+        self.extension = extension
+
+    def path_for(self, url):
+        parsed = urllib.parse.urlparse(url)
+        path = parsed.path.strip("/") or "index"
+        return os.path.join(self.root_dir, parsed.netloc, path + self.extension)
+
+    def fetch(self, url, etag=None, last_modified=None):
+        path = self.path_for(url)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"找不到 {url} 對應的本地檔案：{path}")
+
+        modified = email.utils.formatdate(os.path.getmtime(path), usegmt=True)
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        new_etag = f'"{_content_hash(content)[:16]}"'
+
+        if etag == new_etag or (not etag and last_modified == modified):
+            return FetchResult(etag=new_etag, last_modified=modified, not_modified=True)
+        return FetchResult(
+            content=content,
+            metadata={"sourceURL": url, "title": os.path.basename(path)},
+            etag=new_etag,
+            last_modified=modified,
+        )
+
+
+class CrawlCache:
+    """網址的抓取紀錄與頁面內容"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.pages_dir = os.path.join(cache_dir, "pages")
+        os.makedirs(self.pages_dir, exist_ok=True)
+        self.entries = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, INDEX_FILENAME)
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path()):
+            return {}
+        with open(self._index_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_index(self):
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._index_path())
+
+    def page_path(self, url):
+        return os.path.join(self.pages_dir, _url_key(url) + ".md")
+
+    def _write_page(self, url, content, metadata):
+        path = self.page_path(url)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        with open(path[:-len(".md")] + ".meta.json", "w", encoding="utf-8") as f:
+            json.dump({**metadata, "source": url}, f, ensure_ascii=False)
+
+    def _remove_page(self, url):
+        path = self.page_path(url)
+        for file_path in (path, path[:-len(".md")] + ".meta.json"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def refresh(self, urls, fetcher):
+        """
+        重新爬取網址，只寫入內容有變動的頁面，並移除不在清單中的網址
+
+        回傳：統計 dict（not_modified：條件式請求確認未變更；unchanged：抓取後內容雜湊相同）
+        """
+        stats = {"not_modified": 0, "unchanged": 0, "changed": 0, "added": 0, "removed": 0, "failed": 0}
+
+        for url in urls:
+            entry = self.entries.get(url)
+            has_page = entry is not None and os.path.exists(self.page_path(url))
+            try:
+                result = fetcher.fetch(
+                    url,
+                    etag=entry.get("etag") if has_page else None,
+                    last_modified=entry.get("last_modified") if has_page else None,
+                )
+            except Exception as e:
+                print(f"❌ 抓取失敗 {url}: {e}")
+                stats["failed"] += 1
+                continue
+
+            now = time.time()
+            if result.not_modified:
+                entry.update(etag=result.etag, last_modified=result.last_modified, checked_at=now)
+                stats["not_modified"] += 1
+                print(f"⏭️ 未變更（條件式請求）：{url}")
+                continue
+
+            content_hash = _content_hash(result.content)
+            if has_page and entry.get("content_hash") == content_hash:
+                stats["unchanged"] += 1
+                print(f"⏭️ 內容未變更：{url}")
+            else:
+                self._write_page(url, result.content, result.metadata)
+                stats["changed" if has_page else "added"] += 1
+                print(f"✅ {'已更新' if has_page else '新增'}：{url}")
+
+            self.entries[url] = {
+                "etag": result.etag,
+                "last_modified": result.last_modified,
+                "content_hash": content_hash,
+                "fetched_at": now,
+                "checked_at": now,
+            }
+
+        for url in set(self.entries) - set(urls):
+            self._remove_page(url)
+            del self.entries[url]
+            stats["removed"] += 1
+            print(f"🗑️ 移除：{url}")
+
+        self._save_index()
+        return stats
+
+    def sources(self):
+        """已快取的頁面，格式同 sync_vector_store 的 sources：{檔案路徑: (網址, 檔名)}"""
+        return {
+            self.page_path(url): (url, os.path.basename(self.page_path(url)))
+            for url in self.entries
+            if os.path.exists(self.page_path(url))
+        }
+
+
+def load_and_split_page(file_path, url, filename, splitter_config):
+    """讀取快取的頁面與 metadata，並分割成文檔區塊"""
+    from langchain_core.documents import Document
+    from langchain_text_splitters import CharacterTextSplitter
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        content = f.read()
+    meta_path = file_path[:-len(".md")] + ".meta.json"
+    metadata = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    metadata.update(source_name=url, filename=filename)
+
+    text_splitter = CharacterTextSplitter(**splitter_config)
+    return text_splitter.split_documents([Document(page_content=content, metadata=metadata)])
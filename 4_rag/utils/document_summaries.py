@@ -0,0 +1,229 @@
+"""
+文檔摘要索引與兩階段檢索
+功能：匯入時為每份文檔建立一個摘要 embedding（文檔名稱 + 章節標題 + 開頭內容），
+      並可為偵測到的每個章節標題各建立一個 embedding；
+      查詢時先以摘要相似度挑出最相關的前 N 份文檔，再只在這些文檔的區塊中搜尋
+
+文檔數量成長到數千份時，第一階段只需比對每份文檔少量的摘要向量，
+第二階段的區塊搜尋也只在少數文檔中進行，成本更低、結果更精準
+
+- 摘要不需要呼叫 LLM，匯入時只多計算少量 embedding
+- 以檔案雜湊比對，只重新計算新增或修改過的文檔
+
+使用方式：
+    summary_index = load_or_build_summary_index(index_path, sources, embeddings)
+    retriever = TwoStageRetriever(vectorstore=db, summary_index=summary_index, k=3, top_documents=3)
+    docs = retriever.invoke("押金什麼時候會退還？")
+"""
+
+import gzip
+import json
+import os
+import re
+from typing import Any
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from utils.incremental_index import file_sha256
+
+# 章節標題：「第一章：…」「第四條 …」「第一部分: …」或「1.2 標題」
+_HEADING_PATTERN = re.compile(
+    r"^(第[一二三四五六七八九十百零\d]+[章條節部][分]?[:：\s].*|\d+\.\d+(?:\.\d+)*\s+\S.*)$"
+)
+
+# 摘要文字與章節內容的長度上限（字元）
+SUMMARY_MAX_CHARS = 1000
+SECTION_PREVIEW_CHARS = 200
+
+
+def detect_sections(text):
+    """依標題切分章節，回傳 [(標題, 內容)]"""
+    sections = []
+    heading, lines = None, []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if _HEADING_PATTERN.match(stripped):
+            if heading:
+                sections.append((heading, "\n".join(lines).strip()))
+            heading, lines = stripped, []
+        elif heading:
+            lines.append(stripped)
+    if heading:
+        sections.append((heading, "\n".join(lines).strip()))
+    return sections
+
+
+def heading_offsets(text):
+    """回傳每個章節標題所在行的字元位置 [(位置, 標題)]"""
+    offsets = []
+    position = 0
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if _HEADING_PATTERN.match(stripped):
+            offsets.append((position, stripped))
+        position += len(line)
+    return offsets
+
+
+def build_summary_texts(doc_name, text, include_sections=True):
+    """
+    產生一份文檔要嵌入的文字
+
+    回傳：[(種類, 標題, 文字)]，種類為 "document" 或 "section"
+    """
+    sections = detect_sections(text)
+    headings = "\n".join(heading for heading, _ in sections)
+    opening = text.strip()[:SECTION_PREVIEW_CHARS]
+    summary = f"{doc_name}\n{opening}\n{headings}"[:SUMMARY_MAX_CHARS]
+
+    entries = [("document", doc_name, summary)]
+    if include_sections:
+        for heading, body in sections:
+            entries.append(("section", heading, f"{doc_name} {heading}\n{body[:SECTION_PREVIEW_CHARS]}"))
+    return entries
+
+
+class DocumentSummaryIndex:
+    """每份文檔的摘要與章節向量，以相似度挑出最相關的文檔"""
+
+    def __init__(self):
+        # {doc_name: {"file_hash", "entries": [{"kind", "title", "vector"}]}}
+        self.documents = {}
+        self._matrix = None
+        self._owners = []
+
+    def _build_matrix(self):
+        vectors, owners = [], []
+        for doc_name, document in self.documents.items():
+            for entry in document["entries"]:
+                vectors.append(entry["vector"])
+                owners.append(doc_name)
+        if vectors:
+            matrix = np.asarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self._matrix = matrix / norms
+        else:
+            self._matrix = None
+        self._owners = owners
+
+    def route(self, query_vector, top_n=3):
+        """
+        依摘要或任一章節與查詢的最高相似度排序文檔
+
+        回傳：[(文檔名稱, 相似度)]
+        """
+        if self._matrix is None:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        best = {}
+        for owner, score in zip(self._owners, self._matrix @ query):
+            if score > best.get(owner, -1.0):
+                best[owner] = float(score)
+        return sorted(best.items(), key=lambda item: item[1], reverse=True)[:top_n]
+
+    def update(self, sources, embeddings, include_sections=True):
+        """
+        只為新增或修改過的文檔重新計算摘要，並移除已不存在的文檔（檔案不存在時略過並警告）
+
+        參數：
+            sources: {文檔名稱: 檔案路徑}
+
+        回傳：(重新計算的文檔數量, 移除的文檔數量)
+        """
+        changed = {}
+        # 仍存在的文檔（讀取失敗的文檔保留舊摘要，與增量索引一致）
+        available = set()
+        for doc_name, file_path in sources.items():
+            if not os.path.exists(file_path):
+                print(f"⚠️ 檔案不存在: {file_path}")
+                continue
+            available.add(doc_name)
+
+            document = self.documents.get(doc_name)
+            try:
+                file_hash = file_sha256(file_path)
+                if document and document["file_hash"] == file_hash and document.get("sections") == include_sections:
+                    continue
+                with open(file_path, "r", encoding="utf-8") as f:
+                    changed[doc_name] = (file_hash, build_summary_texts(doc_name, f.read(), include_sections))
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"❌ 摘要讀取失敗 {doc_name}: {e}")
+
+        # 所有變更文檔的摘要一次批次嵌入
+        texts = [text for _, entries in changed.values() for _, _, text in entries]
+        vectors = iter(embeddings.embed_documents(texts) if texts else [])
+        for doc_name, (file_hash, entries) in changed.items():
+            self.documents[doc_name] = {
+                "file_hash": file_hash,
+                "sections": include_sections,
+                "entries": [
+                    {"kind": kind, "title": title, "vector": list(next(vectors))}
+                    for kind, title, _ in entries
+                ],
+            }
+
+        removed = set(self.documents) - available
+        for doc_name in removed:
+            del self.documents[doc_name]
+
+        self._build_matrix()
+        return len(changed), len(removed)
+
+    def save(self, path):
+        """以 gzip 壓縮的 JSON 存到磁碟"""
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"version": 1, "documents": self.documents}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """從磁碟載入索引"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls()
+        index.documents = data["documents"]
+        index._build_matrix()
+        return index
+
+
+def load_or_build_summary_index(index_path, sources, embeddings, include_sections=True):
+    """載入文檔摘要索引，並更新新增、修改或刪除的文檔"""
+    index = DocumentSummaryIndex()
+    if os.path.exists(index_path):
+        try:
+            index = DocumentSummaryIndex.load(index_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ 文檔摘要索引讀取失敗，將重建: {e}")
+
+    updated, removed = index.update(sources, embeddings, include_sections=include_sections)
+    if updated or removed or not os.path.exists(index_path):
+        index.save(index_path)
+    entries = sum(len(document["entries"]) for document in index.documents.values())
+    print(f"✅ 文檔摘要索引就緒：{len(index.documents)} 份文檔、{entries} 個摘要向量（更新 {updated} 份、移除 {removed} 份）")
+    return index
+
+
+class TwoStageRetriever(BaseRetriever):
+    """第一階段以文檔摘要挑出前 top_documents 份文檔，第二階段只在這些文檔中搜尋區塊"""
+
+    vectorstore: Any
+    summary_index: Any
+    k: int = 4
+    top_documents: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        query_vector = self.vectorstore.embeddings.embed_query(query)
+        routed = [doc_name for doc_name, _ in self.summary_index.route(query_vector, self.top_documents)]
+        if not routed:
+            return self.vectorstore.similarity_search_by_vector(query_vector, k=self.k)
+
+        search_filter = {"source_name": routed[0] if len(routed) == 1 else {"$in": routed}}
+        return self.vectorstore.similarity_search_by_vector(query_vector, k=self.k, filter=search_filter)
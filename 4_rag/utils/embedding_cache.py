@@ -0,0 +1,179 @@
+"""
+Embedding 快取工具
+功能：包裝 embedding 模型，記憶體 LRU 快取在前、磁碟 (SQLite) 快取在後，
+      以「模型名稱 + 正規化後的文字」為鍵，查詢與文檔區塊都會使用快取
+
+使用方式：
+    from utils.embedding_cache import create_cached_embeddings
+
+    embeddings = create_cached_embeddings()
+    db = Chroma(persist_directory=db_path, embedding_function=embeddings)
+    print(embeddings.stats())
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+from utils.micro_batching import MicroBatchingEmbeddings
+
+DEFAULT_MODEL_NAME = "jinaai/jina-embeddings-v2-base-zh"
+
+# 預設快取目錄：4_rag/embedding_cache（可用環境變數 RAG_EMBEDDING_CACHE_DIR 覆寫）
+DEFAULT_CACHE_DIR = os.getenv(
+    "RAG_EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "embedding_cache")
+)
+
+
+def normalize_text(text):
+    """正規化文字：全形/半形統一 (NFKC)、合併連續空白、去除頭尾空白"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    """具備記憶體 LRU + 磁碟快取的 Embeddings 包裝器"""
+
+    def __init__(self, embeddings, model_name, cache_dir=DEFAULT_CACHE_DIR, max_memory_items=10000):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "embeddings.sqlite3"),
+            check_same_thread=False
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _key(self, kind, text):
+        """產生快取鍵；查詢與文檔分開存放，避免模型對兩者使用不同前綴時混用"""
+        raw = f"{self.model_name}\0{kind}\0{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        """放入記憶體 LRU（呼叫端需持有鎖）"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        """依序查詢記憶體與磁碟快取，回傳 {key: vector}"""
+        found = {}
+        with self._lock:
+            disk_keys = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self._counters["memory_hits"] += 1
+                elif key not in found:
+                    disk_keys.append(key)
+
+            # SQLite 單次查詢的參數數量有限，分批查詢
+            for start in range(0, len(disk_keys), 500):
+                batch = disk_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    vector = vector.tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                    self._counters["disk_hits"] += 1
+        return found
+
+    def _store(self, items):
+        """寫入記憶體與磁碟快取"""
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items]
+            )
+            self._conn.commit()
+
+    def embed_documents(self, texts):
+        """嵌入文檔區塊，只計算快取中沒有的部分"""
+        keys = [self._key("document", text) for text in texts]
+        found = self._lookup(keys)
+
+        # 同一批中重複的文字只計算一次
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            with self._lock:
+                self._counters["misses"] += len(missing)
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            items = list(zip(missing.keys(), vectors))
+            self._store(items)
+            found.update(items)
+
+        return [list(found[key]) for key in keys]
+
+    def embed_query(self, text):
+        """嵌入查詢文字，重複的問題直接使用快取"""
+        key = self._key("query", text)
+        found = self._lookup([key])
+        if key in found:
+            return list(found[key])
+
+        with self._lock:
+            self._counters["misses"] += 1
+        vector = self.embeddings.embed_query(text)
+        self._store([(key, vector)])
+        return list(vector)
+
+    def stats(self):
+        """回傳快取命中統計"""
+        with self._lock:
+            counters = dict(self._counters)
+            counters["memory_items"] = len(self._memory)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        total = hits + counters["misses"]
+        counters["hit_rate"] = hits / total if total else 0.0
+        return counters
+
+
+def create_cached_embeddings(model_name=DEFAULT_MODEL_NAME, cache_dir=DEFAULT_CACHE_DIR, micro_batch=False):
+    """
+    建立包裝快取的 HuggingFace embedding 模型
+
+    micro_batch=True 時，快取未命中的查詢會與其他使用者同時送來的查詢合併批次計算
+    （批次統計可由 embeddings.embeddings.stats() 取得）
+    """
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    model = HuggingFaceEmbeddings(model_name=model_name)
+    if micro_batch:
+        model = MicroBatchingEmbeddings(model)
+
+    return CachedEmbeddings(
+        model,
+        model_name=model_name,
+        cache_dir=cache_dir
+    )
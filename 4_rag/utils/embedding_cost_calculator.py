@@ -1,32 +1,224 @@
+"""
+Embedding 成本與 Token 預算分析工具
+功能：平行掃描整個語料庫目錄，依 RAG 案例使用的分割設定計算每個檔案與每個區塊的 token 數，
+      並估算不同 embedding 後端的成本與所需時間，可輸出 JSON 供容量規劃使用
+
+使用方式（在 4_rag 目錄下）：
+    python utils/embedding_cost_calculator.py
+    python utils/embedding_cost_calculator.py --corpus books --chunk-size 500 --chunk-overlap 50
+    python utils/embedding_cost_calculator.py --json report.json --per-chunk
+
+也可以當作函式庫使用：
+    from utils.embedding_cost_calculator import profile_corpus
+    report = profile_corpus("books", {"chunk_size": 1000, "chunk_overlap": 200, "separator": "\\n"})
+"""
+
+import argparse
+import glob
+import json
 import os
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import tiktoken
 
-# Define the file path for the document
-file_path = os.path.join(os.path.dirname(__file__), "..", "books", "odyssey.txt")
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(__file__), "..", "books")
+
+# 與 RAG 案例相同的分割設定
+DEFAULT_SPLITTER_CONFIG = {
+    "chunk_size": 1000,
+    "chunk_overlap": 200,
+    "separator": "\n"
+}
+
+# embedding 後端的價格與吞吐量估計
+#   usd_per_million_tokens: 每百萬 token 的價格（本地模型為 0）
+#   tokens_per_second: API 的速率上限估計（依帳號等級調整）
+#   chunks_per_second: 本地 CPU 模型每秒可嵌入的區塊數估計（可用 --throughput 覆寫）
+EMBEDDING_BACKENDS = {
+    "openai/text-embedding-3-small": {"usd_per_million_tokens": 0.02, "tokens_per_second": 16_000},
+    "openai/text-embedding-3-large": {"usd_per_million_tokens": 0.13, "tokens_per_second": 16_000},
+    "openai/text-embedding-ada-002": {"usd_per_million_tokens": 0.10, "tokens_per_second": 16_000},
+    "local/jinaai/jina-embeddings-v2-base-zh (CPU)": {"usd_per_million_tokens": 0.0, "chunks_per_second": 8.0},
+    "local/BAAI/bge-m3 (CPU)": {"usd_per_million_tokens": 0.0, "chunks_per_second": 3.0},
+    "local/intfloat/multilingual-e5-large (CPU)": {"usd_per_million_tokens": 0.0, "chunks_per_second": 3.5},
+}
+
+_tokenizers = {}
+
+
+def get_tokenizer(encoding_name):
+    """取得 tiktoken 編碼器（每個行程只建立一次）"""
+    if encoding_name not in _tokenizers:
+        _tokenizers[encoding_name] = tiktoken.get_encoding(encoding_name)
+    return _tokenizers[encoding_name]
+
+
+def split_text(text, splitter_config):
+    """以 RAG 案例相同的 CharacterTextSplitter 分割文字"""
+    from langchain_text_splitters import CharacterTextSplitter
+
+    return CharacterTextSplitter(**splitter_config).split_text(text)
+
+
+def analyze_file(file_path, splitter_config, encoding_name="cl100k_base", include_chunks=False):
+    """分析單一檔案的字元數、token 數與每個區塊的 token 數"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    tokenizer = get_tokenizer(encoding_name)
+    chunks = split_text(text, splitter_config)
+    chunk_tokens = [len(tokenizer.encode(chunk)) for chunk in chunks]
+
+    result = {
+        "file": os.path.basename(file_path),
+        "characters": len(text),
+        "file_tokens": len(tokenizer.encode(text)),
+        "chunks": len(chunks),
+        # 區塊之間有重疊，實際送去嵌入的 token 數會比檔案本身多
+        "embedded_tokens": sum(chunk_tokens),
+        "chunk_tokens_min": min(chunk_tokens, default=0),
+        "chunk_tokens_max": max(chunk_tokens, default=0),
+        "chunk_tokens_mean": round(statistics.mean(chunk_tokens), 1) if chunk_tokens else 0.0,
+    }
+    if include_chunks:
+        result["chunk_tokens"] = chunk_tokens
+    return result
+
 
-# Check if the file exists
-if not os.path.exists(file_path):
-    raise FileNotFoundError(
-        f"The file {file_path} does not exist. Please check the path."
+def estimate_backends(total_tokens, total_chunks, backends=EMBEDDING_BACKENDS):
+    """估算各 embedding 後端的成本與所需時間"""
+    estimates = {}
+    for name, spec in backends.items():
+        cost = total_tokens / 1_000_000 * spec["usd_per_million_tokens"]
+        if "chunks_per_second" in spec:
+            seconds = total_chunks / spec["chunks_per_second"]
+        else:
+            seconds = total_tokens / spec["tokens_per_second"]
+        estimates[name] = {"usd": round(cost, 6), "seconds": round(seconds, 1)}
+    return estimates
+
+
+def profile_corpus(corpus_dir, splitter_config=DEFAULT_SPLITTER_CONFIG, pattern="*.txt",
+                   encoding_name="cl100k_base", include_chunks=False, max_workers=None,
+                   backends=EMBEDDING_BACKENDS):
+    """
+    平行分析整個語料庫目錄
+
+    回傳：包含每個檔案統計、總計與各後端估算的 dict
+    """
+    files = sorted(glob.glob(os.path.join(corpus_dir, "**", pattern), recursive=True))
+    if not files:
+        raise FileNotFoundError(f"在 {corpus_dir} 中找不到符合 {pattern} 的檔案")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        per_file = list(executor.map(
+            analyze_file,
+            files,
+            [splitter_config] * len(files),
+            [encoding_name] * len(files),
+            [include_chunks] * len(files),
+            chunksize=max(1, len(files) // ((os.cpu_count() or 1) * 4))
+        ))
+
+    totals = {
+        "files": len(per_file),
+        "characters": sum(item["characters"] for item in per_file),
+        "file_tokens": sum(item["file_tokens"] for item in per_file),
+        "chunks": sum(item["chunks"] for item in per_file),
+        "embedded_tokens": sum(item["embedded_tokens"] for item in per_file),
+    }
+
+    return {
+        "corpus_dir": os.path.abspath(corpus_dir),
+        "encoding": encoding_name,
+        "splitter": splitter_config,
+        "totals": totals,
+        "backends": estimate_backends(totals["embedded_tokens"], totals["chunks"], backends),
+        "files": per_file,
+    }
+
+
+def print_report(report):
+    """以表格輸出分析結果"""
+    splitter = report["splitter"]
+    print(f"語料庫：{report['corpus_dir']}")
+    print(f"分割設定：chunk_size={splitter['chunk_size']}, chunk_overlap={splitter['chunk_overlap']}")
+    print()
+    print(f"{'檔案':<24}{'字元':>10}{'Token':>10}{'區塊':>8}{'嵌入Token':>12}{'區塊Token(平均/最大)':>24}")
+    for item in report["files"]:
+        print(
+            f"{item['file']:<24}{item['characters']:>10}{item['file_tokens']:>10}{item['chunks']:>8}"
+            f"{item['embedded_tokens']:>12}{item['chunk_tokens_mean']:>16}/{item['chunk_tokens_max']}"
+        )
+
+    totals = report["totals"]
+    print()
+    print(
+        f"總計：{totals['files']} 個檔案、{totals['chunks']} 個區塊、"
+        f"{totals['file_tokens']} token（嵌入 {totals['embedded_tokens']} token）"
+    )
+    print()
+    print(f"{'Embedding 後端':<48}{'估計成本 (USD)':>16}{'估計時間 (秒)':>16}")
+    for name, estimate in report["backends"].items():
+        print(f"{name:<48}{estimate['usd']:>16.6f}{estimate['seconds']:>16.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="估算語料庫的 embedding token 數、成本與時間")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR, help="語料庫目錄")
+    parser.add_argument("--pattern", default="*.txt", help="檔案名稱樣式")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_SPLITTER_CONFIG["chunk_size"])
+    parser.add_argument("--chunk-overlap", type=int, default=DEFAULT_SPLITTER_CONFIG["chunk_overlap"])
+    parser.add_argument("--separator", default=DEFAULT_SPLITTER_CONFIG["separator"])
+    parser.add_argument("--encoding", default="cl100k_base", help="tiktoken 編碼名稱")
+    parser.add_argument("--workers", type=int, default=None, help="平行行程數量")
+    parser.add_argument("--per-chunk", action="store_true", help="在 JSON 中輸出每個區塊的 token 數")
+    parser.add_argument(
+        "--throughput", action="append", default=[], metavar="後端=區塊每秒",
+        help="覆寫本地後端的吞吐量，例如 'local/BAAI/bge-m3 (CPU)=5'（可重複指定）"
     )
+    parser.add_argument("--json", metavar="路徑", help="輸出 JSON 報告（使用 - 輸出到標準輸出）")
+    return parser.parse_args(argv)
 
-# Read the content of the file
-with open(file_path, "r", encoding="utf-8") as file:
-    text = file.read()
 
-tokenizer = tiktoken.get_encoding(
-    "cl100k_base"
-)  # Use the appropriate encoding for the model
+def main(argv=None):
+    args = parse_args(argv)
+
+    backends = {name: dict(spec) for name, spec in EMBEDDING_BACKENDS.items()}
+    for item in args.throughput:
+        name, _, value = item.rpartition("=")
+        backends.setdefault(name, {"usd_per_million_tokens": 0.0})
+        backends[name]["chunks_per_second"] = float(value)
+
+    splitter_config = {
+        "chunk_size": args.chunk_size,
+        "chunk_overlap": args.chunk_overlap,
+        # 允許在命令列以 \\n、\\t 表示換行與 tab
+        "separator": args.separator.replace("\\n", "\n").replace("\\t", "\t"),
+    }
+    report = profile_corpus(
+        args.corpus,
+        splitter_config,
+        pattern=args.pattern,
+        encoding_name=args.encoding,
+        include_chunks=args.per_chunk,
+        max_workers=args.workers,
+        backends=backends,
+    )
+
+    if args.json == "-":
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
 
-# Tokenize the text and count the tokens
-tokens = tokenizer.encode(text)
-total_tokens = len(tokens)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n已輸出 JSON 報告：{args.json}")
 
-# Calculate the cost based on OpenAI's pricing
-cost_per_million_tokens = 0.02  # $0.02 per million tokens
-cost = (total_tokens / 1_000_000) * cost_per_million_tokens
 
-# Print the results
-print(f"Total number of tokens: {total_tokens}")
-print(f"Estimated cost for processing: ${cost:.6f}")
+if __name__ == "__main__":
+    main()
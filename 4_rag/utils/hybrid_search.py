@@ -0,0 +1,242 @@
+"""
+混合檢索：BM25 關鍵字檢索 + 向量檢索
+功能：在 Chroma 旁維護一份精簡的磁碟倒排索引（支援中文的 unigram/bigram 分詞），
+      兩種檢索同時執行，再以 Reciprocal Rank Fusion (RRF) 合併排名
+
+向量檢索容易漏掉型號、錯誤代碼、條款編號這類「必須完全相符」的字串，
+關鍵字檢索則能精準命中，兩者互補
+
+索引只保存區塊 ID 與詞頻統計，不重複保存區塊文字與 metadata；
+查詢時只為排名在前的區塊，依 ID 從向量資料庫取回內容
+
+使用方式：
+    lexical_index = load_or_build_lexical_index(db, index_path, index_version)
+    retriever = HybridRetriever(vectorstore=db, lexical_index=lexical_index, k=3)
+    docs = retriever.invoke("錯誤代碼 E21 是什麼意思？")
+"""
+
+import gzip
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.metadata_index import matches_filter
+
+# 英數字串（保留型號、版本號常見的 - . _ /）或連續的中日韓文字
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-._/][a-z0-9]+)*|[\u3400-\u9fff\uf900-\ufaff\u3040-\u30ff]+")
+_ASCII_PARTS = re.compile(r"[-._/]")
+
+# 2：不再保存區塊文字與 metadata（舊格式的索引會重建）
+LEXICAL_INDEX_FORMAT = 2
+# 有過濾條件時，每次從向量資料庫取回的候選區塊數量下限
+FETCH_BATCH_SIZE = 32
+
+_search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+
+
+def tokenize(text):
+    """
+    中英混合分詞
+
+    - 英數字串保留完整字串（例如 ax-3000、802.11ax），並拆出各段（ax、3000）
+    - 中文以單字 (unigram) 與雙字 (bigram) 切分，不需要額外的斷詞字典
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if token[0].isascii():
+            tokens.append(token)
+            parts = _ASCII_PARTS.split(token)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part)
+        else:
+            tokens.extend(token)
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    以 BM25 計分的倒排索引
+
+    vectorstore 用於依區塊 ID 取回文字與 metadata（需支援 get(ids=..., include=...)，
+    例如 Chroma 或 MmapVectorStore），不會被存到磁碟
+    """
+
+    def __init__(self, k1=1.5, b=0.75, vectorstore=None):
+        self.k1 = k1
+        self.b = b
+        self.vectorstore = vectorstore
+        self.index_version = None
+        self.doc_ids = []
+        self.doc_lengths = []
+        self.postings = {}
+
+    @classmethod
+    def build(cls, doc_ids, texts, index_version=None, **kwargs):
+        """由文檔區塊建立索引（文字只用於分詞，不保存）"""
+        index = cls(**kwargs)
+        index.index_version = index_version
+        index.doc_ids = list(doc_ids)
+
+        for row, text in enumerate(texts):
+            term_counts = Counter(tokenize(text))
+            index.doc_lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                index.postings.setdefault(term, []).append((row, count))
+        return index
+
+    @property
+    def average_length(self):
+        return sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def search(self, query, k=10, filter=None):
+        """
+        以 BM25 計分查詢
+
+        回傳：[(Document, 分數)]，分數越高越相關
+        """
+        total_docs = len(self.doc_ids)
+        if not total_docs:
+            return []
+
+        average_length = self.average_length or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, tf in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[row] / average_length
+                scores[row] = scores.get(row, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        # 依排名分批取回區塊內容；有過濾條件時一次多取一些，減少往返次數
+        batch_size = max(k, FETCH_BATCH_SIZE) if filter else k
+        results = []
+        for start in range(0, len(ranked), batch_size):
+            batch = ranked[start:start + batch_size]
+            data = self.vectorstore.get(
+                ids=[self.doc_ids[row] for row, _ in batch], include=["documents", "metadatas"]
+            )
+            stored = {
+                doc_id: (text, metadata or {})
+                for doc_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+            }
+            for row, score in batch:
+                doc_id = self.doc_ids[row]
+                # 索引重建前已從向量資料庫刪除的區塊直接略過
+                if doc_id not in stored:
+                    continue
+                text, metadata = stored[doc_id]
+                if not matches_filter(metadata, filter):
+                    continue
+                results.append((Document(page_content=text, metadata=metadata, id=doc_id), score))
+                if len(results) >= k:
+                    return results
+        return results
+
+    def save(self, path):
+        """以 gzip 壓縮的 JSON 存到磁碟"""
+        data = {
+            "format": LEXICAL_INDEX_FORMAT,
+            "k1": self.k1,
+            "b": self.b,
+            "index_version": self.index_version,
+            "doc_ids": self.doc_ids,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, vectorstore=None):
+        """從磁碟載入索引；格式版本不符時拋出 ValueError"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") != LEXICAL_INDEX_FORMAT:
+            raise ValueError(f"關鍵字索引格式版本不符：{data.get('format')}")
+        index = cls(k1=data["k1"], b=data["b"], vectorstore=vectorstore)
+        index.index_version = data["index_version"]
+        index.doc_ids = data["doc_ids"]
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = {term: [tuple(p) for p in postings] for term, postings in data["postings"].items()}
+        return index
+
+
+def load_or_build_lexical_index(db, index_path, index_version):
+    """
+    載入關鍵字索引；索引版本與向量資料庫不一致時，從 Chroma 的文字內容重建
+    （只需分詞，不需要重新計算 embedding）
+
+    查詢結果的文字與 metadata 由 db 依區塊 ID 取回
+    """
+    if os.path.exists(index_path):
+        try:
+            index = BM25Index.load(index_path, vectorstore=db)
+            if index.index_version == index_version:
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ 關鍵字索引讀取失敗，將重建: {e}")
+
+    print("🔨 建立關鍵字索引...")
+    data = db.get(include=["documents"])
+    index = BM25Index.build(data["ids"], data["documents"], index_version=index_version, vectorstore=db)
+    index.save(index_path)
+    print(f"✅ 關鍵字索引建立完成，共 {len(index.doc_ids)} 個區塊、{len(index.postings)} 個詞彙")
+    return index
+
+
+def reciprocal_rank_fusion(result_lists, k=60):
+    """
+    以 RRF 合併多組排名結果：score = Σ 1 / (k + rank)
+
+    參數：
+        result_lists: [[Document, ...], ...]，每組依相關度排序
+    """
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            key = (doc.metadata.get("filename"), doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """同時執行向量檢索與 BM25 檢索，以 RRF 合併結果"""
+
+    vectorstore: Any
+    lexical_index: Any
+    k: int = 4
+    dense_k: Optional[int] = None
+    lexical_k: Optional[int] = None
+    filter: Optional[dict] = None
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        dense_k = self.dense_k or self.k
+        lexical_k = self.lexical_k or self.k * 2
+
+        # 關鍵字檢索在背景執行緒進行，與向量檢索同時執行
+        lexical_future = _search_executor.submit(self.lexical_index.search, query, lexical_k, self.filter)
+        dense_docs = self.vectorstore.similarity_search(query, k=dense_k, filter=self.filter)
+        lexical_docs = [doc for doc, _ in lexical_future.result()]
+
+        return reciprocal_rank_fusion([dense_docs, lexical_docs], k=self.rrf_k)[:self.k]
@@ -0,0 +1,296 @@
+"""
+增量索引工具
+功能：以內容雜湊 (SHA-256) 記錄每個檔案與每個文檔區塊，
+      啟動時比對 books/ 與 manifest，只嵌入新增/變更的區塊，並刪除已消失的區塊
+
+manifest 存放在 Chroma 目錄內 (db/index_manifest.json)，
+刪除 db 目錄時會一併刪除，避免 manifest 與向量資料庫不一致
+"""
+
+import hashlib
+import json
+import os
+
+from utils.ingestion import DEFAULT_BATCH_SIZE, BatchWriter, iter_split_results
+
+MANIFEST_FILENAME = "index_manifest.json"
+# 2：區塊加入章節標題與位置 metadata（舊版 manifest 會觸發一次重建，embedding 由快取取得）
+MANIFEST_VERSION = 2
+
+# Chroma 單次刪除的區塊數量上限
+DELETE_BATCH_SIZE = 256
+
+
+def file_sha256(file_path):
+    """計算檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    """計算文字內容的 SHA-256"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def assign_chunk_ids(filename, chunks):
+    """依「檔名 + 區塊內容」產生穩定的區塊 ID，內容不變則 ID 不變"""
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        base = text_sha256(f"{filename}\0{chunk.page_content}")[:32]
+        # 同一檔案中內容完全相同的區塊，以出現順序區分
+        occurrence = seen.get(base, 0)
+        seen[base] = occurrence + 1
+        ids.append(f"{base}-{occurrence}")
+    return ids
+
+
+def manifest_path(db_path):
+    """取得 manifest 檔案路徑"""
+    return os.path.join(db_path, MANIFEST_FILENAME)
+
+
+def load_manifest(db_path):
+    """讀取 manifest，不存在或格式不符時回傳 None"""
+    path = manifest_path(db_path)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ manifest 讀取失敗，將重建索引: {e}")
+        return None
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+# manifest 路徑 → (修改時間, 索引版本)
+_manifest_versions = {}
+
+
+def manifest_index_version(db_path):
+    """
+    manifest 中的索引版本；manifest 不存在時回傳 None
+
+    依 manifest 的修改時間快取，manifest 沒有變更時只需要一次 stat，可以在每個請求中呼叫
+    """
+    path = manifest_path(db_path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    cached = _manifest_versions.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    manifest = load_manifest(db_path)
+    version = manifest["index_version"] if manifest else None
+    _manifest_versions[path] = (mtime, version)
+    return version
+
+
+def current_index_version(db, db_path):
+    """
+    目前向量資料庫的索引版本（供衍生索引判斷是否需要重建）
+
+    有 manifest 時使用 manifest 的版本號（增量更新時遞增）；
+    沒有 manifest（例如一次性建立的資料庫）時以區塊數量代替
+    """
+    manifest = load_manifest(db_path)
+    if manifest is not None:
+        return manifest["index_version"]
+    return f"chunks:{len(db.get(include=[])['ids'])}"
+
+
+def _previous_index_version(db_path):
+    """讀取舊 manifest 的索引版本（不檢查格式版本），讓重建後的版本號持續遞增"""
+    try:
+        with open(manifest_path(db_path), "r", encoding="utf-8") as f:
+            return int(json.load(f).get("index_version", 0))
+    except (OSError, ValueError, TypeError, AttributeError):
+        return 0
+
+
+def save_manifest(db_path, manifest):
+    """寫入 manifest（先寫暫存檔再替換，避免中斷時留下損毀的檔案）"""
+    os.makedirs(db_path, exist_ok=True)
+    path = manifest_path(db_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _delete_in_batches(db, ids):
+    """分批從 Chroma 刪除"""
+    ids = list(ids)
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        db.delete(ids=ids[start:start + DELETE_BATCH_SIZE])
+
+
+def _update_metadata(db, chunks_by_id):
+    """
+    更新保留區塊的 metadata（內容未變、ID 不變，但文檔名稱或區塊位置等 metadata 可能已改變）
+
+    只寫入 metadata 與資料庫中不同的區塊，不重新計算 embedding
+    回傳：更新的區塊數量
+    """
+    ids = list(chunks_by_id)
+    updated = 0
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        batch = ids[start:start + DELETE_BATCH_SIZE]
+        stored = db.get(ids=batch, include=["metadatas"])
+        changed_ids, changed_metadatas = [], []
+        for chunk_id, metadata in zip(stored["ids"], stored["metadatas"]):
+            expected = chunks_by_id[chunk_id].metadata
+            if (metadata or {}) != expected:
+                changed_ids.append(chunk_id)
+                changed_metadatas.append(expected)
+        if changed_ids:
+            # langchain 的 update_documents 會重新計算 embedding，這裡只需要更新 metadata
+            db._collection.update(ids=changed_ids, metadatas=changed_metadatas)
+            updated += len(changed_ids)
+    return updated
+
+
+def sync_vector_store(db, db_path, sources, split_file, splitter_config, progress=None,
+                      batch_size=DEFAULT_BATCH_SIZE, max_workers=None):
+    """
+    比對來源檔案與 manifest，增量更新向量資料庫
+
+    參數：
+        db: Chroma 向量資料庫
+        db_path: Chroma 持久化目錄（manifest 存放於此）
+        sources: {檔案路徑: (文檔名稱, 檔名)}
+        split_file: 函數 (檔案路徑, 文檔名稱, 檔名) -> 分割後的 Document 列表
+        splitter_config: 分割設定 dict，設定變更時所有檔案都會重新分割比對
+        progress: 選用的進度回呼函數 (已處理檔案數, 檔案總數)
+        batch_size: 每批送入 embedding 模型並寫入 Chroma 的區塊數量
+        max_workers: 平行讀取/分割檔案的工作數量
+
+    回傳：本次同步的統計資訊 dict
+    """
+    manifest = load_manifest(db_path)
+
+    if manifest is None:
+        # 沒有 manifest 的舊資料庫：區塊 ID 無法對應，清空後重建一次
+        existing_ids = db.get(include=[])["ids"]
+        if existing_ids:
+            print(f"⚠️ 找不到索引 manifest，清除舊資料 {len(existing_ids)} 個區塊後重建")
+            _delete_in_batches(db, existing_ids)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            # 沿用舊的版本號，避免與依版本號快取的衍生索引（關鍵字、mmap）撞號
+            "index_version": _previous_index_version(db_path),
+            "splitter": splitter_config,
+            "files": {}
+        }
+
+    splitter_changed = manifest.get("splitter") != splitter_config
+    old_files = manifest["files"]
+    new_files = {}
+    stats = {
+        "unchanged": 0, "added": 0, "deleted": 0, "metadata_updated": 0,
+        "files_changed": 0, "files_removed": 0
+    }
+
+    # 第一階段：以檔案雜湊找出需要重新分割的檔案（只讀取位元組，不做分割）
+    changed_files = {}
+    tasks = []
+    for file_path, (doc_name, filename) in sources.items():
+        if not os.path.exists(file_path):
+            print(f"⚠️ 檔案不存在: {file_path}")
+            continue
+
+        file_hash = file_sha256(file_path)
+        old_entry = old_files.get(filename)
+
+        # 檔案內容、文檔名稱與分割設定都沒變，直接沿用
+        if (
+            old_entry
+            and not splitter_changed
+            and old_entry["file_hash"] == file_hash
+            and old_entry["source_name"] == doc_name
+        ):
+            new_files[filename] = old_entry
+            stats["unchanged"] += len(old_entry["chunks"])
+            continue
+
+        changed_files[filename] = (doc_name, file_hash, old_entry)
+        tasks.append((filename, (file_path, doc_name, filename)))
+
+    # 第二階段：平行分割變更的檔案，新區塊以固定批次嵌入並寫入
+    writer = BatchWriter(db, batch_size=batch_size, total_files=len(tasks))
+
+    for filename, chunks, error in iter_split_results(tasks, split_file, max_workers=max_workers):
+        doc_name, file_hash, old_entry = changed_files[filename]
+        writer.file_done()
+        if progress:
+            progress(writer.files_done, len(tasks))
+
+        if error:
+            print(f"❌ 載入失敗 {doc_name}: {error}")
+            # 讀取失敗時保留舊的索引內容（仍在提供查詢，計入未變更）
+            if old_entry:
+                new_files[filename] = old_entry
+                stats["unchanged"] += len(old_entry["chunks"])
+            continue
+
+        chunk_ids = assign_chunk_ids(filename, chunks)
+        old_ids = set(old_entry["chunks"]) if old_entry else set()
+        new_id_set = set(chunk_ids)
+
+        to_add = [(cid, doc) for cid, doc in zip(chunk_ids, chunks) if cid not in old_ids]
+        to_delete = old_ids - new_id_set
+        # 保留的區塊：內容相同，但文檔名稱或其他 metadata 可能已改變
+        to_keep = {cid: doc for cid, doc in zip(chunk_ids, chunks) if cid in old_ids}
+
+        if to_delete:
+            _delete_in_batches(db, to_delete)
+        if to_add:
+            writer.add([doc for _, doc in to_add], [cid for cid, _ in to_add])
+        metadata_updated = _update_metadata(db, to_keep) if to_keep else 0
+
+        stats["added"] += len(to_add)
+        stats["deleted"] += len(to_delete)
+        stats["unchanged"] += len(to_keep)
+        stats["metadata_updated"] += metadata_updated
+        stats["files_changed"] += 1
+        print(
+            f"✅ 更新 {doc_name}: 新增 {len(to_add)}、刪除 {len(to_delete)}、"
+            f"更新 metadata {metadata_updated} 個區塊"
+        )
+
+        new_files[filename] = {
+            "file_hash": file_hash,
+            "source_name": doc_name,
+            "chunks": chunk_ids
+        }
+
+    writer.flush()
+
+    # 已從 books/ 消失的檔案：刪除所有區塊
+    for filename, old_entry in old_files.items():
+        if filename in new_files:
+            continue
+        _delete_in_batches(db, old_entry["chunks"])
+        stats["deleted"] += len(old_entry["chunks"])
+        stats["files_removed"] += 1
+        print(f"🗑️ 移除 {old_entry['source_name']}: {len(old_entry['chunks'])} 個區塊")
+
+    if stats["added"] or stats["deleted"] or stats["metadata_updated"] or splitter_changed:
+        manifest["index_version"] = manifest.get("index_version", 0) + 1
+    manifest["splitter"] = splitter_config
+    manifest["files"] = new_files
+    save_manifest(db_path, manifest)
+
+    stats["index_version"] = manifest["index_version"]
+    stats["throughput"] = writer.stats()
+    return stats
@@ -0,0 +1,225 @@
+"""
+平行文檔匯入管線
+功能：以行程池平行讀取與分割檔案，區塊以固定大小的批次送入 embedding 模型，
+      每批完成後立即寫入 Chroma，並回報進度與吞吐量
+
+記憶體用量有上限：同時處理中的檔案數量受 max_pending 限制，
+寫入緩衝區最多只保留一個批次的區塊，與語料庫大小無關
+
+工作行程以 forkserver（不支援時 spawn）啟動，不從已有背景執行緒的主行程 fork；
+工作行程以輕量的 utils/text_splitting.py 作為主模組，不會重新匯入主程式（例如 Gradio 應用）。
+split_file 必須是主程式以外的模組中可被 pickle 的函數（例如 text_splitting 的函數或其 functools.partial）
+
+使用方式：
+    from utils.ingestion import ingest_files
+    from utils.text_splitting import load_and_split_text_file
+
+    tasks = [(file_path, (file_path, {"source_name": name, "filename": filename}, SPLITTER_CONFIG))]
+    stats = ingest_files(db, tasks, load_and_split_text_file, batch_size=64)
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from multiprocessing import context as mp_context
+
+from utils import text_splitting
+
+# 每批送入 embedding 模型並寫入 Chroma 的區塊數量
+DEFAULT_BATCH_SIZE = 64
+
+
+def default_workers():
+    """預設的平行工作數量"""
+    return max(1, min(8, (os.cpu_count() or 2) - 1))
+
+
+_worker_main_lock = threading.Lock()
+
+
+@contextmanager
+def _worker_main():
+    """
+    啟動工作行程期間，以 utils.text_splitting 作為子行程的主模組
+
+    spawn / forkserver 的子行程依 __main__.__spec__（或 __main__.__file__）重新執行主模組，
+    不替換時會以 __mp_main__ 重新匯入整個主程式（Gradio、LangChain 與所有模組層級的初始化）
+    """
+    main_module = sys.modules["__main__"]
+    with _worker_main_lock:
+        original_spec = getattr(main_module, "__spec__", None)
+        main_module.__spec__ = text_splitting.__spec__
+        try:
+            yield
+        finally:
+            main_module.__spec__ = original_spec
+
+
+class _WorkerProcess:
+    """啟動時以 utils.text_splitting 作為主模組的行程（與 multiprocessing 的 Process 類別混用）"""
+
+    def start(self):
+        with _worker_main():
+            super().start()
+
+
+class _SpawnWorkerProcess(_WorkerProcess, mp_context.SpawnProcess):
+    pass
+
+
+class _SpawnWorkerContext(mp_context.SpawnContext):
+    Process = _SpawnWorkerProcess
+
+
+# Windows 只支援 spawn
+if hasattr(mp_context, "ForkServerContext"):
+    class _ForkServerWorkerProcess(_WorkerProcess, mp_context.ForkServerProcess):
+        pass
+
+    class _ForkServerWorkerContext(mp_context.ForkServerContext):
+        Process = _ForkServerWorkerProcess
+
+
+def create_executor(max_workers):
+    """
+    建立平行執行器
+
+    匯入在背景載入執行緒中進行，此時主行程已有其他執行緒（Gradio、其他載入器），
+    fork 會複製其他執行緒持有中的鎖，因此使用 forkserver，不支援時使用 spawn；
+    工作行程只匯入 utils.text_splitting，不重新匯入主程式
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=_ForkServerWorkerContext())
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=_SpawnWorkerContext())
+
+
+def iter_split_results(tasks, split_file, max_workers=None, max_pending=None):
+    """
+    平行執行 split_file，依完成順序產生 (key, 區塊列表, 例外)
+
+    參數：
+        tasks: [(key, split_file 的參數 tuple)]
+        split_file: 讀取並分割單一檔案的函數（需可被 pickle）
+        max_workers: 平行工作數量
+        max_pending: 同時處理中的檔案數量上限（預設為 max_workers 的 2 倍）
+    """
+    max_workers = max_workers or default_workers()
+    max_pending = max_pending or max_workers * 2
+    tasks = iter(tasks)
+
+    with create_executor(max_workers) as executor:
+        pending = {}
+
+        def submit_next():
+            task = next(tasks, None)
+            if task is None:
+                return False
+            key, args = task
+            pending[executor.submit(split_file, *args)] = key
+            return True
+
+        while len(pending) < max_pending and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    yield key, future.result(), None
+                except Exception as e:
+                    yield key, [], e
+                submit_next()
+
+
+class BatchWriter:
+    """累積區塊到固定批次大小後寫入 Chroma，並記錄吞吐量"""
+
+    def __init__(self, db, batch_size=DEFAULT_BATCH_SIZE, total_files=None, report=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.total_files = total_files
+        self.report = report
+        self.files_done = 0
+        self.chunks_written = 0
+        self.batches_written = 0
+        self.started_at = time.monotonic()
+        self._docs = []
+        self._ids = []
+
+    def add(self, docs, ids=None):
+        """加入區塊，累積滿一個批次就寫入"""
+        ids = ids if ids is not None else [None] * len(docs)
+        for doc, doc_id in zip(docs, ids):
+            self._docs.append(doc)
+            self._ids.append(doc_id)
+            if len(self._docs) >= self.batch_size:
+                self.flush()
+
+    def file_done(self):
+        """記錄完成一個檔案"""
+        self.files_done += 1
+
+    def flush(self):
+        """寫入目前累積的區塊（embedding 在 add_documents 中以整批計算）"""
+        if not self._docs:
+            return
+
+        if any(doc_id is None for doc_id in self._ids):
+            self.db.add_documents(self._docs)
+        else:
+            self.db.add_documents(self._docs, ids=self._ids)
+
+        self.chunks_written += len(self._docs)
+        self.batches_written += 1
+        self._docs, self._ids = [], []
+
+        stats = self.stats()
+        files = f"{self.files_done}/{self.total_files}" if self.total_files else str(self.files_done)
+        print(
+            f"📦 已寫入 {stats['chunks_written']} 個區塊（{stats['batches_written']} 批）、"
+            f"檔案 {files}、{stats['chunks_per_second']:.1f} 區塊/秒"
+        )
+        if self.report and self.total_files:
+            self.report(f"寫入向量資料庫（檔案 {files}）", self.files_done / self.total_files)
+
+    def stats(self):
+        """回傳吞吐量統計"""
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "files_done": self.files_done,
+            "chunks_written": self.chunks_written,
+            "batches_written": self.batches_written,
+            "elapsed_seconds": round(elapsed, 2),
+            "chunks_per_second": self.chunks_written / elapsed if elapsed else 0.0
+        }
+
+
+def ingest_files(db, tasks, split_file, batch_size=DEFAULT_BATCH_SIZE, max_workers=None, report=None):
+    """
+    匯入所有檔案到向量資料庫（不做增量比對）
+
+    參數：
+        db: Chroma 向量資料庫
+        tasks: [(key, split_file 的參數 tuple)]
+        split_file: 讀取並分割單一檔案的函數
+
+    回傳：吞吐量統計 dict
+    """
+    tasks = list(tasks)
+    writer = BatchWriter(db, batch_size=batch_size, total_files=len(tasks), report=report)
+
+    for key, chunks, error in iter_split_results(tasks, split_file, max_workers=max_workers):
+        if error:
+            print(f"❌ 載入失敗 {key}: {error}")
+            continue
+        writer.file_done()
+        writer.add(chunks)
+        print(f"✅ 載入 {key}: {len(chunks)} 個區塊")
+
+    writer.flush()
+    return writer.stats()
@@ -0,0 +1,144 @@
+"""
+延遲啟動工具
+功能：Gradio 介面先啟動，embedding 模型與向量資料庫在背景執行緒載入，
+      請求透過 Future 等待資源就緒，並提供健康檢查端點回報載入進度
+
+使用方式：
+    vectorstore_loader = BackgroundLoader("vectorstore", create_vector_store)
+    vectorstore_loader.start()
+
+    # 在請求中等待資源就緒
+    db = vectorstore_loader.wait(timeout=30)
+
+    # 啟動 Gradio 並提供 /health 與 /ready
+    launch_with_health(demo, [vectorstore_loader], server_port=7860)
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BackgroundLoader:
+    """在背景執行緒初始化資源，並記錄目前的載入階段與進度"""
+
+    def __init__(self, name, load_fn):
+        """
+        參數：
+            name: 資源名稱（顯示於健康檢查）
+            load_fn: 載入函數，接收 report(stage, progress=None) 回報進度，回傳資源
+        """
+        self.name = name
+        self.load_fn = load_fn
+        self.future = Future()
+        self.stage = "等待啟動"
+        self.progress = None
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def report(self, stage, progress=None):
+        """回報目前的載入階段與進度（0~1）"""
+        with self._lock:
+            self.stage = stage
+            self.progress = progress
+        print(f"⏳ [{self.name}] {stage}" + (f" ({progress:.0%})" if progress is not None else ""))
+
+    def _run(self):
+        try:
+            resource = self.load_fn(self.report)
+        except Exception as e:
+            self.report(f"載入失敗：{e}")
+            self.finished_at = time.monotonic()
+            self.future.set_exception(e)
+            return
+
+        self.finished_at = time.monotonic()
+        self.report("已就緒", 1.0)
+        self.future.set_result(resource)
+
+    def start(self):
+        """啟動背景載入（重複呼叫不會重新載入）"""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self.started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name=f"load-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def ready(self):
+        """資源是否已成功載入"""
+        return self.future.done() and self.future.exception() is None
+
+    def wait(self, timeout=None):
+        """等待資源就緒並回傳；逾時拋出 TimeoutError，載入失敗時拋出原本的例外"""
+        self.start()
+        return self.future.result(timeout=timeout)
+
+    def status(self):
+        """回傳目前狀態，供健康檢查使用"""
+        if not self.future.done():
+            state = "loading"
+        elif self.future.exception() is not None:
+            state = "failed"
+        else:
+            state = "ready"
+
+        end = self.finished_at or time.monotonic()
+        with self._lock:
+            return {
+                "status": state,
+                "stage": self.stage,
+                "progress": self.progress,
+                "elapsed_seconds": round(end - self.started_at, 2) if self.started_at else 0.0
+            }
+
+
+def launch_with_health(demo, loaders, server_name="0.0.0.0", server_port=7860, metrics=None):
+    """
+    以 FastAPI 掛載 Gradio 介面並啟動伺服器
+
+    提供的端點：
+        /health：永遠回傳 200 與各資源的載入進度（存活檢查）
+        /ready：所有資源就緒時回傳 200，否則回傳 503（就緒檢查）
+        /metrics：metrics 中每個函數回傳的統計（例如請求佇列深度）
+
+    參數：
+        metrics: {名稱: 回傳 dict 的函數}
+    """
+    import gradio as gr
+    import uvicorn
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI()
+
+    def collect_status():
+        components = {loader.name: loader.status() for loader in loaders}
+        states = {component["status"] for component in components.values()}
+        if "failed" in states:
+            overall = "failed"
+        elif states == {"ready"}:
+            overall = "ready"
+        else:
+            overall = "loading"
+        return {"status": overall, "components": components}
+
+    @app.get("/health")
+    def health():
+        return collect_status()
+
+    @app.get("/ready")
+    def ready():
+        status = collect_status()
+        return JSONResponse(status, status_code=200 if status["status"] == "ready" else 503)
+
+    @app.get("/metrics")
+    def get_metrics():
+        return {name: collect() for name, collect in (metrics or {}).items()}
+
+    app = gr.mount_gradio_app(app, demo, path="/")
+    uvicorn.run(app, host=server_name, port=server_port)
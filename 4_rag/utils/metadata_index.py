@@ -0,0 +1,304 @@
+"""
+Metadata 倒排索引與候選區塊搜尋
+功能：
+    - 匯入時為每個區塊加上結構 metadata：所屬章節標題 (section)、
+      在文檔中的順序 (chunk_index / chunk_count) 與位置 (position：前段 / 中段 / 後段)
+    - 以 {欄位: {值: 區塊 ID 集合}} 的倒排索引 (posting list) 解析複合過濾條件
+      （例如 文檔 AND 類別 AND 章節），在向量搜尋之前就得到候選區塊 ID
+    - 只在候選區塊中做精確的餘弦相似度搜尋，候選向量依 ID 集合快取
+
+下拉選單指定文檔的過濾查詢是兩個 RAG 案例最主要的查詢形式；
+Chroma 在 HNSW 搜尋時逐一檢查 metadata 條件，而過濾後的候選通常只有數十到數百個區塊，
+直接對候選做精確計算更快，結果也不受近似搜尋影響
+
+- 章節與位置 metadata 取決於區塊在文檔中的位置，文檔變更時內容未變的區塊 ID 不變，
+  但 metadata 仍可能改變；增量索引會更新這些區塊的 metadata 並遞增索引版本，
+  因此候選向量快取以 (索引版本, ID 集合) 為鍵
+- 多值欄位（例如同一份文檔屬於多個比較組合的 category）以 ", " 分隔
+
+使用方式：
+    index = load_or_build_metadata_index(db, "./db/metadata_index.json.gz", index_version)
+    ids = index.resolve({"$and": [{"source_name": "洗衣機使用說明"}, {"position": "後段"}]})
+
+    retriever = FilteredRetriever(vectorstore=db, metadata_index=index, searcher=CandidateSearcher(db),
+                                  filter={"source_name": "洗衣機使用說明"}, k=3)
+"""
+
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.document_summaries import heading_offsets
+
+# 建立倒排索引的欄位
+INDEXED_FIELDS = ("source_name", "filename", "category", "section", "position")
+MULTI_VALUE_SEPARATOR = ", "
+POSITION_BUCKETS = ("前段", "中段", "後段")
+
+
+def add_structure_metadata(text, chunks):
+    """依區塊在原文中的位置，加上章節標題、順序與位置 metadata"""
+    headings = heading_offsets(text)
+    starts = [offset for offset, _ in headings]
+    cursor = 0
+
+    for i, chunk in enumerate(chunks):
+        # 分割器會合併空行，以區塊的第一行定位（重疊的區塊從前一個區塊的起點往後找）
+        first_line = chunk.page_content.strip().split("\n", 1)[0][:50]
+        found = text.find(first_line, cursor) if first_line else -1
+        if found >= 0:
+            cursor = found
+
+        heading = bisect.bisect_right(starts, cursor) - 1
+        chunk.metadata.update(
+            section=headings[heading][1] if heading >= 0 else "",
+            chunk_index=i,
+            chunk_count=len(chunks),
+            position=POSITION_BUCKETS[min(len(POSITION_BUCKETS) - 1, i * len(POSITION_BUCKETS) // len(chunks))],
+        )
+    return chunks
+
+
+def matches_filter(metadata, filter):
+    """
+    判斷單一區塊的 metadata 是否符合過濾條件
+
+    支援與 MetadataIndex.resolve 相同的 Chroma where 語法（欄位值、$eq、$in、$and、$or），
+    供沒有倒排索引的檢索路徑（關鍵字索引、mmap 未建立列索引的欄位）使用
+    """
+    if not filter:
+        return True
+    metadata = metadata or {}
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            values = condition["$in"] if "$in" in condition else [condition["$eq"]]
+            if metadata.get(key) not in values:
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class MetadataIndex:
+    """metadata 欄位值 → 區塊 ID 集合的倒排索引"""
+
+    def __init__(self, index_version=None):
+        self.index_version = index_version
+        self.postings = {}
+
+    @classmethod
+    def build(cls, ids, metadatas, index_version=None, fields=INDEXED_FIELDS):
+        index = cls(index_version=index_version)
+        index.postings = {field: {} for field in fields}
+        for doc_id, metadata in zip(ids, metadatas):
+            for field in fields:
+                value = (metadata or {}).get(field)
+                if value is None or value == "":
+                    continue
+                values = value.split(MULTI_VALUE_SEPARATOR) if isinstance(value, str) else [value]
+                for v in values:
+                    index.postings[field].setdefault(v, set()).add(doc_id)
+        return index
+
+    def values(self, field):
+        """欄位所有的值（可作為下拉選單的選項）"""
+        return sorted(self.postings.get(field, {}), key=str)
+
+    def supports(self, filter):
+        """過濾條件是否只使用已建立索引的欄位與運算子"""
+        if not filter:
+            return True
+        for key, condition in filter.items():
+            if key in ("$and", "$or"):
+                if not all(self.supports(sub) for sub in condition):
+                    return False
+            elif key not in self.postings:
+                return False
+            elif isinstance(condition, dict) and not set(condition) <= {"$eq", "$in"}:
+                return False
+        return True
+
+    def _match(self, field, condition):
+        if isinstance(condition, dict):
+            values = condition["$in"] if "$in" in condition else [condition["$eq"]]
+        else:
+            values = [condition]
+        postings = self.postings[field]
+        matched = set()
+        for value in values:
+            matched |= postings.get(value, set())
+        return matched
+
+    def resolve(self, filter):
+        """
+        將過濾條件（Chroma 的 where 語法：欄位值、$eq、$in、$and、$or）解析為候選區塊 ID 集合
+
+        回傳：set；filter 為空時回傳 None（代表不過濾）
+        """
+        if not filter:
+            return None
+        if not self.supports(filter):
+            raise ValueError(f"過濾條件包含未建立索引的欄位或運算子：{filter}")
+
+        result = None
+        for key, condition in filter.items():
+            if key == "$and":
+                matched = None
+                for sub in condition:
+                    sub_ids = self.resolve(sub)
+                    matched = sub_ids if matched is None else matched & sub_ids
+                matched = matched or set()
+            elif key == "$or":
+                matched = set().union(*(self.resolve(sub) for sub in condition))
+            else:
+                matched = self._match(key, condition)
+            # 同一層的多個條件視為 AND
+            result = matched if result is None else result & matched
+        return result
+
+    def save(self, path):
+        """以 gzip 壓縮的 JSON 存到磁碟"""
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "index_version": self.index_version,
+                    "postings": {
+                        field: {str(value): sorted(ids) for value, ids in values.items()}
+                        for field, values in self.postings.items()
+                    },
+                },
+                f,
+                ensure_ascii=False,
+                separators=(",", ":")
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """從磁碟載入索引"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(index_version=data["index_version"])
+        index.postings = {
+            field: {value: set(ids) for value, ids in values.items()}
+            for field, values in data["postings"].items()
+        }
+        return index
+
+
+def load_or_build_metadata_index(db, index_path, index_version):
+    """載入 metadata 倒排索引；索引版本與向量資料庫不一致時，從 Chroma 的 metadata 重建"""
+    if os.path.exists(index_path):
+        try:
+            index = MetadataIndex.load(index_path)
+            if index.index_version == index_version and set(index.postings) == set(INDEXED_FIELDS):
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ metadata 索引讀取失敗，將重建: {e}")
+
+    print("🔨 建立 metadata 索引...")
+    data = db.get(include=["metadatas"])
+    index = MetadataIndex.build(data["ids"], data["metadatas"], index_version=index_version)
+    index.save(index_path)
+    sizes = ", ".join(f"{field} {len(values)}" for field, values in index.postings.items())
+    print(f"✅ metadata 索引建立完成，共 {len(data['ids'])} 個區塊（{sizes} 個值）")
+    return index
+
+
+class CandidateSearcher:
+    """只在候選區塊中做精確的向量搜尋（候選區塊的向量依 ID 集合快取）"""
+
+    def __init__(self, vectorstore, cache_size=32):
+        self.vectorstore = vectorstore
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _candidates(self, ids, index_version=None):
+        ids = sorted(ids)
+        key = (index_version, hashlib.sha1("\0".join(ids).encode("utf-8")).hexdigest())
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        data = self.vectorstore.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+        matrix = np.asarray(data["embeddings"], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        docs = [
+            Document(page_content=text, metadata=metadata or {}, id=doc_id)
+            for doc_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        ]
+        entry = (matrix / norms, docs)
+
+        with self._lock:
+            self._cache[key] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+    def search(self, query_vector, ids, k=4, index_version=None):
+        """
+        在候選區塊中搜尋
+
+        index_version: 向量資料庫的索引版本（同一組 ID 的 metadata 可能隨版本改變）
+        回傳：[(Document, 距離)]，距離 = 1 - 餘弦相似度（與 Chroma 一致）
+        """
+        if not ids:
+            return []
+        matrix, docs = self._candidates(ids, index_version)
+        if not len(docs):
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        scores = matrix @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(docs[i], float(1.0 - scores[i])) for i in top]
+
+
+class FilteredRetriever(BaseRetriever):
+    """先以 metadata 倒排索引解析過濾條件，再只在候選區塊中做向量搜尋"""
+
+    vectorstore: Any
+    metadata_index: Any
+    searcher: Any
+    filter: dict
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        query_vector = self.vectorstore.embeddings.embed_query(query)
+        if not self.metadata_index.supports(self.filter):
+            # 未建立索引的欄位：交給向量資料庫過濾
+            return self.vectorstore.similarity_search_by_vector(query_vector, k=self.k, filter=self.filter)
+
+        ids = self.metadata_index.resolve(self.filter)
+        if ids is None:
+            return self.vectorstore.similarity_search_by_vector(query_vector, k=self.k)
+        return [
+            doc for doc, _ in
+            self.searcher.search(query_vector, ids, k=self.k, index_version=self.metadata_index.index_version)
+        ]
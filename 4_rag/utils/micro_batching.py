@@ -0,0 +1,135 @@
+"""
+查詢 embedding 微批次 (micro-batching)
+功能：收集短時間內（max_wait_ms）從不同使用者送來的查詢，
+      湊成一批（最多 max_batch_size 個）以一次前向運算計算 embedding，再分別回傳給各呼叫者
+
+CPU 上一次嵌入 16 個問題的時間遠少於逐一嵌入 16 次；
+單一使用者時最多只多等待 max_wait_ms
+
+- 同一批中重複的問題只計算一次
+- 記錄批次大小與排隊延遲的直方圖
+
+使用方式：
+    embeddings = MicroBatchingEmbeddings(HuggingFaceEmbeddings(...), max_batch_size=16, max_wait_ms=5)
+    vector = embeddings.embed_query("如何設定 WiFi？")  # 可從多個執行緒同時呼叫
+    print(embeddings.stats())
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv("RAG_QUERY_BATCH_SIZE", "16"))
+DEFAULT_MAX_WAIT_MS = float(os.getenv("RAG_QUERY_BATCH_WAIT_MS", "5"))
+
+# 排隊延遲直方圖的區間上限（毫秒）
+DELAY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """把同時到達的 embed_query 呼叫合併為一次 embed_documents 計算"""
+
+    def __init__(self, embeddings, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        """
+        參數：
+            embeddings: 底層 embedding 模型（查詢以 embed_documents 批次計算，
+                        HuggingFaceEmbeddings 的 embed_query 本身也是如此實作）
+            max_batch_size: 每批最多的查詢數量
+            max_wait_ms: 收到第一個查詢後最多等待多久湊批次
+        """
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._delay_buckets = Counter()
+        self._queries = 0
+        self._total_delay = 0.0
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    self._worker.start()
+
+    def _collect_batch(self):
+        """等待第一個查詢，再於 max_wait 內收集更多查詢"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.monotonic()
+
+            # 同一批中重複的問題只計算一次
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for text, future, _ in batch:
+                future.set_result(list(vectors[text]))
+            self._record(batch, started)
+
+    def _record(self, batch, started):
+        with self._stats_lock:
+            self._batch_sizes[len(batch)] += 1
+            for _, _, submitted in batch:
+                delay_ms = (started - submitted) * 1000
+                self._total_delay += delay_ms
+                bucket = next((f"<={limit}" for limit in DELAY_BUCKETS_MS if delay_ms <= limit), "inf")
+                self._delay_buckets[bucket] += 1
+            self._queries += len(batch)
+
+    def embed_query(self, text):
+        """排入批次佇列，等待該批次計算完成"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future.result()
+
+    def embed_documents(self, texts):
+        """文檔區塊本身已是批次，直接交給底層模型"""
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self):
+        """回傳批次大小與排隊延遲的直方圖"""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "batches": batches,
+                "queries": self._queries,
+                "queue_depth": self._queue.qsize(),
+                "avg_batch_size": round(self._queries / batches, 2) if batches else 0.0,
+                "avg_queue_delay_ms": round(self._total_delay / self._queries, 2) if self._queries else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "queue_delay_ms_histogram": {
+                    bucket: self._delay_buckets[bucket]
+                    for bucket in [f"<={limit}" for limit in DELAY_BUCKETS_MS] + ["inf"]
+                    if self._delay_buckets[bucket]
+                },
+            }
@@ -0,0 +1,376 @@
+"""
+記憶體映射 (memory-mapped) 量化向量資料庫
+功能：將區塊向量存成 float16 或 int8 的 NumPy 矩陣，以 mmap 唯讀開啟，
+      查詢時用向量化的矩陣乘法做精確 top-k 搜尋，取代 Chroma 的 HNSW 索引
+
+- 向量先正規化再量化，內積即為餘弦相似度
+- source_name / filename / section / position 在匯出時預先建立列索引，查詢時只計算符合的列；
+  過濾條件支援與 Chroma 相同的 $eq、$in、$and、$or
+- 多個工作行程以 mmap 開啟同一份檔案時共用作業系統的 page cache，不會複製資料
+  （向量與文字、metadata 都以 mmap 開啟，只解析搜尋結果的列）
+- 資料由 Chroma 匯出（不需重新計算 embedding），Chroma 仍是增量索引的來源
+
+檔案結構（每個索引版本與 dtype 各一個子目錄，例如 mmap_store/v12-int8-f2/）：
+    vectors.npy    (n, d) float16 或 int8 矩陣
+    scales.npy     int8 模式下每列的縮放係數 (float32)
+    records.jsonl  每列的 id、文字與 metadata
+    offsets.npy    每列在 records.jsonl 中的位元組位置 (int64, n + 1)
+    row_index.json 預先建立的 {欄位: {值: [列]}}
+    info.json      格式版本、dtype、維度、索引版本
+
+匯出的版本目錄寫入後不再修改：先寫到暫存目錄，完成後以 os.replace 改名，
+其他行程 mmap 中的舊版本檔案不會被覆寫（避免 SIGBUS 或讀到寫到一半的資料），
+多個行程（例如案例 1 與案例 2）可以同時使用各自索引版本的匯出
+
+使用方式：
+    store = load_or_export_mmap_store(chroma_db, "./db/mmap_store", index_version, dtype="int8")
+    docs = store.similarity_search("如何設定 WiFi？", k=3, filter={"source_name": "路由器設定手冊"})
+    docs = store.similarity_search("E03", k=3, filter={"$and": [{"source_name": "洗衣機使用說明"}, {"position": "後段"}]})
+"""
+
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+# 預先建立列索引的 metadata 欄位
+INDEXED_FIELDS = ("source_name", "filename", "section", "position")
+
+# 匯出檔案的格式版本（格式變更時寫入新的版本目錄）
+STORE_FORMAT = 2
+
+# 每次矩陣乘法處理的列數，避免 float16/int8 轉型時佔用過多記憶體
+SEARCH_BLOCK_ROWS = 65536
+
+# 匯出新版本後保留的版本目錄數量（其他行程可能仍在使用較舊的版本）
+KEEP_VERSIONS = 3
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def write_mmap_store(path, ids, vectors, texts, metadatas, dtype="float16", index_version=None,
+                     indexed_fields=INDEXED_FIELDS):
+    """將向量與 metadata 寫成 mmap 向量資料庫的檔案"""
+    if dtype not in ("float16", "int8"):
+        raise ValueError(f"不支援的 dtype：{dtype}（可用 float16 或 int8）")
+
+    os.makedirs(path, exist_ok=True)
+    matrix = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+    if dtype == "int8":
+        # 每列以最大絕對值縮放到 [-127, 127]
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(matrix / scales[:, None]).astype(np.int8)
+        np.save(os.path.join(path, "scales.npy"), scales.astype(np.float32))
+    else:
+        quantized = matrix.astype(np.float16)
+    np.save(os.path.join(path, "vectors.npy"), quantized)
+
+    # 每列記錄在 records.jsonl 中的位元組位置，查詢時只解析需要的列
+    offsets = [0]
+    row_index = {field: {} for field in indexed_fields}
+    with open(os.path.join(path, "records.jsonl"), "wb") as f:
+        for row, (doc_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+            metadata = metadata or {}
+            line = json.dumps({"id": doc_id, "text": text, "metadata": metadata}, ensure_ascii=False) + "\n"
+            f.write(line.encode("utf-8"))
+            offsets.append(offsets[-1] + len(line.encode("utf-8")))
+            for field in indexed_fields:
+                if field in metadata:
+                    row_index[field].setdefault(str(metadata[field]), []).append(row)
+    np.save(os.path.join(path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+    with open(os.path.join(path, "row_index.json"), "w", encoding="utf-8") as f:
+        json.dump(row_index, f, ensure_ascii=False, separators=(",", ":"))
+
+    # info.json 最後寫入，作為匯出完成的標記
+    with open(os.path.join(path, "info.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "format": STORE_FORMAT,
+            "dtype": dtype,
+            "rows": int(quantized.shape[0]),
+            "dimensions": int(quantized.shape[1]) if quantized.ndim == 2 else 0,
+            "index_version": index_version
+        }, f)
+
+
+class MmapVectorStore(VectorStore):
+    """以 mmap 開啟的唯讀量化向量資料庫，支援精確 top-k 與 metadata 過濾"""
+
+    def __init__(self, path, embedding_function):
+        self.path = path
+        self.embedding_function = embedding_function
+
+        with open(os.path.join(path, "info.json"), "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.rows = self.info["rows"]
+
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = (
+            np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+            if self.info["dtype"] == "int8" else None
+        )
+
+        # 文字與 metadata 不複製到每個行程：records.jsonl 以 mmap 開啟，依列的位元組位置解析
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        with open(os.path.join(path, "records.jsonl"), "rb") as f:
+            self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.rows else b""
+        self._row_of = None
+
+        # 預先建立的 {欄位: {值: 列索引陣列}}
+        with open(os.path.join(path, "row_index.json"), "r", encoding="utf-8") as f:
+            self.row_index = {
+                field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+                for field, values in json.load(f).items()
+            }
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @property
+    def index_version(self):
+        return self.info.get("index_version")
+
+    def _record(self, row):
+        """解析單一列的 id、文字與 metadata"""
+        return json.loads(self._records[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def _document(self, row):
+        record = self._record(row)
+        return Document(page_content=record["text"], metadata=record["metadata"], id=record["id"])
+
+    def get(self, ids=None, include=None):
+        """取得區塊（與 Chroma.get 相同的回傳格式）；ids 為 None 時回傳所有區塊"""
+        include = include or []
+        if ids is None:
+            rows = range(self.rows)
+        else:
+            if self._row_of is None:
+                # 依 ID 取得時才建立 ID → 列的對照表
+                self._row_of = {self._record(row)["id"]: row for row in range(self.rows)}
+            rows = [self._row_of[doc_id] for doc_id in ids if doc_id in self._row_of]
+
+        data = {"ids": []}
+        if "documents" in include:
+            data["documents"] = []
+        if "metadatas" in include:
+            data["metadatas"] = []
+        for row in rows:
+            record = self._record(row)
+            data["ids"].append(record["id"])
+            if "documents" in include:
+                data["documents"].append(record["text"])
+            if "metadatas" in include:
+                data["metadatas"].append(record["metadata"])
+        return data
+
+    def _field_rows(self, field, condition):
+        """單一欄位條件（值、$eq、$in）符合的列"""
+        if isinstance(condition, dict):
+            values = condition["$in"] if "$in" in condition else [condition["$eq"]]
+        else:
+            values = [condition]
+
+        if field in self.row_index:
+            matched = [self.row_index[field].get(str(value)) for value in values]
+            return np.unique(np.concatenate([m for m in matched if m is not None] or [np.empty(0, dtype=np.int64)]))
+
+        # 沒有預先建立索引的欄位：掃描 metadata
+        return np.asarray(
+            [row for row in range(self.rows) if self._record(row)["metadata"].get(field) in values],
+            dtype=np.int64
+        )
+
+    def _rows_for_filter(self, filter):
+        """
+        將過濾條件轉為列索引；None 代表全部的列
+
+        支援與 Chroma 相同的 where 語法（欄位值、$eq、$in、$and、$or），
+        同一層的多個條件視為 AND
+        """
+        if not filter:
+            return None
+
+        rows = None
+        for key, condition in filter.items():
+            if key == "$and":
+                matched = None
+                for sub in condition:
+                    sub_rows = self._rows_for_filter(sub)
+                    if sub_rows is not None:
+                        matched = sub_rows if matched is None else np.intersect1d(matched, sub_rows)
+                if matched is None:
+                    continue
+            elif key == "$or":
+                subs = [self._rows_for_filter(sub) for sub in condition]
+                if any(sub_rows is None for sub_rows in subs):
+                    continue
+                matched = np.unique(np.concatenate(subs or [np.empty(0, dtype=np.int64)]))
+            else:
+                matched = self._field_rows(key, condition)
+            rows = matched if rows is None else np.intersect1d(rows, matched)
+        return rows
+
+    def _scores(self, query, rows):
+        """計算查詢向量與指定列的餘弦相似度"""
+        total = self.rows if rows is None else len(rows)
+        scores = np.empty(total, dtype=np.float32)
+
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, total)
+            if rows is None:
+                block = self.vectors[start:end]
+                scales = self.scales[start:end] if self.scales is not None else None
+            else:
+                block = self.vectors[rows[start:end]]
+                scales = self.scales[rows[start:end]] if self.scales is not None else None
+
+            block_scores = block.astype(np.float32) @ query
+            if scales is not None:
+                block_scores *= scales
+            scores[start:end] = block_scores
+        return scores
+
+    def _search_rows(self, embedding, k, filter):
+        """回傳：[(列, 距離)]，距離 = 1 - 餘弦相似度"""
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        rows = self._rows_for_filter(filter)
+        if rows is not None and not len(rows):
+            return []
+
+        scores = self._scores(query, rows)
+        k = min(k, len(scores))
+        if not k:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(position if rows is None else rows[position]), float(1.0 - scores[position])) for position in top]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        """
+        以向量做精確 top-k 搜尋
+
+        回傳：[(Document, 距離)]，距離 = 1 - 餘弦相似度（越小越相似，與 Chroma 一致）
+        """
+        return [(self._document(row), distance) for row, distance in self._search_rows(embedding, k, filter)]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self.embedding_function.embed_query(query), k, filter
+        )
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5,
+                                                filter=None, **kwargs):
+        """先取 fetch_k 個最相似的區塊，再以 MMR 挑出 k 個兼顧相關性與多樣性的區塊"""
+        candidates = self._search_rows(embedding, fetch_k, filter)
+        if not candidates:
+            return []
+
+        rows = np.asarray([row for row, _ in candidates])
+        vectors = self.vectors[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32), vectors, lambda_mult=lambda_mult, k=k
+        )
+        return [self._document(candidates[i][0]) for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding_function.embed_query(query), k, fetch_k, lambda_mult, filter
+        )
+
+    def _select_relevance_score_fn(self):
+        # 距離 = 1 - 餘弦相似度，轉回 0~1 的相關度
+        return lambda distance: 1.0 - distance
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, path=None, dtype="float16", ids=None, **kwargs):
+        """計算 embedding 並建立 mmap 向量資料庫"""
+        if path is None:
+            raise ValueError("需要指定 path")
+        texts = list(texts)
+        ids = ids or [str(i) for i in range(len(texts))]
+        vectors = embedding.embed_documents(texts)
+        write_mmap_store(path, ids, vectors, texts, metadatas or [{}] * len(texts), dtype=dtype)
+        return cls(path, embedding)
+
+
+def version_directory(path, index_version, dtype):
+    """索引版本、dtype 與格式版本對應的版本子目錄"""
+    version = re.sub(r"[^0-9A-Za-z_.-]", "_", str(index_version))
+    return os.path.join(path, f"v{version}-{dtype}-f{STORE_FORMAT}")
+
+
+def _prune_versions(path, keep):
+    """刪除較舊的版本目錄（只保留最近的 KEEP_VERSIONS 個與 keep）"""
+    versions = [
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.startswith("v") and os.path.exists(os.path.join(path, name, "info.json"))
+    ]
+    versions.sort(key=os.path.getmtime, reverse=True)
+    for version_path in versions[KEEP_VERSIONS:]:
+        if version_path != keep:
+            # 已被其他行程 mmap 的檔案在 POSIX 上刪除後仍可讀取；無法刪除時留待下次
+            shutil.rmtree(version_path, ignore_errors=True)
+
+
+def load_or_export_mmap_store(db, path, index_version=None, dtype="float16"):
+    """
+    開啟 mmap 向量資料庫；該索引版本尚未匯出時，從 Chroma 匯出到新的版本目錄
+    （直接使用 Chroma 中已計算的向量，不需要重新嵌入）
+    """
+    version_path = version_directory(path, index_version, dtype)
+    if os.path.exists(os.path.join(version_path, "info.json")):
+        return MmapVectorStore(version_path, db.embeddings)
+
+    print(f"🔨 從 Chroma 匯出 mmap 向量資料庫（{dtype}）...")
+    os.makedirs(path, exist_ok=True)
+    data = db.get(include=["embeddings", "documents", "metadatas"])
+    tmp_path = tempfile.mkdtemp(prefix=".export-", dir=path)
+    try:
+        write_mmap_store(
+            tmp_path,
+            data["ids"],
+            data["embeddings"],
+            data["documents"],
+            data["metadatas"],
+            dtype=dtype,
+            index_version=index_version
+        )
+        os.replace(tmp_path, version_path)
+    except OSError:
+        # 其他行程已先完成同一版本的匯出：使用已存在的版本
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.exists(os.path.join(version_path, "info.json")):
+            raise
+
+    _prune_versions(path, keep=version_path)
+    store = MmapVectorStore(version_path, db.embeddings)
+    print(f"✅ mmap 向量資料庫匯出完成：{store.rows} 列、{store.info['dimensions']} 維")
+    return store
@@ -0,0 +1,137 @@
+"""
+Cross-encoder 重新排序
+功能：向量檢索先多取幾倍的候選區塊，再以本地 CPU 的 cross-encoder 模型
+      逐一對 (問題, 區塊) 評分，只保留分數最高的 k 個區塊送進 prompt
+
+Cross-encoder 同時看到問題與區塊內容，排序比 embedding 相似度準確，
+前幾名更可靠後，可以減少送進 LLM 的區塊數量，縮短 prompt 與生成時間
+
+- (問題雜湊, 區塊 ID) 的分數存在 LRU 快取，重複的問題不必重新評分
+- 只有未快取的配對會送進模型，並以批次計算
+
+使用方式：
+    reranker = CrossEncoderReranker("BAAI/bge-reranker-base")
+    retriever = RerankingRetriever(
+        base_retriever=db.as_retriever(search_kwargs={"k": 12}),
+        reranker=reranker,
+        k=3
+    )
+    docs = retriever.invoke("如何設定 WiFi？")
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+DEFAULT_RERANKER_MODEL = "BAAI/bge-reranker-base"
+
+# 重新排序前，向量檢索多取的倍數
+DEFAULT_OVERFETCH = 4
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_key(doc):
+    """區塊的快取鍵：優先使用向量資料庫的 ID，沒有時以來源檔名與內容雜湊"""
+    if getattr(doc, "id", None):
+        return doc.id
+    return _sha256(f"{doc.metadata.get('filename', '')}\0{doc.page_content}")
+
+
+class CrossEncoderReranker:
+    """以 sentence-transformers 的 CrossEncoder 評分，並快取 (問題, 區塊) 的分數"""
+
+    def __init__(self, model_name=DEFAULT_RERANKER_MODEL, batch_size=16, max_length=512,
+                 max_cache_items=4096, device="cpu"):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.max_cache_items = max_cache_items
+        self.device = device
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.pairs_scored = 0
+
+    @property
+    def model(self):
+        """第一次使用時才載入模型，不影響系統啟動時間"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    print(f"📥 載入重新排序模型 {self.model_name}...")
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device=self.device)
+        return self._model
+
+    def score(self, query, docs):
+        """回傳每個區塊與問題的相關分數（越高越相關）"""
+        query_hash = _sha256(query.strip())
+        keys = [(query_hash, chunk_key(doc)) for doc in docs]
+
+        scores = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+            self.cache_hits += len(scores)
+
+        # 同一批中重複的區塊只評分一次
+        missing = {}
+        for key, doc in zip(keys, docs):
+            if key not in scores and key not in missing:
+                missing[key] = doc
+
+        if missing:
+            pairs = [(query, doc.page_content) for doc in missing.values()]
+            predicted = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+            with self._lock:
+                for key, value in zip(missing, predicted):
+                    scores[key] = float(value)
+                    self._scores[key] = float(value)
+                while len(self._scores) > self.max_cache_items:
+                    self._scores.popitem(last=False)
+                self.pairs_scored += len(pairs)
+
+        return [scores[key] for key in keys]
+
+    def rerank(self, query, docs, k):
+        """依 cross-encoder 分數排序，回傳前 k 個 (Document, 分數)"""
+        if not docs:
+            return []
+        ranked = sorted(zip(docs, self.score(query, docs)), key=lambda item: item[1], reverse=True)
+        return ranked[:k]
+
+    def stats(self):
+        """回傳快取統計"""
+        with self._lock:
+            total = self.cache_hits + self.pairs_scored
+            return {
+                "cache_hits": self.cache_hits,
+                "pairs_scored": self.pairs_scored,
+                "cached_pairs": len(self._scores),
+                "hit_rate": self.cache_hits / total if total else 0.0
+            }
+
+
+class RerankingRetriever(BaseRetriever):
+    """先以 base_retriever 取得候選區塊，再以 cross-encoder 重新排序並保留前 k 個"""
+
+    base_retriever: Any
+    reranker: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        candidates = self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return [doc for doc, _ in self.reranker.rerank(query, candidates, self.k)]
@@ -0,0 +1,193 @@
+"""
+分片向量資料庫
+功能：依 metadata（例如 source_name）把文檔區塊分到不同的 Chroma collection，
+      有過濾條件的查詢直接送到對應的 shard，沒有過濾條件的查詢平行送到所有 shard
+      再依距離合併結果
+
+共用一個大型 collection 時，metadata 過濾仍需在整個 HNSW 索引上搜尋，
+語料庫越大效能越差；分片後每次過濾查詢只搜尋該文檔自己的索引
+
+使用方式：
+    # 每個文檔一個 shard；傳入 shard_of 可自訂分片方式（例如依文檔組合）
+    db = ShardedVectorStore(persist_directory="./db_shards", embedding_function=embeddings)
+    db.add_documents(docs)
+    db.similarity_search_by_vector(query_vector, k=3, filter={"source_name": "洗衣機使用說明"})
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SHARD_REGISTRY_FILENAME = "shards.json"
+
+
+def collection_name_for(shard_name):
+    """Chroma collection 名稱只能使用英數字，以雜湊值命名"""
+    return "shard-" + hashlib.md5(shard_name.encode("utf-8")).hexdigest()[:16]
+
+
+class ShardedVectorStore:
+    """以 shard_key 分片的向量資料庫，提供與 Chroma 相同的常用查詢介面"""
+
+    def __init__(self, persist_directory, embedding_function, shard_of=None, shard_key="source_name",
+                 max_workers=8):
+        """
+        參數：
+            persist_directory: 持久化目錄
+            embedding_function: embedding 模型
+            shard_of: 函數 (shard_key 的值) -> shard 名稱，預設每個值一個 shard
+            shard_key: 用來分片的 metadata 欄位
+            max_workers: 平行查詢 shard 的執行緒數量
+        """
+        import chromadb
+
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.shard_key = shard_key
+        # 每個值一個 shard 時，查詢該 shard 不需要再過濾 shard_key
+        self.one_value_per_shard = shard_of is None
+        self.shard_of = shard_of or (lambda value: value)
+
+        os.makedirs(persist_directory, exist_ok=True)
+        self._client = chromadb.PersistentClient(path=persist_directory)
+        self._shards = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-search")
+
+        # 載入已存在的 shard
+        for shard_name in self._load_registry():
+            self._open_shard(shard_name)
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @property
+    def shard_names(self):
+        return list(self._shards)
+
+    def _registry_path(self):
+        return os.path.join(self.persist_directory, SHARD_REGISTRY_FILENAME)
+
+    def _load_registry(self):
+        if not os.path.exists(self._registry_path()):
+            return []
+        with open(self._registry_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_registry(self):
+        with open(self._registry_path(), "w", encoding="utf-8") as f:
+            json.dump(list(self._shards), f, ensure_ascii=False, indent=2)
+
+    def _open_shard(self, shard_name):
+        """開啟（或建立）shard 對應的 collection"""
+        from langchain_community.vectorstores import Chroma
+
+        with self._lock:
+            if shard_name not in self._shards:
+                self._shards[shard_name] = Chroma(
+                    client=self._client,
+                    collection_name=collection_name_for(shard_name),
+                    embedding_function=self.embedding_function
+                )
+                self._save_registry()
+            return self._shards[shard_name]
+
+    def add_documents(self, documents, ids=None):
+        """依 shard_key 將區塊寫入各自的 shard"""
+        ids = ids if ids is not None else [None] * len(documents)
+        grouped = {}
+        for doc, doc_id in zip(documents, ids):
+            shard_name = self.shard_of(doc.metadata.get(self.shard_key))
+            grouped.setdefault(shard_name, ([], []))
+            grouped[shard_name][0].append(doc)
+            grouped[shard_name][1].append(doc_id)
+
+        written_ids = []
+        for shard_name, (docs, doc_ids) in grouped.items():
+            shard = self._open_shard(shard_name)
+            if any(doc_id is None for doc_id in doc_ids):
+                written_ids.extend(shard.add_documents(docs))
+            else:
+                written_ids.extend(shard.add_documents(docs, ids=doc_ids))
+        return written_ids
+
+    def delete(self, ids):
+        """從所有 shard 刪除指定 ID（不存在的 ID 會被忽略）"""
+        for shard in list(self._shards.values()):
+            shard.delete(ids=ids)
+
+    def get(self, include=None):
+        """取得所有 shard 的區塊 ID"""
+        all_ids = []
+        for shard in list(self._shards.values()):
+            all_ids.extend(shard.get(include=include or [])["ids"])
+        return {"ids": all_ids}
+
+    def route(self, filter=None):
+        """
+        依過濾條件決定要查詢的 shard
+
+        回傳：[(shard, 傳給該 shard 的過濾條件)]
+        """
+        value = (filter or {}).get(self.shard_key)
+
+        if value is None:
+            # 沒有指定 shard_key：平行查詢所有 shard
+            return [(shard, filter or None) for shard in self._shards.values()]
+
+        values = value["$in"] if isinstance(value, dict) and "$in" in value else [value]
+        targets = {}
+        for v in values:
+            shard_name = self.shard_of(v)
+            if shard_name in self._shards:
+                targets.setdefault(shard_name, []).append(v)
+
+        routes = []
+        for shard_name, shard_values in targets.items():
+            shard_filter = {key: v for key, v in filter.items() if key != self.shard_key}
+            if not self.one_value_per_shard:
+                # 同一個 shard 有多個值（例如依組合分片），仍需過濾
+                shard_filter[self.shard_key] = (
+                    shard_values[0] if len(shard_values) == 1 else {"$in": shard_values}
+                )
+            routes.append((self._shards[shard_name], self._combine_filter(shard_filter)))
+        return routes
+
+    @staticmethod
+    def _combine_filter(conditions):
+        """Chroma 的 where 只接受單一欄位，多個欄位需以 $and 組合"""
+        if not conditions:
+            return None
+        if len(conditions) == 1:
+            return conditions
+        return {"$and": [{key: value} for key, value in conditions.items()]}
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None):
+        """以向量查詢對應的 shard，依距離（越小越相似）合併結果"""
+        routes = self.route(filter)
+        if not routes:
+            return []
+
+        def search(route):
+            shard, shard_filter = route
+            return shard.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter=shard_filter
+            )
+
+        if len(routes) == 1:
+            merged = search(routes[0])
+        else:
+            merged = [item for results in self._executor.map(search, routes) for item in results]
+        merged.sort(key=lambda item: item[1])
+        return merged[:k]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        """以向量查詢，回傳 Document 列表"""
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def similarity_search(self, query, k=4, filter=None):
+        """以文字查詢（只嵌入一次，再送到各 shard）"""
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k, filter)
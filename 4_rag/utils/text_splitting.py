@@ -0,0 +1,53 @@
+"""
+工作行程使用的檔案讀取與分割函數
+功能：匯入管線的工作行程只需要載入與分割檔案，本模組只依賴標準函式庫，
+      LangChain 的載入器與分割器在函數內才匯入
+
+工作行程以本模組作為主模組啟動（見 utils/ingestion.py 的 create_executor），
+不會重新匯入 Gradio 應用程式或其他主程式
+
+使用方式：
+    from functools import partial
+    from utils.text_splitting import load_and_split_source_file
+
+    split_file = partial(load_and_split_source_file, splitter_config=SPLITTER_CONFIG)
+    sync_vector_store(db, db_path, sources, split_file, SPLITTER_CONFIG)
+"""
+
+
+def load_and_split_text_file(file_path, metadata, splitter_config, structure_metadata=False):
+    """
+    載入單一 .txt 檔案、加上 metadata 並分割成文檔區塊
+
+    structure_metadata=True 時，每個區塊另外加上章節標題與在文檔中的位置
+    （見 utils/metadata_index.py）
+    """
+    from langchain_community.document_loaders import TextLoader
+    from langchain_text_splitters import CharacterTextSplitter
+
+    documents = TextLoader(file_path, encoding="utf-8").load()
+    for doc in documents:
+        doc.metadata.update(metadata)
+
+    text_splitter = CharacterTextSplitter(**splitter_config)
+    if not structure_metadata:
+        return text_splitter.split_documents(documents)
+
+    from utils.metadata_index import add_structure_metadata
+
+    chunks = []
+    for doc in documents:
+        chunks.extend(add_structure_metadata(doc.page_content, text_splitter.split_documents([doc])))
+    return chunks
+
+
+def load_and_split_source_file(file_path, doc_name, filename, splitter_config,
+                               extra_metadata=None, structure_metadata=False):
+    """
+    載入並分割單一來源檔案，metadata 為 source_name / filename 加上 extra_metadata
+
+    參數順序與增量索引的 split_file (檔案路徑, 文檔名稱, 檔名) 相同，可用
+    functools.partial(load_and_split_source_file, splitter_config=...) 傳給 sync_vector_store
+    """
+    metadata = {"source_name": doc_name, "filename": filename, **(extra_metadata or {})}
+    return load_and_split_text_file(file_path, metadata, splitter_config, structure_metadata=structure_metadata)
@@ -0,0 +1,141 @@
+"""
+共用的向量資料庫註冊表
+功能：以 (持久化目錄, embedding 模型) 為鍵，每個行程只開啟一次 Chroma 向量資料庫，
+      第一次取用時才開啟（不在匯入模組時開啟），並檢查資料庫中已存的向量維度
+      與目前設定的 embedding 模型輸出維度是否一致
+
+開啟 Chroma 會把 HNSW 索引載入記憶體，同一個目錄開啟兩次會使啟動時間與峰值記憶體加倍；
+維度不一致（例如以 768 維的模型建立、卻以 1536 維的模型查詢）時在開啟時就明確報錯，
+而不是在第一次查詢時才失敗
+
+模型的輸出維度不呼叫 embedding API 取得（OpenAI 的每次呼叫都要計費）：
+依序使用 RAG_EMBEDDING_DIMENSIONS、模型物件的 dimensions 設定、本地模型回報的維度、已知模型的維度表，
+都無法取得時略過檢查
+
+使用方式：
+    from utils.vectorstore_registry import get_shared_vectorstore
+
+    db = get_shared_vectorstore("./db/chroma_db", embeddings)         # 第一次呼叫時開啟
+    same_db = get_shared_vectorstore("./db/chroma_db", embeddings)    # 回傳同一個物件
+"""
+
+import os
+import threading
+
+_stores = {}
+_open_locks = {}
+_registry_lock = threading.Lock()
+_dimensions = {}
+
+# 常用模型的輸出維度
+KNOWN_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+    "jinaai/jina-embeddings-v2-base-zh": 768,
+}
+
+
+def embedding_model_name(embeddings):
+    """取得 embedding 模型名稱（CachedEmbeddings / HuggingFaceEmbeddings 的 model_name，OpenAIEmbeddings 的 model）"""
+    return getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+def _configured_dimension(embeddings, model_name):
+    """不呼叫 embedding API 取得輸出維度；無法取得時回傳 None"""
+    if os.getenv("RAG_EMBEDDING_DIMENSIONS"):
+        return int(os.getenv("RAG_EMBEDDING_DIMENSIONS"))
+
+    # 快取與微批次包裝器以 .embeddings 包住實際的模型
+    model = embeddings
+    while model is not None:
+        if getattr(model, "dimensions", None):
+            return int(model.dimensions)
+        # HuggingFaceEmbeddings 的 SentenceTransformer 在本地回報維度
+        get_dimension = getattr(getattr(model, "client", None), "get_sentence_embedding_dimension", None)
+        dimension = get_dimension() if callable(get_dimension) else None
+        if dimension:
+            return int(dimension)
+        model = getattr(model, "embeddings", None)
+
+    return KNOWN_DIMENSIONS.get(model_name)
+
+
+def embedding_dimension(embeddings, model_name=None):
+    """目前 embedding 模型的輸出維度（每個模型只取得一次）；無法取得時回傳 None"""
+    model_name = model_name or embedding_model_name(embeddings)
+    with _registry_lock:
+        if model_name not in _dimensions:
+            _dimensions[model_name] = _configured_dimension(embeddings, model_name)
+        return _dimensions[model_name]
+
+
+def stored_dimension(db):
+    """向量資料庫中已存向量的維度；資料庫為空時回傳 None"""
+    result = db.get(limit=1, include=["embeddings"])
+    vectors = result.get("embeddings")
+    if vectors is None or len(vectors) == 0:
+        return None
+    return len(vectors[0])
+
+
+def validate_dimension(db, embeddings, persist_directory, model_name=None):
+    """資料庫中的向量維度與 embedding 模型不一致時拋出 ValueError"""
+    stored = stored_dimension(db)
+    if stored is None:
+        return
+    model_name = model_name or embedding_model_name(embeddings)
+    expected = embedding_dimension(embeddings, model_name)
+    if expected is None:
+        print(f"⚠️ 無法取得 {model_name} 的輸出維度，略過維度檢查（可設定 RAG_EMBEDDING_DIMENSIONS）")
+        return
+    if stored != expected:
+        raise ValueError(
+            f"向量資料庫 {persist_directory} 的向量為 {stored} 維，"
+            f"但 embedding 模型 {model_name} 輸出 {expected} 維；請使用建立資料庫時的模型或重建資料庫"
+        )
+
+
+def get_shared_vectorstore(persist_directory, embeddings, model_name=None, must_exist=False, validate=True):
+    """
+    取得共用的 Chroma 向量資料庫（同一個目錄與模型在每個行程中只開啟一次）
+
+    參數：
+        persist_directory: Chroma 持久化目錄
+        embeddings: embedding 模型
+        model_name: 註冊表使用的模型名稱（預設從 embeddings 取得）
+        must_exist: 目錄不存在時拋出 FileNotFoundError，而不是建立新的資料庫
+        validate: 第一次開啟時檢查向量維度
+    """
+    path = os.path.realpath(persist_directory)
+    model_name = model_name or embedding_model_name(embeddings)
+    key = (path, model_name)
+
+    with _registry_lock:
+        if key in _stores:
+            return _stores[key]
+        open_lock = _open_locks.setdefault(key, threading.Lock())
+
+    # 每個鍵各自加鎖：同時請求同一個資料庫時只開啟一次，不同資料庫可以同時開啟
+    with open_lock:
+        if key in _stores:
+            return _stores[key]
+        if must_exist and not os.path.exists(path):
+            raise FileNotFoundError(f"目錄 {persist_directory} 不存在。請檢查路徑。")
+
+        from langchain_community.vectorstores import Chroma
+
+        print(f"📂 開啟向量資料庫 {path}（{model_name}）")
+        db = Chroma(persist_directory=path, embedding_function=embeddings)
+        if validate:
+            validate_dimension(db, embeddings, persist_directory, model_name)
+
+        with _registry_lock:
+            _stores[key] = db
+        return db
+
+
+def registered_stores():
+    """目前已開啟的向量資料庫 [(目錄, 模型名稱)]"""
+    with _registry_lock:
+        return list(_stores)
@@ -1,30 +1,36 @@
+import argparse
 import os
+import sys
+import time
 
 from dotenv import load_dotenv
 from langchain import hub
 from langchain.agents import AgentExecutor, create_react_agent
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_community.vectorstores import Chroma
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.tools import Tool
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
+# 共用 4_rag/utils 的工具模組
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "..", "..", "4_rag"))
+
+from utils.agent_tools import LLMCallCounter, create_rag_tool
+from utils.chat_history import TokenBudgetHistory
+from utils.contextualize import QuestionContextualizer
+from utils.vectorstore_registry import get_shared_vectorstore
+
 # 從 .env 檔案載入環境變數
 load_dotenv()
 
 # 載入現有的 Chroma 向量資料庫
-current_dir = os.path.dirname(os.path.abspath(__file__))
 db_dir = os.path.join(current_dir, "..", "..", "4_rag", "db")
 persistent_directory = os.path.join(db_dir, "chroma_db_with_metadata")
 
 # 檢查 Chroma 向量資料庫是否已存在
-if os.path.exists(persistent_directory):
-    print("載入現有向量資料庫...")
-    db = Chroma(persist_directory=persistent_directory,
-                embedding_function=None)
-else:
+if not os.path.exists(persistent_directory):
     raise FileNotFoundError(
         f"目錄 {persistent_directory} 不存在。請檢查路徑。"
     )
@@ -32,20 +38,31 @@ else:
 # 定義嵌入模型
 embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
 
-# 使用嵌入函數載入現有的向量資料庫
-db = Chroma(persist_directory=persistent_directory,
-            embedding_function=embeddings)
 
-# 建立用於查詢向量資料庫的檢索器
-# `search_type` 指定搜尋類型（例如：相似度）
-# `search_kwargs` 包含搜尋的額外參數（例如：返回結果的數量）
-retriever = db.as_retriever(
-    search_type="similarity",
-    search_kwargs={"k": 3},
-)
+def retrieve(question):
+    """檢索相關文檔；向量資料庫在第一次檢索時才從共用註冊表開啟（每個行程只開啟一次）"""
+    db = get_shared_vectorstore(persistent_directory, embeddings, must_exist=True)
+    # `search_type` 指定搜尋類型（例如：相似度）
+    # `search_kwargs` 包含搜尋的額外參數（例如：返回結果的數量）
+    retriever = db.as_retriever(
+        search_type="similarity",
+        search_kwargs={"k": 3},
+    )
+    return retriever.invoke(question)
 
-# 建立 ChatOpenAI 模型
-llm = ChatOpenAI(model="gpt-4o")
+
+# 建立 ChatOpenAI 模型（掛上 LLM 呼叫計數器，統計每個問題實際的 LLM 往返次數）
+llm_counter = LLMCallCounter()
+llm = ChatOpenAI(model="gpt-4o", callbacks=[llm_counter])
+# 問題改寫使用的模型：兩種工具模式在檢索前都可能改寫問題，同樣掛上計數器，
+# 比較工具模式時改寫的 LLM 呼叫也會被算進去
+rewrite_llm = ChatOpenAI(model="gpt-4o", callbacks=[llm_counter])
+
+# 比較工具模式時使用的預設問題
+DEFAULT_COMPARE_QUESTIONS = [
+    "押金什麼時候會退還？",
+    "洗衣機出現錯誤代碼 E03 該怎麼處理？",
+]
 
 # 上下文化問題的 prompt
 # 這個系統 prompt 幫助 AI 理解它應該根據聊天歷史重新表述問題
@@ -67,10 +84,10 @@ contextualize_q_prompt = ChatPromptTemplate.from_messages(
 )
 
 # 建立具有歷史意識的檢索器
-# 這使用 LLM 來幫助根據聊天歷史重新表述問題
-history_aware_retriever = create_history_aware_retriever(
-    llm, retriever, contextualize_q_prompt
-)
+# 先以本地規則判斷是否需要改寫（沒有歷史、問題本身已完整時不呼叫 LLM），
+# 需要時才使用 LLM 根據聊天歷史重新表述問題，改寫結果會被快取
+contextualizer = QuestionContextualizer(contextualize_q_prompt | rewrite_llm | StrOutputParser())
+history_aware_retriever = RunnableLambda(contextualizer.contextualize) | RunnableLambda(retrieve)
 
 # 回答問題的 prompt
 # 這個系統 prompt 幫助 AI 理解它應該根據檢索到的上下文提供簡潔的答案
@@ -100,41 +117,130 @@ question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
 rag_chain = create_retrieval_chain(
     history_aware_retriever, question_answer_chain)
 
+# 聊天歷史管理：最近的對話保留原文，超出 token 預算的較舊對話在背景併入摘要
+# 問題改寫與問答 prompt 只會收到「摘要 + 最近對話」的精簡版本
+summarize_prompt = ChatPromptTemplate.from_template(
+    "請將以下新的對話內容併入既有的對話摘要，保留使用者關心的主題、已知的事實與尚未解決的問題，"
+    "只輸出更新後的摘要，不超過 200 字。\n\n"
+    "既有摘要：\n{summary}\n\n"
+    "新的對話：\n{new_lines}"
+)
+# 背景摘要使用不掛計數器的獨立模型，避免摘要呼叫被算進 Agent 的 LLM 往返次數
+summary_llm = ChatOpenAI(model="gpt-4o")
+chat_history = TokenBudgetHistory(
+    summarize_prompt | summary_llm | StrOutputParser(),
+    max_tokens=int(os.getenv("RAG_CHAT_HISTORY_TOKENS", "1500")),
+)
+
+
+# 工具模式（每個工具可各自設定）：
+#   answer   - 工具內部執行完整的 rag_chain（問題改寫 + 生成答案），每次使用工具多兩次 LLM 呼叫
+#   passages - 工具只回傳去重、截短後的檢索段落，由外層 Agent 一次整合回答（預設）
+TOOL_MODES = {
+    "Answer Question": os.getenv("RAG_TOOL_MODE", "passages"),
+}
+
 
-# 設定具有文檔存儲檢索器的 ReAct Agent
-# 載入 ReAct Docstore Prompt
-react_docstore_prompt = hub.pull("hwchase17/react")
+def answer_with_rag_chain(query):
+    return rag_chain.invoke({"input": query, "chat_history": chat_history.messages()})["answer"]
 
-tools = [
-    Tool(
-        name="Answer Question",
-        func=lambda input, **kwargs: rag_chain.invoke(
-            {"input": input, "chat_history": kwargs.get("chat_history", [])}
-        ),
-        description="當你需要回答有關上下文的問題時使用",
+
+def retrieve_with_history(query):
+    return history_aware_retriever.invoke({"input": query, "chat_history": chat_history.messages()})
+
+
+_react_prompt = None
+
+
+def get_react_prompt():
+    """第一次建立 Agent 時才從 LangChain Hub 下載 ReAct Prompt（匯入模組時不需要網路）"""
+    global _react_prompt
+    if _react_prompt is None:
+        _react_prompt = hub.pull("hwchase17/react")
+    return _react_prompt
+
+
+def build_agent_executor(tool_modes, verbose=True):
+    """依各工具的模式建立 Agent"""
+    tools = [
+        create_rag_tool(
+            name="Answer Question",
+            description="當你需要回答有關上下文的問題時使用",
+            mode=tool_modes["Answer Question"],
+            rag_chain=answer_with_rag_chain,
+            retrieve=retrieve_with_history,
+        )
+    ]
+
+    # 建立具有文檔存儲檢索器的 ReAct Agent
+    agent = create_react_agent(
+        llm=llm,
+        tools=tools,
+        prompt=get_react_prompt(),
     )
-]
 
-# 建立具有文檔存儲檢索器的 ReAct Agent
-agent = create_react_agent(
-    llm=llm,
-    tools=tools,
-    prompt=react_docstore_prompt,
-)
+    return AgentExecutor.from_agent_and_tools(
+        agent=agent, tools=tools, handle_parsing_errors=True, verbose=verbose,
+    )
 
-agent_executor = AgentExecutor.from_agent_and_tools(
-    agent=agent, tools=tools, handle_parsing_errors=True, verbose=True,
-)
 
-chat_history = []
-while True:
-    query = input("你: ")
-    if query.lower() == "exit":
-        break
-    response = agent_executor.invoke(
-        {"input": query, "chat_history": chat_history})
-    print(f"AI: {response['output']}")
-
-    # 更新歷史
-    chat_history.append(HumanMessage(content=query))
-    chat_history.append(AIMessage(content=response["output"]))
+def compare_tool_modes(questions):
+    """以相同問題分別測試兩種工具模式，輸出每個問題的 LLM 呼叫次數與延遲"""
+    results = []
+    for mode in ("answer", "passages"):
+        agent_executor = build_agent_executor({name: mode for name in TOOL_MODES}, verbose=False)
+        for question in questions:
+            llm_counter.reset()
+            rewrites_before = contextualizer.stats()["llm_calls"]
+            started = time.perf_counter()
+            response = agent_executor.invoke({"input": question, "chat_history": []})
+            elapsed = time.perf_counter() - started
+            stats = dict(llm_counter.stats(), rewrites=contextualizer.stats()["llm_calls"] - rewrites_before)
+            results.append((mode, question, stats, elapsed, response["output"]))
+
+    # LLM 呼叫包含 Agent 推理、工具內的問答與問題改寫；「其中改寫」列出問題改寫佔的次數
+    print(f"\n{'模式':<10}{'LLM 呼叫':>10}{'其中改寫':>10}{'LLM 秒數':>10}{'總秒數':>10}  問題")
+    for mode, question, stats, elapsed, _ in results:
+        print(
+            f"{mode:<10}{stats['llm_calls']:>10}{stats['rewrites']:>10}"
+            f"{stats['llm_seconds']:>10.2f}{elapsed:>10.2f}  {question}"
+        )
+    for mode in ("answer", "passages"):
+        rows = [(stats, elapsed) for m, _, stats, elapsed, _ in results if m == mode]
+        print(
+            f"{mode} 平均：{sum(stats['llm_calls'] for stats, _ in rows) / len(rows):.1f} 次 LLM 呼叫、"
+            f"{sum(elapsed for _, elapsed in rows) / len(rows):.2f} 秒"
+        )
+
+
+def chat():
+    agent_executor = build_agent_executor(TOOL_MODES)
+    while True:
+        query = input("你: ")
+        if query.lower() == "exit":
+            print(f"問題改寫統計：{contextualizer.stats()}")
+            print(f"聊天歷史統計：{chat_history.stats()}")
+            chat_history.close()
+            break
+        llm_counter.reset()
+        response = agent_executor.invoke(
+            {"input": query, "chat_history": chat_history.messages()})
+        print(f"AI: {response['output']}")
+        print(f"（LLM 呼叫 {llm_counter.stats()['llm_calls']} 次）")
+
+        # 更新歷史（超出預算的較舊對話在背景摘要，不阻塞下一輪）
+        chat_history.add_turn(query, response["output"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="具有文檔存儲檢索器的 ReAct Agent")
+    parser.add_argument(
+        "--compare", nargs="*", metavar="問題",
+        help="比較 answer 與 passages 工具模式的 LLM 呼叫次數與延遲（未指定問題時使用預設問題）",
+    )
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare_tool_modes(args.compare or DEFAULT_COMPARE_QUESTIONS)
+    else:
+        chat()